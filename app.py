@@ -1,28 +1,187 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Request
-from fastapi.responses import HTMLResponse, FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Request, BackgroundTasks
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+import asyncio
 import base64
+import functools
+import hmac
 import io
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+import json
+import multiprocessing
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageOps
 import httpx
 import os
 from typing import Optional
-import numpy as np
 from dotenv import load_dotenv
-import fal_client
+import image_kernels
+import background_removal
+import bulk_edit
+import recolor
+import upscale
+import plates
+import profiler
+import tracing
+from asset_store import AssetStore
+from video_processing import VideoStore, RENDITIONS
+from fal_jobs import FalQueueClient, FalStorage, VideoJobs
+from static_assets import StaticAssets
+from json_stream import Base64Field, StreamedJSONResponse, encode_image
+from prompts import COLOR_PROMPTS, SCENE_PROMPTS, STYLE_MODIFIERS, CATEGORY_PROMPTS, ANIMATION_STYLES
+from upstream import ModalUpstream, CircuitOpenError, Prewarmer
+from scheduler import GpuScheduler, PRIORITIES
+from singleflight import SingleFlight, request_key
+from cancellation import CancellationTracker, RequestCancelled
 
 # Load environment variables
 load_dotenv()
 
 app = FastAPI(title="Make3D Studio", description="Transform ideas into 3D models")
 
+# Server-Timing on every response, sampled traces in TRACE_LOG
+app.add_middleware(tracing.TracingMiddleware)
+
+# Bearer token for /api/admin endpoints and X-Profile requests; unset
+# disables both
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+def is_admin(headers) -> bool:
+    """Whether the request carries the admin token (Authorization: Bearer or X-Admin-Token)"""
+    if not ADMIN_TOKEN:
+        return False
+    provided = headers.get("x-admin-token") or headers.get("authorization", "").removeprefix("Bearer ")
+    return hmac.compare_digest(provided.encode(), ADMIN_TOKEN.encode())
+
+def require_admin(http_request: Request) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_admin(http_request.headers):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+# Requests sent with X-Profile and the admin token are profiled in this worker
+app.add_middleware(profiler.ProfilingMiddleware, authorize=is_admin)
+
 # Templates
 templates = Jinja2Templates(directory="templates")
 
-# Static files
-app.mount("/frontend", StaticFiles(directory="frontend"), name="frontend")
+# Static files, fingerprinted and precompressed in memory at startup
+static_assets = StaticAssets("frontend", url_prefix="/frontend")
+
+# Generated images and their thumbnail/preview derivatives
+asset_store = AssetStore()
+
+# Generated videos with their poster, preview and web renditions
+video_store = VideoStore()
+
+# Kling jobs submitted to the FAL queue, completed by webhook
+video_jobs = VideoJobs(FalQueueClient(), video_store)
+
+# Animation source images, uploaded to FAL once per content hash
+fal_storage = FalStorage()
+
+# Scene/style background plates for composited lifestyle mockups
+plate_library = plates.PlateLibrary()
+
+# Steps of the optional FLUX pass that blends a composite into its plate
+HARMONIZE_STEPS = int(os.getenv("LIFESTYLE_HARMONIZE_STEPS", "8"))
+
+# Multi-style animation batches: outstanding jobs per batch, and the most
+# seconds of video (Kling is billed per second) and variants one batch may request
+BATCH_CONCURRENCY = int(os.getenv("FAL_BATCH_CONCURRENCY", "5"))
+BATCH_MAX_SECONDS = float(os.getenv("FAL_BATCH_MAX_SECONDS", "50"))
+BATCH_MAX_VARIANTS = int(os.getenv("FAL_BATCH_MAX_VARIANTS", "10"))
+
+# Seconds /api/generate-video waits for its job before giving up
+VIDEO_WAIT_TIMEOUT = 600.0
+
+# Image processes per worker for bulk edits and upscaling; 0 = one per core
+BULK_EDIT_PROCESSES = int(os.getenv("BULK_EDIT_PROCESSES", "0")) or (os.cpu_count() or 1)
+
+# Shared client for all calls to the Modal FLUX.1-Kontext service
+modal_upstream = ModalUpstream(
+    os.getenv("MODAL_FLUX_URL", "https://gpudashboard0--flux-kontext-web-app.modal.run")
+)
+
+# Starts the GPU container ahead of the first edit when the studio is in use
+upstream_warmer = Prewarmer(modal_upstream)
+
+# Fair, priority-aware admission for GPU-bound calls
+gpu_scheduler = GpuScheduler()
+
+# Identical /api/generate requests in flight share one upstream call
+generate_flight = SingleFlight()
+
+# Abandoned generations (client gone, superseded by a newer edit) are
+# cancelled, on the GPU too
+cancellations = CancellationTracker()
+
+@app.on_event("shutdown")
+async def close_upstream():
+    await modal_upstream.aclose()
+    if _image_pool is not None and _image_pool_pid == os.getpid():
+        _image_pool.shutdown(wait=False, cancel_futures=True)
+
+def client_key(http_request: Request) -> str:
+    """Identify the caller for fair queueing: X-Client-Id header, else peer address"""
+    client_id = http_request.headers.get("x-client-id")
+    if client_id:
+        return client_id[:64]
+    return http_request.client.host if http_request.client else "anonymous"
+
+async def generate_on_gpu(payload: dict, http_request: Request, priority: str) -> httpx.Response:
+    """
+    Send one FLUX generation through the GPU scheduler
+    
+    Callers may lower their priority with an X-Priority header (e.g. catalog
+    jobs sending "bulk") but never raise it above the endpoint's default.
+    Cancelling the caller cancels the job on the GPU. The queue wait, the
+    upstream call and the stages FluxKontext reports in its Server-Timing
+    header are recorded as spans of the current trace.
+    """
+    requested = http_request.headers.get("x-priority")
+    if requested in PRIORITIES and PRIORITIES.index(requested) > PRIORITIES.index(priority):
+        priority = requested
+    
+    # The job id lets FluxKontext stop between denoising steps if the
+    # caller is cancelled (client gone, request superseded)
+    job_id = uuid.uuid4().hex
+    call = None
+    try:
+        started = time.perf_counter()
+        async with gpu_scheduler.slot(client_key(http_request), priority) as held:
+            tracing.add("queue", time.perf_counter() - started)
+            started = time.perf_counter()
+            call = asyncio.ensure_future(modal_upstream.post("/generate", {**payload, "job_id": job_id}))
+            try:
+                response = await asyncio.shield(call)
+                elapsed = time.perf_counter() - started
+                tracing.add("upstream", elapsed)
+                
+                # Break the hop down into web_app's and the GPU container's
+                # own stages, and the network in between
+                remote = tracing.parse_server_timing(response.headers.get("server-timing"))
+                for name, seconds in remote.items():
+                    tracing.add(name, seconds)
+                if "webapp" in remote:
+                    tracing.add("network", max(0.0, elapsed - remote["webapp"]))
+                return response
+            except asyncio.CancelledError:
+                # The GPU stays busy until the job sees its flag, so the
+                # slot is only freed once the call has wound down
+                held.hand_over(cancellations.abandon(
+                    job_id, call, modal_upstream.cancel, payload.get("num_inference_steps", 28)
+                ))
+                raise
+    except asyncio.CancelledError:
+        if call is None:
+            # Still queued for a slot, no GPU time spent
+            cancellations.counters["cancelled_queued"] += 1
+        raise
 
 class GenerateRequest(BaseModel):
     prompt: str
@@ -36,18 +195,41 @@ class BasicEditRequest(BaseModel):
     image_base64: str
     operation: str
 
+class RemoveBackgroundRequest(BasicEditRequest):
+    mode: str = "ai"  # "ai" (rembg), "matting" (low-res rembg) or "fast" (OpenCV)
+
+class AdjustImageRequest(BasicEditRequest):
+    brightness: float = Field(1.3, ge=0, le=10)  # 1.0 = unchanged
+    contrast: float = Field(1.2, ge=0, le=10)
+    saturation: float = Field(1.1, ge=0, le=10)
+
+class EnhanceImageRequest(BasicEditRequest):
+    unsharp_radius: float = Field(1.0, ge=0, le=50)  # 0 disables the unsharp mask
+    unsharp_percent: int = Field(150, ge=0, le=1000)
+    unsharp_threshold: int = Field(3, ge=0, le=255)
+    blur_radius: float = Field(0.5, ge=0, le=50)  # Noise smoothing before sharpening, 0 disables
+    sharpness: float = Field(1.2, ge=0, le=10)
+
 @app.get("/", response_class=HTMLResponse)
-async def homepage():
+async def homepage(request: Request):
     """Direct to Make3D Studio editor"""
-    return FileResponse("frontend/index.html")
+    upstream_warmer.note_activity()
+    return static_assets.page_response("index", request.headers)
+
+@app.get("/frontend/{path:path}")
+async def frontend_asset(path: str, request: Request):
+    """Studio scripts and styles, by plain or fingerprinted name"""
+    response = static_assets.response(path, request.headers)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return response
 
 @app.get("/old", response_class=HTMLResponse)
 async def old_editor():
     """Old editor for comparison"""
     return FileResponse("static/modern_editor_fixed.html")
 
-@app.get("/home", response_class=HTMLResponse)
-async def marketing_page():
+def render_marketing_page() -> str:
     """Marketing homepage with integrated workflow"""
     return """
     <!DOCTYPE html>
@@ -322,6 +504,9 @@ async def marketing_page():
                     return;
                 }
 
+                // Start the GPU container while the user writes a prompt
+                navigator.sendBeacon('/api/prewarm');
+
                 const reader = new FileReader();
                 reader.onload = (e) => {
                     currentImage = e.target.result.split(',')[1]; // Remove data URL prefix
@@ -354,7 +539,7 @@ async def marketing_page():
                 `;
 
                 try {
-                    const response = await fetch('/api/generate', {
+                    const response = await fetch('/api/generate?inline=true', {
                         method: 'POST',
                         headers: {
                             'Content-Type': 'application/json',
@@ -422,45 +607,78 @@ async def marketing_page():
     </html>
     """
 
+# Entry pages are rendered once; their script/style URLs are fingerprinted
+with open("frontend/index.html") as index_file:
+    static_assets.add_page("index", index_file.read())
+static_assets.add_page("home", render_marketing_page())
+
+@app.get("/home", response_class=HTMLResponse)
+async def marketing_page(request: Request):
+    """Marketing homepage with integrated workflow"""
+    return static_assets.page_response("home", request.headers)
+
 @app.post("/api/generate")
-async def generate_image(request: GenerateRequest):
-    """Generate or edit image with FLUX.1-Kontext via Modal"""
+async def generate_image(request: GenerateRequest, http_request: Request, inline: bool = False):
+    """
+    Generate or edit image with FLUX.1-Kontext via Modal
+    
+    The result is returned as asset derivative URLs, with the image itself
+    only for ?inline=true. FLUX runs at no more than FLUX_NATIVE_RESOLUTION² pixels. Larger
+    text-to-image sizes, and edits of larger source images, are generated
+    at that budget with the same aspect ratio and upscaled on the CPU to
+    the requested (or source) size. Edits of sources with a side over
+    UPSCALE_MAX_SIDE come back scaled down to fit it.
+    """
+    # Everything before the handler: receiving and validating the body
+    tracing.since_start("parse")
     try:
-        # Get Modal app URL from environment variable
-        modal_url = os.getenv("MODAL_FLUX_URL", "https://gpudashboard0--flux-kontext-web-app.modal.run")
+        loop = asyncio.get_running_loop()
+        target_size = None
         
         # Prepare request data - match your current Modal deployment format
         if request.image_base64:
             # Image editing mode - use original format
+            image_base64 = request.image_base64
+            with tracing.span("decode"):
+                source_size = upscale.source_size(image_base64)
+            if upscale.gpu_size(*source_size) != source_size:
+                with tracing.span("fit"):
+                    image_base64 = await loop.run_in_executor(image_pool(), upscale.fit_base64, image_base64)
+                # Edits come back at the source size, up to the CPU stage's limit
+                target_size = upscale.clamp_size(*source_size)
             request_data = {
-                "image_base64": request.image_base64,
+                "image_base64": image_base64,
                 "prompt": request.prompt,
                 "guidance_scale": request.guidance_scale,
                 "num_inference_steps": request.num_inference_steps
             }
         else:
+            if max(request.width, request.height) > upscale.MAX_OUTPUT_SIDE:
+                raise HTTPException(status_code=400, detail=f"Width and height are limited to {upscale.MAX_OUTPUT_SIDE}")
+            width, height = upscale.gpu_size(request.width, request.height)
+            if (width, height) != (request.width, request.height):
+                target_size = (request.width, request.height)
+            
             # Text-to-image mode - this might not work with current deployment
             # You'll need to redeploy Modal with the updated code
             request_data = {
                 "prompt": request.prompt,
                 "guidance_scale": request.guidance_scale,
                 "num_inference_steps": request.num_inference_steps,
-                "width": request.width,
-                "height": request.height
+                "width": width,
+                "height": height
             }
         
-        print(f"Sending request to Modal: {request_data}")  # Debug log
-        
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            response = await client.post(
-                f"{modal_url}/generate",
-                json=request_data
-            )
+        async def forward():
+            print(f"Sending request to Modal: {request_data}")  # Debug log
+            
+            response = await generate_on_gpu(request_data, http_request, "interactive")
             
             print(f"Modal response status: {response.status_code}")  # Debug log
             
             if response.status_code == 200:
-                return response.json()
+                with tracing.span("upstream-json"):
+                    return response.json()
             else:
                 error_text = response.text
                 print(f"Modal error response: {error_text}")  # Debug log
@@ -468,149 +686,238 @@ async def generate_image(request: GenerateRequest):
                     status_code=response.status_code, 
                     detail=f"Modal service error: {error_text}"
                 )
-                
+        
+        # Double-clicks, retries and other tabs attach to the call already
+        # running; requests differing only in upscaled size share it too.
+        # A newer request from the same session (X-Session-Id) or the
+        # client disconnecting cancels this one
+        result = await cancellations.run(
+            http_request,
+            generate_flight.run(request_key(request_data), forward),
+            session=http_request.headers.get("x-session-id")
+        )
+        
+        if not (result.get("success") and result.get("image")):
+            return result
+        # Shared with coalesced callers, so copied rather than changed
+        fields = {name: value for name, value in result.items() if name != "image"}
+        if target_size is None:
+            asset = await asyncio.to_thread(register_result, result["image"])
+            return {**fields, **result_image(result["image"], asset, inline)}
+        
+        with tracing.span("upscale"):
+            png = await loop.run_in_executor(image_pool(), upscale.upscale_base64, result["image"], *target_size)
+        return StreamedJSONResponse({
+            **fields,
+            **result_image(Base64Field(png), await asyncio.to_thread(register_result, png), inline),
+            "upscaled_from": list(upscale.gpu_size(*target_size))
+        })
+    
+    except HTTPException:
+        raise
+    except RequestCancelled as e:
+        # 499 (client closed request) is never seen by a disconnected client
+        raise HTTPException(status_code=409 if e.reason == "superseded" else 499, detail=f"Request cancelled: {e.reason}")
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Request timeout - model is likely loading")
     except Exception as e:
         print(f"Exception in generate_image: {str(e)}")  # Debug log
         raise HTTPException(status_code=500, detail=str(e))
 
+def register_result(image) -> Optional[dict]:
+    """Store a generated image (base64 or encoded bytes) and return references to its derivatives"""
+    try:
+        with tracing.span("register"):
+            return asset_store.register(image if isinstance(image, bytes) else base64.b64decode(image))
+    except Exception as e:
+        # The image is then returned inline, so this must not fail the request
+        print(f"Failed to store result asset: {str(e)}")
+        return None
+
+def result_image(image, asset: Optional[dict], inline: bool) -> dict:
+    """
+    Response fields for a result: its asset block, and the image itself
+    only if the client asked for it (?inline=true) or it couldn't be stored
+    """
+    if inline or asset is None:
+        return {"image": image, "asset": asset}
+    return {"asset": asset}
+
+@app.get("/api/assets/{asset_id}/{size}")
+def get_asset(asset_id: str, size: str):
+    """Serve a stored result or its WebP derivative (128/512/1024), rendered on first request"""
+    path = asset_store.derivative(asset_id, size)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    
+    # Content-addressed, so every URL is immutable
+    return FileResponse(
+        path,
+        media_type="image/png" if size == "original" else "image/webp",
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
+@app.get("/api/videos/{video_id}/{name}")
+def get_video_rendition(video_id: str, name: str):
+    """Serve a stored video or its poster/preview/web rendition, rendered on first request"""
+    try:
+        path = video_store.rendition(video_id, name)
+    except ValueError:
+        path = None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Video not found")
+    
+    # Content-addressed, so every URL is immutable
+    return FileResponse(
+        path,
+        media_type=RENDITIONS[name][1],
+        headers={"Cache-Control": "public, max-age=31536000, immutable"}
+    )
+
 @app.get("/studio", response_class=HTMLResponse)
 async def studio_page(request: Request):
     """Integrated Make3D Studio page"""
+    upstream_warmer.note_activity()
     return templates.TemplateResponse("studio.html", {"request": request})
 
 @app.get("/editor", response_class=HTMLResponse)
 async def editor_page(request: Request):
     """Image editor page (legacy)"""
+    upstream_warmer.note_activity()
     return templates.TemplateResponse("editor.html", {"request": request})
 
 @app.post("/api/remove-background")
-async def remove_background(request: BasicEditRequest):
-    """Remove background using AI-powered rembg library with fallback to basic method"""
+async def remove_background(request: RemoveBackgroundRequest):
+    """Remove background using AI-powered rembg library, or the OpenCV fast mode"""
+    upstream_warmer.note_activity()
     try:
         # Decode base64 image
         image_data = base64.b64decode(request.image_base64)
         img = Image.open(io.BytesIO(image_data)).convert("RGBA")
         
-        try:
-            # Try using rembg for professional background removal
-            from rembg import remove
-            
-            # Convert to RGB for rembg processing
-            img_rgb = img.convert("RGB")
-            
-            # Apply AI-powered background removal
-            output = remove(img_rgb)
-            
-            # Convert to base64
-            buffer = io.BytesIO()
-            output.save(buffer, format="PNG")
-            result_base64 = base64.b64encode(buffer.getvalue()).decode()
-            
-            return {"success": True, "image": result_base64, "method": "ai"}
-            
-        except ImportError:
-            # Fallback to basic method if rembg is not available
-            img_array = np.array(img)
-            
-            # Create a simple mask based on corner colors (assuming background is uniform)
-            h, w = img_array.shape[:2]
-            corner_colors = [
-                img_array[0, 0], img_array[0, w-1], 
-                img_array[h-1, 0], img_array[h-1, w-1]
-            ]
-            
-            # Find most common corner color as background
-            bg_color = corner_colors[0][:3]  # Take RGB only
-            
-            # Create mask where pixels are similar to background color
-            tolerance = 30
-            mask = np.all(np.abs(img_array[:, :, :3] - bg_color) < tolerance, axis=2)
-            
-            # Set background pixels to transparent
-            img_array[mask] = [0, 0, 0, 0]
-            
-            # Convert back to PIL image
-            result_img = Image.fromarray(img_array, 'RGBA')
-            
-            # Convert to base64
-            buffer = io.BytesIO()
-            result_img.save(buffer, format="PNG")
-            result_base64 = base64.b64encode(buffer.getvalue()).decode()
-            
-            return {"success": True, "image": result_base64, "method": "basic"}
+        output = None
+        method = "fast"
+        if request.mode != "fast":
+            try:
+                # Try using rembg for professional background removal
+                from rembg import remove
+                
+                if request.mode == "matting":
+                    # Segment at the model's input size, guided-upsample the mask
+                    output = background_removal.remove_background_matting(img)
+                    method = "matting"
+                else:
+                    # Apply AI-powered background removal at full resolution
+                    output = remove(img.convert("RGB"), session=background_removal.get_rembg_session())
+                    method = "ai"
+                
+            except ImportError:
+                # Fall back to fast mode if rembg is not available
+                print("rembg not installed, using fast background removal")
+        
+        if output is None:
+            # Border-estimated background, flood-filled at reduced resolution
+            output = background_removal.remove_background_fast(img)
+        
+        # Base64 is streamed from the PNG buffer
+        return StreamedJSONResponse({"success": True, "image": encode_image(output), "method": method})
         
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+def adjusted_image(request: AdjustImageRequest) -> Base64Field:
+    """Decode, adjust and re-encode an image; blocking, run off the event loop"""
+    # Decode base64 image
+    image_data = base64.b64decode(request.image_base64)
+    img = Image.open(io.BytesIO(image_data))
+    
+    # Brightness + contrast as one LUT, saturation as one colour matrix
+    adjusted = image_kernels.adjust(
+        image_kernels.to_array(img),
+        brightness=request.brightness,
+        contrast=request.contrast,
+        saturation=request.saturation
+    )
+    return encode_image(image_kernels.from_array(adjusted))
+
 @app.post("/api/adjust-image")
-async def adjust_image(request: BasicEditRequest):
+async def adjust_image(request: AdjustImageRequest):
     """Basic image adjustments (brightness, contrast, etc.)"""
+    upstream_warmer.note_activity()
     try:
-        # Decode base64 image
-        image_data = base64.b64decode(request.image_base64)
-        img = Image.open(io.BytesIO(image_data))
-        
-        # Apply brightness enhancement
-        enhancer = ImageEnhance.Brightness(img)
-        img = enhancer.enhance(1.3)  # Increase brightness by 30%
-        
-        # Apply contrast enhancement
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.2)  # Increase contrast by 20%
+        # In a thread: the tiles run in parallel, but waiting for them
+        # would still hold the event loop
+        image = await asyncio.to_thread(adjusted_image, request)
         
-        # Apply color enhancement
-        enhancer = ImageEnhance.Color(img)
-        img = enhancer.enhance(1.1)  # Increase saturation by 10%
-        
-        # Convert to base64
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        result_base64 = base64.b64encode(buffer.getvalue()).decode()
-        
-        return {"success": True, "image": result_base64}
+        # Base64 is streamed from the PNG buffer
+        return StreamedJSONResponse({"success": True, "image": image})
         
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+def enhanced_image(request: EnhanceImageRequest) -> Base64Field:
+    """Decode, enhance and re-encode an image; blocking, run off the event loop"""
+    # Decode base64 image
+    image_data = base64.b64decode(request.image_base64)
+    img = Image.open(io.BytesIO(image_data))
+    
+    # Unsharp mask, then blur/sharpen/sharpness folded into one convolution
+    enhanced = image_kernels.enhance(
+        image_kernels.to_array(img),
+        unsharp_radius=request.unsharp_radius,
+        unsharp_percent=request.unsharp_percent,
+        unsharp_threshold=request.unsharp_threshold,
+        blur_radius=request.blur_radius,
+        sharpness=request.sharpness
+    )
+    return encode_image(image_kernels.from_array(enhanced))
+
 @app.post("/api/enhance-image")
-async def enhance_image(request: BasicEditRequest):
+async def enhance_image(request: EnhanceImageRequest):
     """Enhance image quality using basic filters"""
+    upstream_warmer.note_activity()
     try:
-        # Decode base64 image
-        image_data = base64.b64decode(request.image_base64)
-        img = Image.open(io.BytesIO(image_data))
-        
-        # Apply sharpening filter
-        img = img.filter(ImageFilter.UnsharpMask(radius=1, percent=150, threshold=3))
-        
-        # Apply slight blur to smooth noise, then sharpen
-        img = img.filter(ImageFilter.GaussianBlur(radius=0.5))
-        img = img.filter(ImageFilter.SHARPEN)
+        image = await asyncio.to_thread(enhanced_image, request)
         
-        # Enhance sharpness
-        enhancer = ImageEnhance.Sharpness(img)
-        img = enhancer.enhance(1.2)
-        
-        # Convert to base64
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        result_base64 = base64.b64encode(buffer.getvalue()).decode()
-        
-        return {"success": True, "image": result_base64}
+        # Base64 is streamed from the PNG buffer
+        return StreamedJSONResponse({"success": True, "image": image})
         
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+def fast_color_variants(image_base64: str, colors: list, inline: bool) -> list:
+    """CPU recolor of one image into each hex color, with stored assets"""
+    img = Image.open(io.BytesIO(base64.b64decode(image_base64)))
+    variants = []
+    for i, (color, recolored) in enumerate(zip(colors, recolor.recolor_variants(img, colors))):
+        buffer = io.BytesIO()
+        recolored.save(buffer, format="PNG", compress_level=1)
+        png = buffer.getvalue()
+        variants.append({
+            "name": f"Color Variant {i+1}",
+            "color": color,
+            **result_image(Base64Field(png, prefix="data:image/png;base64,"), register_result(png), inline)
+        })
+    return variants
+
 @app.post("/api/color-variations")
-async def color_variations(request: dict):
-    """Generate color variations using Modal Labs FLUX.1-Kontext"""
+async def color_variations(request: dict, http_request: Request, inline: bool = False):
+    """
+    Generate color variations
+    
+    mode "fast" (the default) recolors the segmented product on the CPU in
+    milliseconds and accepts any hex color; mode "flux" runs a Modal
+    FLUX.1-Kontext inference per color for high-fidelity results. Variants
+    carry their images only with ?inline=true.
+    """
     try:
         image_base64 = request.get("image_base64")
         colors = request.get("colors", [])
         num_variations = request.get("num_variations", 4)
         preserve_details = request.get("preserve_details", True)
+        mode = request.get("mode", "fast")
         
         if not image_base64:
             return {"success": False, "error": "No image provided"}
@@ -618,101 +925,96 @@ async def color_variations(request: dict):
         if not colors:
             return {"success": False, "error": "No colors provided"}
         
-        # Get Modal app URL from environment variable
-        modal_url = os.getenv("MODAL_FLUX_URL", "https://gpudashboard0--flux-kontext-web-app.modal.run")
-        
-        # Color name to prompt mapping
-        color_prompts = {
-            "#dc2626": "Transform the product to elegant red color scheme, vibrant red finish, professional red coating",
-            "#2563eb": "Transform the product to deep blue color scheme, rich navy blue finish, vibrant blue coating", 
-            "#16a34a": "Transform the product to forest green color scheme, natural green finish, deep emerald green coating",
-            "#ea580c": "Transform the product to bright orange color scheme, vibrant orange finish, energetic orange coating",
-            "#9333ea": "Transform the product to elegant purple color scheme, rich purple finish, luxurious purple coating",
-            "#f59e0b": "Transform the product to golden yellow color scheme, warm gold finish, premium golden coating",
-            "#1f2937": "Transform the product to elegant matte black color scheme, sophisticated dark finish, premium black coating",
-            "#f9fafb": "Transform the product to clean pure white color scheme, pristine white finish, minimalist white coating",
-            "#f472b6": "Transform the product to soft pink color scheme, elegant pink finish, stylish rose coating",
-            "#10b981": "Transform the product to mint green color scheme, fresh mint finish, modern teal coating",
-            "#0ea5e9": "Transform the product to sky blue color scheme, bright cyan finish, modern blue coating",
-            "#a855f7": "Transform the product to lavender purple color scheme, soft purple finish, elegant violet coating"
-        }
+        if mode == "fast":
+            colors = colors[:num_variations]
+            try:
+                for color in colors:
+                    recolor.parse_hex(color)
+            except ValueError as e:
+                return {"success": False, "error": str(e)}
+            variants = await asyncio.to_thread(fast_color_variants, image_base64, colors, inline)
+            return StreamedJSONResponse({"success": True, "variants": variants, "mode": "fast"})
         
         variants = []
         
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            for i, color in enumerate(colors[:num_variations]):
-                try:
-                    # Get color-specific prompt or use generic transformation
-                    color_prompt = color_prompts.get(color, f"Transform the product to {color} color scheme, maintaining all original design features and proportions")
-                    
-                    full_prompt = f"{color_prompt}. Professional product photography, clean white background, studio lighting, high-quality commercial shot, maintain original shape and details"
-                    if preserve_details:
-                        full_prompt += ", preserve textures and shadows intact"
-                    
-                    response = await client.post(
-                        f"{modal_url}/generate",
-                        json={
-                            "image_base64": image_base64,
-                            "prompt": full_prompt,
-                            "guidance_scale": 7.0,
-                            "num_inference_steps": 25
-                        }
-                    )
-                    
-                    if response.status_code == 200:
-                        result = response.json()
-                        if result.get("success"):
-                            variants.append({
-                                "name": f"Color Variant {i+1}",
-                                "color": color,
-                                "image": f"data:image/png;base64,{result['image']}"
-                            })
-                        else:
-                            print(f"Modal error for color {color}: {result.get('message', 'Unknown error')}")
+        for i, color in enumerate(colors[:num_variations]):
+            try:
+                # Get color-specific prompt or use generic transformation
+                color_prompt = COLOR_PROMPTS.get(color, f"Transform the product to {color} color scheme, maintaining all original design features and proportions")
+                
+                full_prompt = f"{color_prompt}. Professional product photography, clean white background, studio lighting, high-quality commercial shot, maintain original shape and details"
+                if preserve_details:
+                    full_prompt += ", preserve textures and shadows intact"
+                
+                # Each variant queues separately, so edits can run in between
+                response = await generate_on_gpu({
+                    "image_base64": image_base64,
+                    "prompt": full_prompt,
+                    "guidance_scale": 7.0,
+                    "num_inference_steps": 25
+                }, http_request, "bulk")
+                
+                if response.status_code == 200:
+                    result = response.json()
+                    if result.get("success"):
+                        variants.append({
+                            "name": f"Color Variant {i+1}",
+                            "color": color,
+                            **result_image(
+                                Base64Field(prefix="data:image/png;base64,", encoded=result["image"]),
+                                await asyncio.to_thread(register_result, result["image"]),
+                                inline
+                            )
+                        })
                     else:
-                        print(f"HTTP error for color {color}: {response.status_code}")
-                        
-                except Exception as e:
-                    print(f"Error generating variant for color {color}: {str(e)}")
-                    continue
+                        print(f"Modal error for color {color}: {result.get('message', 'Unknown error')}")
+                else:
+                    print(f"HTTP error for color {color}: {response.status_code}")
+            
+            except CircuitOpenError as e:
+                # Upstream is down, the remaining colors would fail the same way
+                print(f"Stopping color variations: {str(e)}")
+                break
+            except Exception as e:
+                print(f"Error generating variant for color {color}: {str(e)}")
+                continue
         
         if variants:
-            return {"success": True, "variants": variants}
+            return StreamedJSONResponse({"success": True, "variants": variants, "mode": "flux"})
         else:
             return {"success": False, "error": "Failed to generate any color variations"}
-        
+    
     except Exception as e:
         print(f"Color variations error: {str(e)}")
         return {"success": False, "error": str(e)}
 
+def basic_edited_image(image_base64: str, operation: str) -> Base64Field:
+    """Decode, edit and re-encode an image; blocking, run off the event loop"""
+    # Decode image
+    image_data = base64.b64decode(image_base64)
+    img = Image.open(io.BytesIO(image_data))
+    
+    # Apply operation
+    if operation == "rotate":
+        img = img.rotate(90, expand=True)
+    elif operation == "crop":
+        # Crop to square
+        width, height = img.size
+        size = min(width, height)
+        left = (width - size) // 2
+        top = (height - size) // 2
+        img = img.crop((left, top, left + size, top + size))
+    return encode_image(img)
+
 @app.post("/api/basic-edit")
 async def basic_edit(request: dict):
     """Basic image editing operations"""
+    upstream_warmer.note_activity()
     try:
-        image_base64 = request.get("image_base64")
-        operation = request.get("operation")
-        
-        # Decode image
-        image_data = base64.b64decode(image_base64)
-        img = Image.open(io.BytesIO(image_data))
-        
-        # Apply operation
-        if operation == "rotate":
-            img = img.rotate(90, expand=True)
-        elif operation == "crop":
-            # Crop to square
-            width, height = img.size
-            size = min(width, height)
-            left = (width - size) // 2
-            top = (height - size) // 2
-            img = img.crop((left, top, left + size, top + size))
-        
-        # Convert back to base64
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        result_base64 = base64.b64encode(buffer.getvalue()).decode()
+        image = await asyncio.to_thread(basic_edited_image, request.get("image_base64"), request.get("operation"))
         
-        return {"success": True, "image": result_base64}
+        # Base64 is streamed from the PNG buffer
+        return StreamedJSONResponse({"success": True, "image": image})
         
     except Exception as e:
         return {"success": False, "error": str(e)}
@@ -720,37 +1022,285 @@ async def basic_edit(request: dict):
 @app.post("/api/crop-image")
 async def crop_image(request: BasicEditRequest):
     """Crop image to square aspect ratio"""
+    upstream_warmer.note_activity()
     try:
-        # Decode base64 image
-        image_data = base64.b64decode(request.image_base64)
-        img = Image.open(io.BytesIO(image_data))
+        image = await asyncio.to_thread(basic_edited_image, request.image_base64, "crop")
         
-        # Get image dimensions
-        width, height = img.size
-        
-        # Calculate square crop
-        size = min(width, height)
-        left = (width - size) // 2
-        top = (height - size) // 2
-        right = left + size
-        bottom = top + size
+        # Base64 is streamed from the PNG buffer
+        return StreamedJSONResponse({"success": True, "image": image})
         
-        # Crop to square
-        img = img.crop((left, top, right, bottom))
-        
-        # Convert to base64
-        buffer = io.BytesIO()
-        img.save(buffer, format="PNG")
-        result_base64 = base64.b64encode(buffer.getvalue()).decode()
-        
-        return {"success": True, "image": result_base64}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+_image_pool: Optional[ProcessPoolExecutor] = None
+_image_pool_pid: Optional[int] = None
+
+def image_pool() -> ProcessPoolExecutor:
+    """
+    Process pool for CPU-heavy image work (bulk edits, upscaling), created
+    on first use in each worker
+    
+    Processes are spawned rather than forked, so they don't inherit the
+    gateway's event loop, client connections or thread pools. A pool broken
+    by a process dying (e.g. OOM-killed on a huge image) is replaced.
+    """
+    global _image_pool, _image_pool_pid
+    if _image_pool is not None and _image_pool_pid == os.getpid() and _image_pool._broken:
+        print(f"Image pool broken ({_image_pool._broken}), starting a new one")
+        _image_pool.shutdown(wait=False, cancel_futures=True)
+        _image_pool = None
+    if _image_pool is None or _image_pool_pid != os.getpid():
+        _image_pool = ProcessPoolExecutor(
+            max_workers=BULK_EDIT_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=bulk_edit.init_process
+        )
+        _image_pool_pid = os.getpid()
+    return _image_pool
+
+def bulk_edit_items(body):
+    """
+    Items of a spooled NDJSON bulk-edit body, one line at a time after the
+    header line; lines that aren't JSON objects are yielded as errors
+    """
+    for line in body:
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+            if not isinstance(item, dict):
+                raise ValueError("Item is not a JSON object")
+        except ValueError as e:
+            item = {"error": f"Invalid item: {str(e)}"}
+        yield item
+
+async def run_bulk_edit(items, operations: list, inline: bool, body=None):
+    """
+    NDJSON lines: a header, one line per image as it finishes (in completion
+    order, with its request index), then a summary
+    
+    At most two items per pool process are decoded or in flight at once, so
+    memory stays bounded however many items the request holds.
+    """
+    loop = asyncio.get_running_loop()
+    window = 2 * BULK_EDIT_PROCESSES
+    pending = {}
+    counts = {"completed": 0, "failed": 0}
+    
+    def failed(error: Exception) -> asyncio.Future:
+        future = loop.create_future()
+        future.set_exception(error)
+        return future
+    
+    def run(task) -> asyncio.Future:
+        # image_pool() per item, so that items after a process died run on
+        # a fresh pool; only those in flight at the time fail
+        try:
+            return loop.run_in_executor(image_pool(), task)
+        except BrokenProcessPool as e:
+            return failed(e)
+    
+    def submit(index: int, item: dict):
+        if item.get("error"):
+            future = failed(ValueError(item["error"]))
+        elif item.get("image_base64"):
+            future = run(functools.partial(bulk_edit.process, operations, image_base64=item["image_base64"]))
+        elif item.get("asset_id"):
+            path = asset_store.derivative(str(item["asset_id"]), "original")
+            if path is None:
+                future = failed(ValueError(f"Asset not found: {item['asset_id']}"))
+            else:
+                future = run(functools.partial(bulk_edit.process, operations, path=path))
+        else:
+            future = failed(ValueError("Item has no image_base64 or asset_id"))
+        pending[future] = (index, item.get("id", index))
+    
+    async def result_line(future) -> str:
+        index, item_id = pending.pop(future)
+        try:
+            png = future.result()
+            line = {"index": index, "id": item_id, "success": True, "asset": await asyncio.to_thread(register_result, png)}
+            if inline or line["asset"] is None:
+                line["image"] = base64.b64encode(png).decode()
+            counts["completed"] += 1
+        except Exception as e:
+            print(f"Bulk edit failed for item {item_id}: {str(e)}")
+            line = {"index": index, "id": item_id, "success": False, "error": str(e)}
+            counts["failed"] += 1
+        return json.dumps(line) + "\n"
+    
+    try:
+        yield json.dumps({"success": True, "operations": operations, "processes": BULK_EDIT_PROCESSES}) + "\n"
+        for index, item in enumerate(items):
+            submit(index, item)
+            if len(pending) >= window:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    yield await result_line(future)
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                yield await result_line(future)
+        yield json.dumps({"done": True, **counts}) + "\n"
+    finally:
+        # Client gone: drop queued work; images already on a process finish there
+        for future in pending:
+            future.cancel()
+        if body is not None:
+            body.close()
+
+@app.post("/api/bulk-edit")
+async def bulk_edit_images(http_request: Request):
+    """
+    Run an operation chain on many images across a process pool
+    
+    Operations are the basic edits (remove-background, crop, rotate, adjust,
+    enhance), each with the parameters of its single-image endpoint. The body
+    is either NDJSON (Content-Type application/x-ndjson) whose first line is
+    {"operations": [...], "inline": false} and each further line one item, or
+    a JSON object {"operations": [...], "items": [...]}. An item is
+    {"id": ..., "image_base64": ...} or {"id": ..., "asset_id": ...}.
+    
+    The response streams one JSON line per finished image with its stored
+    asset (and the image itself when `inline`), including failed items.
+    """
+    upstream_warmer.note_activity()
+    ndjson = "ndjson" in http_request.headers.get("content-type", "")
+    
+    # The body is spooled (to disk past 16 MB) so that items can be read
+    # one at a time while results stream out
+    body = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    try:
+        async for chunk in http_request.stream():
+            body.write(chunk)
+        body.seek(0)
         
+        if ndjson:
+            lines = io.TextIOWrapper(body, encoding="utf-8")
+            header = json.loads(lines.readline() or "{}")
+            items = bulk_edit_items(lines)
+        else:
+            header = json.load(body)
+            items = header.get("items", [])
+            body.close()
+            body = None
+        operations = bulk_edit.validate(header.get("operations", []))
+    except (ValueError, AttributeError) as e:
+        if body is not None:
+            body.close()
+        return {"success": False, "error": str(e)}
+    
+    return StreamingResponse(
+        run_bulk_edit(items, operations, bool(header.get("inline", False)), body),
+        media_type="application/x-ndjson"
+    )
+
+async def lifestyle_plate(scene: str, style: str, http_request: Request):
+    """
+    Background plate for a scene/style, generating it with FLUX the first
+    time it is needed (once across all workers)
+    """
+    found = plate_library.get(scene, style)
+    if found is not None:
+        return found
+    
+    async def generate_plate():
+        prompt = (
+            f"Empty background plate: {SCENE_PROMPTS[scene]}, {STYLE_MODIFIERS[style]}. "
+            "No product, an empty clear surface in the center foreground for product placement, "
+            "professional lifestyle photography, realistic lighting"
+        )
+        response = await generate_on_gpu({
+            "prompt": prompt,
+            "guidance_scale": 3.5,
+            "num_inference_steps": 28,
+            "width": 1024,
+            "height": 1024
+        }, http_request, "preview")
+        result = response.json() if response.status_code == 200 else {}
+        if not result.get("success"):
+            raise RuntimeError(f"Plate generation failed: {result.get('message', response.text)}")
+        # Stored by the worker that generated it; the others find it on disk
+        await asyncio.to_thread(plate_library.put, scene, style, base64.b64decode(result["image"]), "flux")
+        return {"scene": scene, "style": style}
+    
+    await generate_flight.run(request_key({"plate": scene, "style": style}), generate_plate)
+    found = plate_library.get(scene, style)
+    if found is None:
+        # Coalesced onto a recent generation whose plate has since gone
+        await generate_plate()
+        found = plate_library.get(scene, style)
+    return found
+
+def composite_mockup(image_base64: str, plate: Image.Image, meta: dict) -> bytes:
+    """PNG of the product composited onto a plate"""
+    product = Image.open(io.BytesIO(base64.b64decode(image_base64)))
+    buffer = io.BytesIO()
+    plates.composite(product, plate, meta).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+async def harmonize_mockup(png: bytes, http_request: Request) -> Optional[str]:
+    """Short low-step FLUX pass over a composite; None if it fails"""
+    try:
+        response = await generate_on_gpu({
+            "image_base64": base64.b64encode(png).decode(),
+            "prompt": "Blend the product naturally into the scene with consistent lighting, reflections and shadows, keep the product and background unchanged",
+            "guidance_scale": 2.5,
+            "num_inference_steps": HARMONIZE_STEPS
+        }, http_request, "preview")
+        result = response.json() if response.status_code == 200 else {}
+        return result.get("image") if result.get("success") else None
+    except Exception as e:
+        print(f"Harmonize pass failed, returning the composite: {str(e)}")
+        return None
+
+@app.get("/api/plates")
+async def list_plates():
+    """Stored background plates and the scene/style combinations still missing"""
+    stored = plate_library.index()
+    have = {(plate["scene"], plate["style"]) for plate in stored}
+    missing = [
+        {"scene": scene, "style": style}
+        for scene in SCENE_PROMPTS for style in STYLE_MODIFIERS
+        if (scene, style) not in have
+    ]
+    return {"success": True, "plates": stored, "missing": missing}
+
+@app.post("/api/plates/{scene}/{style}")
+async def import_plate(scene: str, style: str, request: dict, http_request: Request):
+    """
+    Import a background plate for a scene/style, replacing any stored one
+    
+    Plates are shared by every user's mockups, so this needs the admin
+    token. Optional "placement" ({"x", "bottom", "max_width", "max_height"}
+    as fractions of the plate) and "light_direction" ([x, y] towards the
+    light) override the defaults and the estimate.
+    """
+    require_admin(http_request)
+    if scene not in SCENE_PROMPTS or style not in STYLE_MODIFIERS:
+        raise HTTPException(status_code=404, detail="Unknown scene or style")
+    if not request.get("image_base64"):
+        return {"success": False, "error": "No image provided"}
+    try:
+        meta = await asyncio.to_thread(
+            plate_library.put, scene, style, base64.b64decode(request["image_base64"]), "import",
+            request.get("placement"), request.get("light_direction")
+        )
     except Exception as e:
         return {"success": False, "error": str(e)}
+    return {"success": True, "plate": meta}
 
 @app.post("/api/lifestyle-mockup")
-async def lifestyle_mockup(request: dict):
-    """Generate lifestyle mockups using Modal Labs FLUX.1-Kontext"""
+async def lifestyle_mockup(request: dict, http_request: Request, inline: bool = False):
+    """
+    Generate lifestyle mockups
+    
+    mode "composite" (the default) places the cut-out product on the cached
+    scene/style plate on the CPU, optionally followed by a short FLUX
+    harmonize pass ("harmonize": true); mode "flux" generates the whole
+    scene around the product with FLUX.1-Kontext. The image itself is
+    included only with ?inline=true.
+    """
     try:
         image_base64 = request.get("image_base64")
         scene = request.get("scene")
@@ -759,179 +1309,297 @@ async def lifestyle_mockup(request: dict):
         if not image_base64:
             return {"success": False, "error": "No image provided"}
         
-        # Get Modal app URL from environment variable
-        modal_url = os.getenv("MODAL_FLUX_URL", "https://gpudashboard0--flux-kontext-web-app.modal.run")
-        
-        # Create lifestyle prompt based on scene and style
-        scene_prompts = {
-            'living-room': 'Product placed in a modern living room setting, cozy atmosphere, natural lighting, home lifestyle',
-            'kitchen': 'Product in a modern kitchen environment, bright lighting, culinary lifestyle, home cooking scene',
-            'office': 'Product in a professional office workspace, clean desk setup, business environment, productivity lifestyle',
-            'bedroom': 'Product in a comfortable bedroom setting, soft lighting, relaxing atmosphere, personal space',
-            'outdoor': 'Product in a natural outdoor setting, fresh air environment, outdoor lifestyle, nature scene',
-            'cafe': 'Product in a trendy café atmosphere, coffee shop environment, social lifestyle, urban setting'
-        }
-        
-        style_modifiers = {
-            'modern': 'clean, minimalist aesthetic, contemporary design',
-            'rustic': 'warm, natural materials, cozy atmosphere',
-            'industrial': 'urban, edgy vibe, modern industrial design',
-            'scandinavian': 'light, airy Nordic style, minimalist approach',
-            'bohemian': 'eclectic, artistic feel, creative atmosphere'
-        }
+        if request.get("mode", "composite") == "composite":
+            scene = scene if scene in SCENE_PROMPTS else 'living-room'
+            style = style if style in STYLE_MODIFIERS else 'modern'
+            plate, meta = await lifestyle_plate(scene, style, http_request)
+            png = await asyncio.to_thread(composite_mockup, image_base64, plate, meta)
+            
+            harmonized = await harmonize_mockup(png, http_request) if request.get("harmonize") else None
+            if harmonized is not None:
+                image = Base64Field(prefix="data:image/png;base64,", encoded=harmonized)
+                asset = await asyncio.to_thread(register_result, harmonized)
+            else:
+                image = Base64Field(png, prefix="data:image/png;base64,")
+                asset = await asyncio.to_thread(register_result, png)
+            return StreamedJSONResponse({
+                "success": True,
+                **result_image(image, asset, inline),
+                "scene": scene,
+                "style": style,
+                "mode": "composite",
+                "harmonized": harmonized is not None
+            })
         
-        base_prompt = scene_prompts.get(scene, scene_prompts['living-room'])
-        style_modifier = style_modifiers.get(style, style_modifiers['modern'])
+        base_prompt = SCENE_PROMPTS.get(scene, SCENE_PROMPTS['living-room'])
+        style_modifier = STYLE_MODIFIERS.get(style, STYLE_MODIFIERS['modern'])
         
         full_prompt = f"{base_prompt}, {style_modifier}. Professional lifestyle photography, high quality, realistic lighting, commercial photography style."
         
-        async with httpx.AsyncClient(timeout=300.0) as client:
-            response = await client.post(
-                f"{modal_url}/generate",
-                json={
-                    "image_base64": image_base64,
-                    "prompt": full_prompt,
-                    "guidance_scale": 6.5,
-                    "num_inference_steps": 25
-                }
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("success"):
-                    return {
-                        "success": True, 
-                        "image": f"data:image/png;base64,{result['image']}",
-                        "scene": scene,
-                        "style": style
-                    }
-                else:
-                    return {"success": False, "error": result.get('message', 'Unknown error')}
+        response = await generate_on_gpu({
+            "image_base64": image_base64,
+            "prompt": full_prompt,
+            "guidance_scale": 6.5,
+            "num_inference_steps": 25
+        }, http_request, "preview")
+        
+        if response.status_code == 200:
+            result = response.json()
+            if result.get("success"):
+                return StreamedJSONResponse({
+                    "success": True, 
+                    **result_image(
+                        Base64Field(prefix="data:image/png;base64,", encoded=result["image"]),
+                        await asyncio.to_thread(register_result, result["image"]),
+                        inline
+                    ),
+                    "scene": scene,
+                    "style": style,
+                    "mode": "flux"
+                })
             else:
-                return {"success": False, "error": f"Modal service error: {response.text}"}
-                
+                return {"success": False, "error": result.get('message', 'Unknown error')}
+        else:
+            return {"success": False, "error": f"Modal service error: {response.text}"}
+    
     except Exception as e:
         print(f"Lifestyle mockup error: {str(e)}")
         return {"success": False, "error": str(e)}
 
 @app.post("/api/generate-video")
 async def generate_video(request: dict):
-    """Generate animated video using FAL Kling 2.5"""
+    """
+    Generate animated video using FAL Kling 2.5, answering once it is done
+    
+    Kept for clients that expect the video in the response: the job goes
+    through the same queue and webhook as /api/video-jobs, which new
+    callers should use instead of holding a request open for minutes.
+    """
     try:
-        image_base64 = request.get("image_base64")
-        prompt = request.get("prompt", "smooth product animation")
-        category = request.get("category", "product")
-        animation_style = request.get("animation_style", "smooth_rotation")
-        guidance_scale = request.get("guidance_scale", 3.5)
-        duration = request.get("duration", "5")  # User-specified duration (5 or 10 seconds)
-        
-        if not image_base64:
+        if not request.get("image_base64"):
             return {"success": False, "message": "No image provided"}
-        
-        # Get FAL API key from environment variable
-        fal_api_key = os.getenv("FAL_KEY")
-        if not fal_api_key:
+        if not os.getenv("FAL_KEY"):
             return {"success": False, "message": "FAL API key not configured"}
         
-        # Set FAL_KEY environment variable for fal_client
-        os.environ['FAL_KEY'] = fal_api_key
+        arguments, metadata = await kling_job_request(request)
         
-        # Convert base64 image to data URI format expected by FAL
-        if not image_base64.startswith("data:"):
-            image_url = f"data:image/png;base64,{image_base64}"
-        else:
-            image_url = image_base64
-            
-        # Create enhanced prompt based on category and animation style
-        enhanced_prompt = create_enhanced_prompt(prompt, category, animation_style)
-        
-        print(f"Generating video with FAL Kling 2.5: {enhanced_prompt}")
-        
-        # Use FAL client subscribe method
-        result = fal_client.subscribe(
-            "fal-ai/kling-video/v2.5-turbo/pro/image-to-video",
-            arguments={
-                "prompt": enhanced_prompt,
-                "image_url": image_url,
-                "duration": duration,
-                "negative_prompt": "blur, distort, and low quality",
-                "cfg_scale": min(guidance_scale / 7.0, 1.0)  # Convert to 0-1 range
-            },
-            with_logs=True
-        )
+        print(f"Generating video with FAL Kling 2.5: {arguments['prompt']}")
         
-        # Check if we got a successful result
-        if result and "video" in result and "url" in result["video"]:
-            video_url = result["video"]["url"]
-            
-            # Download the video and convert to base64
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                video_response = await client.get(video_url)
-                if video_response.status_code == 200:
-                    video_base64 = base64.b64encode(video_response.content).decode()
-                    
-                    return {
-                        "success": True,
-                        "video": video_base64,
-                        "message": "Video generated successfully with FAL Kling 2.5",
-                        "prompt_used": enhanced_prompt,
-                        "settings": {
-                            "resolution": "1280x720",
-                            "duration": f"{duration}s", 
-                            "fps": 16,
-                            "cfg_scale": min(guidance_scale / 7.0, 1.0),
-                            "model": "Kling 2.5 Turbo Pro"
-                        }
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "message": f"Failed to download generated video: {video_response.status_code}"
-                    }
-        else:
-            return {
-                "success": False,
-                "message": f"Unexpected FAL API response: {result}"
-            }
+        record = await video_jobs.submit(arguments, metadata, transcode=bool(request.get("transcode", False)))
+        record = await video_jobs.wait(record["job_id"], timeout=VIDEO_WAIT_TIMEOUT)
+        if record is None or record["status"] != "completed":
+            error = record.get("error") if record else None
+            return {"success": False, "message": f"Animation generation failed: {error or 'job lost'}"}
+        
+        with open(video_store.rendition(record["video_id"], "original"), "rb") as f:
+            video = f.read()
+        return StreamedJSONResponse({
+            "success": True,
+            "video": Base64Field(video),
+            "media": record["media"],
+            "job_id": record["job_id"],
+            "message": "Video generated successfully with FAL Kling 2.5",
+            **metadata
+        })
                 
     except Exception as e:
         print(f"Exception in generate_video: {str(e)}")  # Debug log
         return {"success": False, "message": f"Animation generation failed: {str(e)}"}
 
-def create_enhanced_prompt(base_prompt: str, category: str, animation_style: str) -> str:
-    """Create enhanced prompt based on product category and animation style"""
+async def kling_job_request(request: dict):
+    """
+    Kling arguments for an animation request, plus the prompt and settings
+    echoed back to the client
+    
+    The source image is referenced by its FAL storage URL, so trying
+    several styles on one product uploads it only once.
+    """
+    guidance_scale = request.get("guidance_scale", 3.5)
+    duration = request.get("duration", "5")  # User-specified duration (5 or 10 seconds)
+    
+    image_url = await fal_storage.url_for(request.get("image_base64"))
+    
+    enhanced_prompt = create_enhanced_prompt(
+        request.get("prompt", "smooth product animation"),
+        request.get("category", "product"),
+        request.get("animation_style", "smooth_rotation")
+    )
+    cfg_scale = min(guidance_scale / 7.0, 1.0)  # Convert to 0-1 range
+    
+    arguments = {
+        "prompt": enhanced_prompt,
+        "image_url": image_url,
+        "duration": duration,
+        "negative_prompt": "blur, distort, and low quality",
+        "cfg_scale": cfg_scale
+    }
+    metadata = {
+        "prompt_used": enhanced_prompt,
+        "settings": {
+            "resolution": "1280x720",
+            "duration": f"{duration}s",
+            "fps": 16,
+            "cfg_scale": cfg_scale,
+            "model": "Kling 2.5 Turbo Pro"
+        }
+    }
+    return arguments, metadata
+
+@app.post("/api/video-jobs")
+async def submit_video_job(request: dict):
+    """Queue a FAL Kling 2.5 animation and return at once; FAL calls back on completion"""
+    if not request.get("image_base64"):
+        return {"success": False, "message": "No image provided"}
+    if not os.getenv("FAL_KEY"):
+        return {"success": False, "message": "FAL API key not configured"}
+    
+    arguments, metadata = await kling_job_request(request)
+    try:
+        record = await video_jobs.submit(arguments, metadata, transcode=bool(request.get("transcode", False)))
+    except Exception as e:
+        print(f"Exception in submit_video_job: {str(e)}")  # Debug log
+        return {"success": False, "message": f"Animation submission failed: {str(e)}"}
+    
+    return {
+        "success": True,
+        "job_id": record["job_id"],
+        "status": record["status"],
+        "status_url": f"/api/video-jobs/{record['job_id']}"
+    }
+
+@app.get("/api/video-jobs/{job_id}")
+async def get_video_job(job_id: str, inline: bool = False):
+    """Status of a queued animation; once completed, its renditions (and the video itself with inline=true)"""
+    record = await video_jobs.refresh(job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found")
     
-    # Category-specific prompt enhancements optimized for Kling 2.5
-    category_prompts = {
-        "product": "premium commercial product showcase, studio lighting, clean background",
-        "electronics": "sleek modern electronics, premium materials, high-tech aesthetic",
-        "fashion": "stylish fashion photography, elegant presentation, premium quality",
-        "jewelry": "luxury jewelry showcase, sparkling details, premium lighting",
-        "cosmetics": "beauty product photography, elegant presentation, soft lighting",
-        "furniture": "modern furniture showcase, interior design aesthetic, premium materials",
-        "automotive": "automotive product showcase, sleek design, professional presentation",
-        "food": "appetizing food presentation, fresh ingredients, culinary artistry",
-        "sports": "dynamic sports equipment, athletic performance, energetic presentation",
-        "lifestyle": "lifestyle product integration, modern living, aspirational presentation"
+    response = {
+        "success": record["status"] != "failed",
+        "job_id": job_id,
+        "status": record["status"],
+        **record["metadata"]
     }
+    if record["status"] == "completed":
+        response["media"] = record["media"]
+        response["message"] = "Video generated successfully with FAL Kling 2.5"
+        if inline:
+            with open(video_store.rendition(record["video_id"], "original"), "rb") as f:
+                response["video"] = Base64Field(f.read())
+    elif record["status"] == "failed":
+        response["message"] = record.get("error", "Animation generation failed")
+    return StreamedJSONResponse(response)
+
+def batch_variants(request: dict):
+    """
+    The style/duration combinations of a batch request: explicit
+    `variants`, or every `styles` entry at `duration`
+    """
+    variants = request.get("variants")
+    if variants is None:
+        variants = [
+            {"animation_style": style, "duration": request.get("duration", "5")}
+            for style in request.get("styles", [])
+        ]
+    return [
+        {**request, "animation_style": variant.get("animation_style", "smooth_rotation"), "duration": str(variant.get("duration", "5"))}
+        for variant in variants
+    ]
+
+async def stream_batch(batch_id: str, first_line: dict = None):
+    """NDJSON lines: optionally a header, then each variant as its status changes"""
+    if first_line is not None:
+        yield json.dumps(first_line) + "\n"
+    async for variant in video_jobs.follow_batch(batch_id):
+        yield json.dumps(variant) + "\n"
+
+@app.post("/api/video-batches")
+async def submit_video_batch(request: dict):
+    """
+    Animate one image in several styles/durations at once
+    
+    All variants are queued at FAL concurrently (up to FAL_BATCH_CONCURRENCY
+    at a time), so exploring five styles takes about the time of one. The
+    response streams one JSON line per status change as variants complete;
+    GET /api/video-batches/{id} (or .../stream) picks the batch up again.
+    """
+    if not request.get("image_base64"):
+        return {"success": False, "message": "No image provided"}
+    if not os.getenv("FAL_KEY"):
+        return {"success": False, "message": "FAL API key not configured"}
+    
+    variants = batch_variants(request)
+    if not variants:
+        return {"success": False, "message": "No styles or variants requested"}
+    if len(variants) > BATCH_MAX_VARIANTS:
+        return {"success": False, "message": f"At most {BATCH_MAX_VARIANTS} variants per batch"}
     
-    # Animation style descriptions optimized for Kling 2.5
-    animation_styles = {
-        "smooth_rotation": "smooth 360-degree rotation, fluid camera movement, cinematic",
-        "gentle_float": "gentle floating motion, ethereal movement, soft transitions",
-        "dynamic_showcase": "dynamic product showcase, multiple angles, professional presentation",
-        "lifestyle_scene": "lifestyle integration, environmental context, natural movement",
-        "premium_reveal": "premium product reveal, dramatic lighting, luxury presentation",
-        "tech_demo": "technology demonstration, interactive elements, modern aesthetic",
-        "organic_flow": "organic flowing movement, natural transitions, smooth animation",
-        "dramatic_lighting": "dramatic lighting changes, cinematic atmosphere, mood enhancement",
-        "close_up_details": "detailed close-up shots, texture focus, premium quality reveal",
-        "environmental_context": "environmental integration, contextual placement, story-driven"
+    # A client may lower the budget, never raise it
+    budget = min(float(request.get("max_seconds", BATCH_MAX_SECONDS)), BATCH_MAX_SECONDS)
+    requested = sum(float(variant["duration"]) for variant in variants)
+    if requested > budget:
+        return {
+            "success": False,
+            "message": f"Batch requests {requested:.0f}s of video, over the {budget:.0f}s budget"
+        }
+    
+    # The first variant uploads the image; the others share that upload
+    jobs = await asyncio.gather(*(kling_job_request(variant) for variant in variants))
+    batch = video_jobs.start_batch(list(jobs), BATCH_CONCURRENCY)
+    
+    header = {
+        "success": True,
+        "batch_id": batch["batch_id"],
+        "status_url": f"/api/video-batches/{batch['batch_id']}",
+        "variants": len(variants),
+        "video_seconds": requested
+    }
+    return StreamingResponse(stream_batch(batch["batch_id"], header), media_type="application/x-ndjson")
+
+@app.get("/api/video-batches/{batch_id}")
+async def get_video_batch(batch_id: str):
+    """Current status of every variant in a batch"""
+    batch = video_jobs.get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    variants = video_jobs.batch_status(batch)
+    return {
+        "success": True,
+        "batch_id": batch_id,
+        "done": all(variant["status"] in ("completed", "failed") for variant in variants),
+        "variants": variants
     }
+
+@app.get("/api/video-batches/{batch_id}/stream")
+async def follow_video_batch(batch_id: str):
+    """Stream a batch's variants from their current status until all have finished"""
+    if video_jobs.get_batch(batch_id) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return StreamingResponse(stream_batch(batch_id), media_type="application/x-ndjson")
+
+@app.post("/api/fal-webhook/{job_id}")
+async def fal_webhook(job_id: str, request: Request, background_tasks: BackgroundTasks, sig: str = ""):
+    """Completion callback from the FAL queue; the URL carries an HMAC of the job id"""
+    if not video_jobs.verify(job_id, sig):
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body is not JSON")
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Webhook body is not a JSON object")
+    
+    # Acknowledge at once; downloading the video happens after the response
+    background_tasks.add_task(video_jobs.handle_webhook, job_id, body)
+    return {"received": True}
+
+def create_enhanced_prompt(base_prompt: str, category: str, animation_style: str) -> str:
+    """Create enhanced prompt based on product category and animation style"""
     
     # Build enhanced prompt
-    category_enhancement = category_prompts.get(category, category_prompts["product"])
-    style_enhancement = animation_styles.get(animation_style, animation_styles["smooth_rotation"])
+    category_enhancement = CATEGORY_PROMPTS.get(category, CATEGORY_PROMPTS["product"])
+    style_enhancement = ANIMATION_STYLES.get(animation_style, ANIMATION_STYLES["smooth_rotation"])
     
     enhanced_prompt = f"{base_prompt}, {category_enhancement}, {style_enhancement}, high quality, professional, smooth motion, commercial grade"
     
@@ -939,9 +1607,75 @@ def create_enhanced_prompt(base_prompt: str, category: str, animation_style: str
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Liveness check: the gateway process is up (see /ready for the upstream)"""
     return {"status": "healthy", "service": "Make3D Studio"}
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness check: Modal upstream warm/cold state and recent latency"""
+    upstream = upstream_warmer.stats()
+    if upstream["state"] == "unavailable":
+        return JSONResponse(status_code=503, content={"status": "unavailable", "upstream": upstream})
+    
+    # A cold upstream still serves requests, only slowly, so stay ready
+    return {"status": "ready", "upstream": upstream}
+
+@app.post("/api/prewarm")
+async def prewarm():
+    """Hint from the frontend that an AI edit is likely soon (e.g. an image was uploaded)"""
+    upstream_warmer.note_activity()
+    return {"state": upstream_warmer.state()}
+
+@app.get("/api/upstream-stats")
+async def upstream_stats():
+    """Circuit breaker state, retry/hedge counters and latency for Modal calls"""
+    stats = modal_upstream.stats()
+    stats["coalescing"] = generate_flight.stats()
+    stats["video_jobs"] = video_jobs.stats()
+    stats["fal_uploads"] = fal_storage.stats()
+    stats["cancellation"] = cancellations.stats()
+    return stats
+
+@app.get("/api/queue-status")
+async def queue_status():
+    """GPU queue depth, in-flight calls and estimated wait per priority class"""
+    return gpu_scheduler.stats()
+
+@app.post("/api/admin/profile")
+async def admin_profile(http_request: Request, seconds: float = 10, memory: bool = False, top: int = 25, idle: bool = False):
+    """
+    Profile this worker for `seconds` and return its hot functions
+    
+    Samples every thread's stack (see PROFILE_INTERVAL_MS) and writes the
+    samples as collapsed stacks, fetched from /api/admin/profiles/{id}.folded
+    for a flame graph. `memory` adds a tracemalloc diff over the window,
+    which slows the worker down while it runs; `idle` keeps samples of
+    waiting threads. With several gunicorn workers, "pid" says which one
+    answered.
+    """
+    require_admin(http_request)
+    if not 0 < seconds <= profiler.MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {profiler.MAX_SECONDS:g}")
+    
+    try:
+        profile = profiler.start(memory=memory, top=max(1, top), include_idle=idle)
+    except profiler.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        summary = await asyncio.to_thread(profiler.finish, profile)
+    return summary
+
+@app.get("/api/admin/profiles/{name}")
+async def admin_profile_file(name: str, http_request: Request):
+    """A written profile: {id}.folded (collapsed stacks) or {id}.json (summary)"""
+    require_admin(http_request)
+    path = profiler.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json" if name.endswith(".json") else "text/plain")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
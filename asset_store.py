@@ -0,0 +1,214 @@
+"""
+Content-addressed store for generated images
+Keeps each result once on disk and serves a WebP derivative pyramid
+(thumbnail/preview/large) that is rendered lazily on first request. The
+store is kept under a disk budget by evicting least recently used assets.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image
+
+# Longest side in pixels of each derivative; "original" serves the stored file
+DERIVATIVE_SIZES = (128, 512, 1024)
+WEBP_QUALITY = 80
+
+# Eviction frees space down to this fraction of the budget, so that it
+# runs in batches rather than on every store
+EVICT_TO = 0.9
+
+# Seconds between last-used updates of a file, which are its mtime
+TOUCH_INTERVAL = 60.0
+
+_ASSET_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class AssetStore:
+    """
+    Stores result images by content hash and renders derivatives on demand
+
+    Once the files in the store pass `max_bytes`, whole assets (original
+    and derivatives) are deleted, least recently served first. Each worker
+    tracks what it has written since its last scan, so the limit is
+    approximate with several workers.
+    """
+
+    def __init__(self, root: str = None, url_prefix: str = "/api/assets", max_bytes: int = None):
+        """
+        Args:
+            root: Store directory; defaults to ASSET_CACHE_DIR or .cache/assets
+            url_prefix: Route the derivatives are served under
+            max_bytes: Disk budget; defaults to ASSET_CACHE_MAX_MB (5 GiB),
+                0 for no limit
+        """
+        self.root = root or os.getenv("ASSET_CACHE_DIR", os.path.join(".cache", "assets"))
+        self.url_prefix = url_prefix
+        self.max_bytes = max_bytes if max_bytes is not None else int(float(os.getenv("ASSET_CACHE_MAX_MB", "5120")) * 1024 * 1024)
+        os.makedirs(self.root, exist_ok=True)
+        # Render locks with the number of threads using each
+        self._locks: Dict[str, List] = {}
+        self._locks_guard = threading.Lock()
+        self._size: Optional[int] = None
+        self._size_guard = threading.Lock()
+        self._evicting = threading.Lock()
+        self.evicted = 0
+
+    def _path(self, asset_id: str, size: str) -> str:
+        if size == "original":
+            return os.path.join(self.root, asset_id[:2], f"{asset_id}.png")
+        return os.path.join(self.root, asset_id[:2], f"{asset_id}_{size}.webp")
+
+    def _write_atomic(self, path: str, write) -> None:
+        """Write via a temp file + rename so concurrent workers never see partial files"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _touch(self, path: str) -> None:
+        """Mark a file as used now, for eviction order"""
+        try:
+            if time.time() - os.path.getmtime(path) > TOUCH_INTERVAL:
+                os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _scan(self) -> Dict[str, Tuple[float, int, List[str]]]:
+        """Asset id -> (last used, bytes, files) for every asset on disk"""
+        assets: Dict[str, Tuple[float, int, List[str]]] = {}
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                used, size, files = assets.get(entry.name[:32], (0.0, 0, []))
+                files.append(entry.path)
+                assets[entry.name[:32]] = (max(used, stat.st_mtime), size + stat.st_size, files)
+        return assets
+
+    def _added(self, nbytes: int) -> None:
+        """Account for a written file, evicting if the store is over budget"""
+        if self.max_bytes <= 0:
+            return
+        with self._size_guard:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan().values())
+            self._size += nbytes
+            over = self._size > self.max_bytes
+        if over and self._evicting.acquire(blocking=False):
+            try:
+                self._evict()
+            finally:
+                self._evicting.release()
+
+    def _evict(self) -> None:
+        assets = sorted(self._scan().values())
+        total = sum(size for _, size, _ in assets)
+        for _, size, files in assets:
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            for path in files:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
+            self.evicted += 1
+        with self._size_guard:
+            self._size = total
+
+    def put(self, image_bytes: bytes) -> str:
+        """Store encoded image bytes and return their asset id"""
+        asset_id = hashlib.sha256(image_bytes).hexdigest()[:32]
+        path = self._path(asset_id, "original")
+        if os.path.exists(path):
+            self._touch(path)
+        else:
+            self._write_atomic(path, lambda f: f.write(image_bytes))
+            self._added(len(image_bytes))
+        return asset_id
+
+    def urls(self, asset_id: str) -> Dict[str, str]:
+        """Derivative URLs keyed by size, for embedding in API responses"""
+        urls = {str(size): f"{self.url_prefix}/{asset_id}/{size}" for size in DERIVATIVE_SIZES}
+        urls["original"] = f"{self.url_prefix}/{asset_id}/original"
+        return urls
+
+    def register(self, image_bytes: bytes) -> Dict[str, object]:
+        """Store a result and return the reference block for its response"""
+        asset_id = self.put(image_bytes)
+        return {"id": asset_id, "derivatives": self.urls(asset_id)}
+
+    @contextmanager
+    def _locked(self, key: str) -> Iterator[None]:
+        """Hold the lock for key; it is dropped once no thread uses it"""
+        with self._locks_guard:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+    def derivative(self, asset_id: str, size: str) -> Optional[str]:
+        """
+        Path to the requested rendition, rendering and caching it if needed
+
+        Args:
+            asset_id: Id returned by put()
+            size: One of DERIVATIVE_SIZES (as a string) or "original"
+
+        Returns:
+            File path, or None if the asset or size is unknown
+        """
+        if not _ASSET_ID.match(asset_id):
+            return None
+        if size != "original" and size not in {str(s) for s in DERIVATIVE_SIZES}:
+            return None
+
+        original = self._path(asset_id, "original")
+        if not os.path.exists(original):
+            return None
+        # The original keeps the asset's derivatives renderable, so it is
+        # used whenever any of them is
+        self._touch(original)
+        if size == "original":
+            return original
+
+        path = self._path(asset_id, size)
+        if os.path.exists(path):
+            self._touch(path)
+            return path
+
+        # One render per derivative per process; other workers may race, but
+        # the atomic rename makes that harmless
+        with self._locked(f"{asset_id}_{size}"):
+            if not os.path.exists(path):
+                with Image.open(original) as img:
+                    if img.mode not in ("RGB", "RGBA"):
+                        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+                    img.thumbnail((int(size), int(size)), Image.LANCZOS)
+                    self._write_atomic(path, lambda f: img.save(f, format="WEBP", quality=WEBP_QUALITY, method=4))
+                self._added(os.path.getsize(path))
+        return path
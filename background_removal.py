@@ -0,0 +1,304 @@
+"""
+Background removal helpers for the basic edit endpoints
+CPU fast mode for studio shots on plain backgrounds, used on its own or as
+the fallback when rembg is not installed, and low-resolution rembg matting
+with guided-filter mask upsampling
+"""
+
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Longest side of the working image for mask estimation
+FAST_WORKING_SIZE = 512
+
+# rembg model used by the gateway and the resolution it segments at
+REMBG_MODEL = os.getenv("REMBG_MODEL", "u2net")
+REMBG_INPUT_SIZES = {
+    "u2net": 320,
+    "u2netp": 320,
+    "u2net_human_seg": 320,
+    "u2net_cloth_seg": 768,
+    "silueta": 320,
+    "isnet-general-use": 1024,
+    "isnet-anime": 1024,
+    "birefnet-general": 1024,
+    "birefnet-general-lite": 1024,
+}
+
+# Longest side of the guide image the matting refinement is solved at
+MATTING_REFINE_SIZE = 1024
+
+# Rows per band when applying the refinement at full resolution
+MATTING_STRIP_ROWS = 256
+
+_rembg_sessions = {}
+
+
+def _working_copy(rgb: np.ndarray, max_side: int):
+    """
+    Downscale by an integer factor so the longest side is at most max_side
+
+    An exact integer factor keeps cv2.INTER_AREA on its fast box-filter
+    path; the few rows/columns that don't fill a whole block are dropped.
+
+    The factor never exceeds the shorter side, so extreme aspect ratios
+    (e.g. 3x5000) keep at least one pixel across rather than vanishing.
+
+    Returns:
+        (small, factor)
+    """
+    h, w = rgb.shape[:2]
+    factor = max(1, min(-(-max(h, w) // max_side), h, w))
+    if factor == 1:
+        return rgb, factor
+    cropped = rgb[:h // factor * factor, :w // factor * factor]
+    size = (w // factor, h // factor)
+    return cv2.resize(cropped, size, interpolation=cv2.INTER_AREA), factor
+
+
+def _upsample_mask(mask: np.ndarray, factor: int, shape) -> np.ndarray:
+    """Inverse of _working_copy for a single-channel mask"""
+    if factor == 1:
+        return mask
+    h, w = shape
+    small_h, small_w = mask.shape
+    mask = cv2.resize(mask, (small_w * factor, small_h * factor), interpolation=cv2.INTER_LINEAR)
+    return cv2.copyMakeBorder(mask, 0, h - mask.shape[0], 0, w - mask.shape[1], cv2.BORDER_REPLICATE)
+
+
+def _border_pixels(img: np.ndarray, width: int) -> np.ndarray:
+    """All pixels within `width` of any edge, as an (N, channels) array"""
+    channels = img.shape[2]
+    return np.concatenate([
+        img[:width].reshape(-1, channels),
+        img[-width:].reshape(-1, channels),
+        img[width:-width, :width].reshape(-1, channels),
+        img[width:-width, -width:].reshape(-1, channels),
+    ])
+
+
+def estimate_background(lab: np.ndarray, border: int = 4):
+    """
+    Estimate the background colour from all four borders
+
+    Returns:
+        (colour, spread): median Lab colour of the border and the median
+        absolute deviation of border pixels from it
+    """
+    border = max(1, min(border, min(lab.shape[:2]) // 4))
+    pixels = _border_pixels(lab, border).astype(np.float32)
+    color = np.median(pixels, axis=0)
+    spread = float(np.median(np.linalg.norm(pixels - color, axis=1)))
+    return color, spread
+
+
+def _border_connected(mask: np.ndarray) -> np.ndarray:
+    """Keep only the regions of a binary mask that touch the image border"""
+    _, labels = cv2.connectedComponents(mask.astype(np.uint8), connectivity=4)
+    edge_labels = np.unique(np.concatenate([
+        labels[0], labels[-1], labels[:, 0], labels[:, -1]
+    ]))
+    edge_labels = edge_labels[edge_labels != 0]
+    return np.isin(labels, edge_labels)
+
+
+def fast_mask(
+    rgb: np.ndarray,
+    tolerance: float = 12.0,
+    grabcut_iterations: int = 0,
+    feather: float = 1.5,
+    working_size: int = FAST_WORKING_SIZE
+) -> np.ndarray:
+    """
+    Foreground mask for a product on a plain background
+
+    The mask is computed at reduced resolution: pixels close to the border
+    colour (in Lab, so the distance is perceptual and cannot wrap around)
+    and connected to the border are background, optionally refined with a
+    short GrabCut. It is then feathered and upsampled to full resolution.
+
+    Args:
+        rgb: uint8 RGB array
+        tolerance: Minimum Lab distance from the background colour that
+            counts as foreground; widened automatically for noisy backdrops
+        grabcut_iterations: GrabCut refinement passes; 0 (the default)
+            keeps to the flood-fill mask, which is enough for studio shots
+        feather: Edge softening radius in working-resolution pixels
+        working_size: Longest side of the working image
+
+    Returns:
+        uint8 alpha mask at the input resolution (255 = foreground)
+    """
+    small, factor = _working_copy(rgb, working_size)
+    lab = cv2.cvtColor(small, cv2.COLOR_RGB2LAB)
+
+    bg_color, spread = estimate_background(lab)
+    threshold = max(tolerance, 3.0 * spread)
+    distance = np.linalg.norm(lab.astype(np.float32) - bg_color, axis=2)
+
+    background = _border_connected(distance < threshold)
+
+    if grabcut_iterations > 0 and background.any() and not background.all():
+        gc_mask = np.where(background, cv2.GC_PR_BGD, cv2.GC_PR_FGD).astype(np.uint8)
+        gc_mask[background & (distance < threshold / 2)] = cv2.GC_BGD
+        gc_mask[distance > threshold * 3] = cv2.GC_FGD
+        bgd_model = np.zeros((1, 65), np.float64)
+        fgd_model = np.zeros((1, 65), np.float64)
+        try:
+            cv2.grabCut(small, gc_mask, None, bgd_model, fgd_model,
+                        grabcut_iterations, cv2.GC_INIT_WITH_MASK)
+            background = (gc_mask == cv2.GC_BGD) | (gc_mask == cv2.GC_PR_BGD)
+        except cv2.error:
+            # GrabCut needs samples of both classes to fit its models
+            pass
+
+    mask = np.where(background, 0, 255).astype(np.uint8)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+
+    if feather > 0:
+        mask = cv2.GaussianBlur(mask, (0, 0), feather)
+    return _upsample_mask(mask, factor, rgb.shape[:2])
+
+
+def apply_mask(img: Image.Image, mask: np.ndarray, rgb: np.ndarray = None) -> Image.Image:
+    """
+    Attach a mask as alpha, keeping any transparency the image already has
+
+    Pass the RGB array if the caller already has it to skip a conversion.
+    """
+    if img.mode == "RGBA":
+        rgba = np.array(img)
+        np.minimum(rgba[:, :, 3], mask, out=rgba[:, :, 3])
+    else:
+        if rgb is None:
+            rgb = np.asarray(img.convert("RGB"))
+        rgba = cv2.cvtColor(rgb, cv2.COLOR_RGB2RGBA)
+        rgba[:, :, 3] = mask
+    return Image.fromarray(rgba, "RGBA")
+
+
+def remove_background_fast(img: Image.Image, **options) -> Image.Image:
+    """CPU fast mode: see fast_mask for the available options"""
+    rgb = np.asarray(img.convert("RGB"))
+    return apply_mask(img, fast_mask(rgb, **options), rgb)
+
+
+def get_rembg_session(model_name: str = REMBG_MODEL):
+    """
+    rembg session for model_name, created once per process
+
+    rembg.remove() loads the ONNX model on every call when no session is
+    passed, so callers should always go through this.
+    """
+    if model_name not in _rembg_sessions:
+        from rembg import new_session
+        _rembg_sessions[model_name] = new_session(model_name)
+    return _rembg_sessions[model_name]
+
+
+def _box(x: np.ndarray, radius: int) -> np.ndarray:
+    return cv2.boxFilter(x, -1, (2 * radius + 1, 2 * radius + 1), borderType=cv2.BORDER_REFLECT)
+
+
+def guided_upsample(
+    mask: np.ndarray,
+    rgb: np.ndarray,
+    radius: int = 8,
+    eps: float = 1e-4,
+    levels=(0.1, 0.9),
+    refine_size: int = MATTING_REFINE_SIZE,
+    strip_rows: int = MATTING_STRIP_ROWS
+) -> np.ndarray:
+    """
+    Upsample a low-resolution alpha mask to full resolution, snapping its
+    edges to the full-resolution image
+
+    This is a fast guided filter (He & Sun, 2015): the local linear model
+    alpha = a * I + b is solved on a downscaled guide, and only the
+    smooth coefficients are upsampled. The full-resolution pass runs in
+    horizontal strips, so float intermediates are bounded by strip size
+    rather than image size.
+
+    Coefficients interpolated across the guide's pixel grid leave a short
+    ramp just inside hard edges, so the result is finally stretched so that
+    `levels` map to fully transparent/opaque.
+
+    Args:
+        mask: uint8 alpha mask at any resolution (255 = foreground)
+        rgb: Full-resolution uint8 RGB array used as the guide
+        radius: Filter radius in guide pixels
+        eps: Regularisation; smaller values follow image edges more closely
+        levels: (low, high) alpha values that become 0 and 1
+        refine_size: Longest side of the guide the coefficients are solved at
+        strip_rows: Rows per band in the full-resolution pass
+
+    Returns:
+        uint8 alpha mask at the resolution of rgb
+    """
+    h, w = rgb.shape[:2]
+    guide, factor = _working_copy(rgb, refine_size)
+    gh, gw = guide.shape[:2]
+
+    I = cv2.cvtColor(guide, cv2.COLOR_RGB2GRAY).astype(np.float32) * (1.0 / 255)
+    p = cv2.resize(mask, (gw, gh), interpolation=cv2.INTER_LINEAR).astype(np.float32) * (1.0 / 255)
+
+    mean_I = _box(I, radius)
+    mean_p = _box(p, radius)
+    cov_Ip = _box(I * p, radius) - mean_I * mean_p
+    var_I = _box(I * I, radius) - mean_I * mean_I
+    a = cov_Ip / (var_I + eps)
+    b = mean_p - a * mean_I
+    mean_a = _box(a, radius)
+    mean_b = _box(b, radius)
+
+    low = levels[0] * 255
+    gain = 1.0 / (levels[1] - levels[0])
+    alpha = np.empty((h, w), dtype=np.uint8)
+    inv = 1.0 / factor
+    for y0 in range(0, h, strip_rows):
+        y1 = min(h, y0 + strip_rows)
+        # Inverse map from strip pixel centres to guide pixel centres,
+        # matching cv2.resize's bilinear sampling
+        to_guide = np.float32([
+            [inv, 0, 0.5 * inv - 0.5],
+            [0, inv, (y0 + 0.5) * inv - 0.5],
+        ])
+        flags = cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP
+        strip_a = cv2.warpAffine(mean_a, to_guide, (w, y1 - y0), flags=flags, borderMode=cv2.BORDER_REPLICATE)
+        strip_b = cv2.warpAffine(mean_b, to_guide, (w, y1 - y0), flags=flags, borderMode=cv2.BORDER_REPLICATE)
+
+        # alpha * 255 = a * (I * 255) + b * 255, then stretched to the levels
+        strip_I = cv2.cvtColor(rgb[y0:y1], cv2.COLOR_RGB2GRAY).astype(np.float32)
+        q = strip_a * strip_I
+        q += strip_b * 255 - low
+        q *= gain
+        np.clip(q, 0, 255, out=q)
+        alpha[y0:y1] = q.astype(np.uint8)
+    return alpha
+
+
+def matting_mask(rgb: np.ndarray, model_name: str = REMBG_MODEL, **options) -> np.ndarray:
+    """
+    rembg foreground mask computed at the model's native input size
+
+    rembg resizes its input to the model resolution internally anyway, so
+    segmenting a downscaled copy loses nothing; the mask is then brought
+    back to full resolution with guided_upsample (options are passed on).
+    """
+    from rembg import remove
+
+    input_size = REMBG_INPUT_SIZES.get(model_name, 1024)
+    small, _ = _working_copy(rgb, input_size)
+    mask = remove(Image.fromarray(small), session=get_rembg_session(model_name), only_mask=True)
+    return guided_upsample(np.asarray(mask.convert("L")), rgb, **options)
+
+
+def remove_background_matting(img: Image.Image, **options) -> Image.Image:
+    """Low-resolution rembg matting: see matting_mask for the available options"""
+    rgb = np.asarray(img.convert("RGB"))
+    return apply_mask(img, matting_mask(rgb, **options), rgb)
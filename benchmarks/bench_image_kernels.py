@@ -0,0 +1,155 @@
+"""
+Benchmark: PIL ImageEnhance/ImageFilter chains vs fused image_kernels
+Runs each variant in a fresh subprocess on a synthetic 12 MP image and
+reports wall time, peak RSS growth and deviation from the PIL output
+
+Usage:
+    python benchmarks/bench_image_kernels.py [--width 4000] [--height 3000] [--repeat 3]
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageFilter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import image_kernels  # noqa: E402
+
+
+def make_image(width: int, height: int) -> Image.Image:
+    """Synthetic product-like photo: gradients, flat regions and sensor noise"""
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+    arr = np.dstack((xx / width * 255, yy / height * 255, (xx + yy) / (width + height) * 255))
+    cy, cx, r = height // 2, width // 2, min(width, height) // 4
+    arr[(yy - cy) ** 2 + (xx - cx) ** 2 < r * r] = (200, 40, 30)
+    arr += rng.normal(0, 6, arr.shape).astype(np.float32)
+    return Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8), "RGB")
+
+
+def pil_adjust(img):
+    img = ImageEnhance.Brightness(img).enhance(1.3)
+    img = ImageEnhance.Contrast(img).enhance(1.2)
+    return ImageEnhance.Color(img).enhance(1.1)
+
+
+def pil_enhance(img):
+    img = img.filter(ImageFilter.UnsharpMask(radius=1, percent=150, threshold=3))
+    img = img.filter(ImageFilter.GaussianBlur(radius=0.5))
+    img = img.filter(ImageFilter.SHARPEN)
+    return ImageEnhance.Sharpness(img).enhance(1.2)
+
+
+def fused_adjust(img):
+    return image_kernels.from_array(image_kernels.adjust(image_kernels.to_array(img)))
+
+
+def fused_enhance(img):
+    return image_kernels.from_array(image_kernels.enhance(image_kernels.to_array(img)))
+
+
+VARIANTS = {
+    "pil_adjust": pil_adjust,
+    "fused_adjust": fused_adjust,
+    "pil_enhance": pil_enhance,
+    "fused_enhance": fused_enhance,
+}
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_variant(name: str, source: str, repeat: int) -> dict:
+    """Child process body: time one variant and report peak RSS growth"""
+    # Decode the pre-rendered pixels so image synthesis doesn't set the RSS peak
+    img = Image.open(source)
+    img.load()
+    baseline = max_rss_mb()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = VARIANTS[name](img)
+        timings.append(time.perf_counter() - start)
+        del out
+
+    return {"name": name, "seconds": min(timings), "peak_mb": max_rss_mb() - baseline}
+
+
+def deviation(img: Image.Image) -> dict:
+    """Mean and 99.9th percentile absolute error of fused vs PIL (interior pixels)"""
+    report = {}
+    for op in ("adjust", "enhance"):
+        reference = np.asarray(VARIANTS[f"pil_{op}"](img), dtype=np.int16)
+        fused = np.asarray(VARIANTS[f"fused_{op}"](img), dtype=np.int16)
+        # PIL's 3x3 filters leave the outermost pixels unfiltered
+        diff = np.abs(reference - fused)[3:-3, 3:-3]
+        report[op] = {"mean": float(diff.mean()), "p99.9": float(np.percentile(diff, 99.9))}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark fused image kernels against PIL")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--variant", help=argparse.SUPPRESS)
+    parser.add_argument("--source", help=argparse.SUPPRESS)
+    parser.add_argument("--render", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.render:
+        make_image(args.width, args.height).save(args.source)
+        return
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.source, args.repeat)))
+        return
+
+    # Linux children inherit the parent's ru_maxrss, so keep the parent small
+    # and synthesise the source image in its own process
+    source = os.path.join(tempfile.mkdtemp(), "source.ppm")
+    subprocess.run(
+        [sys.executable, __file__, "--render", "--source", source,
+         "--width", str(args.width), "--height", str(args.height)],
+        check=True
+    )
+
+    megapixels = args.width * args.height / 1e6
+    print(f"Image: {args.width}x{args.height} ({megapixels:.1f} MP), best of {args.repeat}")
+
+    results = {}
+    for name in VARIANTS:
+        proc = subprocess.run(
+            [sys.executable, __file__, "--variant", name, "--source", source, "--repeat", str(args.repeat)],
+            capture_output=True, text=True, check=True
+        )
+        results[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    print(f"{'variant':<16}{'time (s)':>10}{'peak +RSS (MB)':>16}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['seconds']:>10.3f}{r['peak_mb']:>16.1f}")
+
+    for op in ("adjust", "enhance"):
+        pil, fused = results[f"pil_{op}"], results[f"fused_{op}"]
+        print(f"{op}: {pil['seconds'] / fused['seconds']:.1f}x faster, "
+              f"{pil['peak_mb'] - fused['peak_mb']:.0f} MB less peak memory")
+
+    img = Image.open(source)
+    for op, err in deviation(img).items():
+        print(f"{op}: mean abs error {err['mean']:.2f}, p99.9 {err['p99.9']:.0f} (8-bit levels)")
+
+    os.remove(source)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Benchmark: gateway import time and multi-worker memory, with and without
+gunicorn preload
+Reports the slowest imports under app.py (python -X importtime), then boots
+gunicorn in each mode and reports time to first healthy response and the
+RSS/PSS summed over the master and its workers. PSS counts shared pages
+once, so it shows what copy-on-write sharing saves.
+
+Usage:
+    python benchmarks/bench_startup.py [--workers 4] [--top 15] [--modes preload,no-preload]
+"""
+
+import argparse
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+
+def import_profile(top: int) -> None:
+    """Print total import time of app.py and its slowest direct imports"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c",
+         "import resource, app; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        sys.exit("import app failed")
+
+    entries = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            # importtime indents by two spaces per nesting level
+            depth = len(match[3]) // 2
+            entries.append((depth, int(match[1]), int(match[2]), match[4]))
+
+    app_entry = next(e for e in entries if e[3] == "app" and e[0] == 0)
+    # Entries are printed after their children, so app's direct imports
+    # are the depth-1 lines before it
+    direct = [e for e in entries[:entries.index(app_entry)] if e[0] == 1]
+
+    print(f"python -c 'import app': {elapsed:.2f}s wall, "
+          f"{app_entry[2] / 1e3:.0f} ms importing app, "
+          f"{int(result.stdout.split()[-1]) / 1024:.0f} MB RSS")
+    print(f"{'module':<32} {'cumulative':>12} {'self':>10}")
+    for _, self_us, cumulative_us, name in sorted(direct, key=lambda e: -e[2])[:top]:
+        print(f"{name:<32} {cumulative_us / 1e3:>9.1f} ms {self_us / 1e3:>7.1f} ms")
+    print(f"{'app (own code)':<32} {'':>12} {app_entry[1] / 1e3:>7.1f} ms")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _children(pid: int):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except FileNotFoundError:
+        return []
+
+
+def _memory_kb(pid: int):
+    """(Rss, Pss) in KiB from smaps_rollup"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in ("Rss", "Pss"):
+                values[name] = int(rest.split()[0])
+    return values.get("Rss", 0), values.get("Pss", 0)
+
+
+def boot_gunicorn(preload: bool, workers: int, timeout: float = 120.0) -> dict:
+    """Start gunicorn, wait until every worker is up, measure, stop it"""
+    port = _free_port()
+    env = dict(os.environ, PRELOAD_APP="1" if preload else "0", WEB_CONCURRENCY=str(workers))
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "app:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        first_response = None
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200 and first_response is None:
+                        first_response = time.perf_counter() - started
+            except OSError:
+                pass
+            if first_response is not None and len(_children(server.pid)) >= workers:
+                break
+            time.sleep(0.05)
+        else:
+            raise RuntimeError("gunicorn did not become healthy")
+
+        # Let the remaining workers finish booting before measuring
+        time.sleep(2.0)
+        pids = [server.pid] + _children(server.pid)
+        rss = pss = 0
+        for pid in pids:
+            pid_rss, pid_pss = _memory_kb(pid)
+            rss += pid_rss
+            pss += pid_pss
+        return {"first_response": first_response, "processes": len(pids), "rss_mb": rss / 1024, "pss_mb": pss / 1024}
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--top", type=int, default=15, help="Slowest direct imports to list")
+    parser.add_argument("--modes", default="preload,no-preload")
+    args = parser.parse_args()
+
+    import_profile(args.top)
+
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        print("\ngunicorn is not installed, skipping the worker comparison")
+        return
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        print("\n/proc/<pid>/smaps_rollup is not available, skipping the worker comparison")
+        return
+
+    print(f"\n{'mode':<12} {'first 200':>10} {'processes':>10} {'RSS':>10} {'PSS':>10}")
+    for mode in args.modes.split(","):
+        result = boot_gunicorn(mode == "preload", args.workers)
+        print(f"{mode:<12} {result['first_response']:>9.2f}s {result['processes']:>10} "
+              f"{result['rss_mb']:>7.0f} MB {result['pss_mb']:>7.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
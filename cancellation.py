@@ -0,0 +1,121 @@
+"""
+Cancellation of GPU requests nobody is waiting for any more
+Watches a request's client connection and its session's newer requests,
+cancels the request's task when it is abandoned, and stops the upstream
+FluxKontext job at its next denoising step, counting the steps that were
+wasted and saved
+"""
+
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+from starlette.requests import Request
+
+# Seconds between checks of whether the client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+
+
+class RequestCancelled(Exception):
+    """The request was abandoned; `reason` is "client_disconnected" or "superseded" """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CancellationTracker:
+    """
+    Cancels abandoned requests and keeps the counters
+
+    A request is abandoned when its client disconnects, or when a newer
+    request arrives from the same session (X-Session-Id), e.g. the user
+    changed the prompt and pressed Generate again.
+    """
+
+    def __init__(self):
+        self.counters = Counter()
+        self._sessions: Dict[str, asyncio.Future] = {}
+        self._reasons: Dict[asyncio.Future, str] = {}
+
+    async def _watch(self, http_request: Request, task: asyncio.Future) -> None:
+        while not await http_request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+        if not task.done():
+            self.counters["client_disconnected"] += 1
+            self._reasons[task] = "client_disconnected"
+            task.cancel()
+
+    async def run(self, http_request: Request, work: Awaitable[Any], session: Optional[str] = None) -> Any:
+        """
+        Await `work`, cancelling it if the client goes away or the session
+        sends a newer request
+
+        Raises:
+            RequestCancelled: `work` was cancelled for one of those reasons
+        """
+        task = asyncio.ensure_future(work)
+        if session:
+            previous = self._sessions.get(session)
+            if previous is not None and not previous.done():
+                self.counters["superseded"] += 1
+                self._reasons[previous] = "superseded"
+                previous.cancel()
+            self._sessions[session] = task
+
+        watcher = asyncio.ensure_future(self._watch(http_request, task))
+        try:
+            return await task
+        except asyncio.CancelledError:
+            reason = self._reasons.get(task)
+            if reason is None:
+                # This handler itself was cancelled (server shutdown)
+                task.cancel()
+                raise
+            raise RequestCancelled(reason)
+        finally:
+            watcher.cancel()
+            self._reasons.pop(task, None)
+            if session and self._sessions.get(session) is task:
+                del self._sessions[session]
+
+    def abandon(
+        self,
+        job_id: str,
+        call: asyncio.Future,
+        send_cancel: Callable[[str], Awaitable[bool]],
+        requested_steps: int
+    ) -> asyncio.Future:
+        """
+        Stop an upstream generation whose caller has gone
+
+        Sends the cancel, then lets the call finish in the background
+        (quickly, once the job sees its flag) to record how many steps ran.
+        Returns the task, which ends when the GPU is free again.
+        """
+        self.counters["cancelled_upstream"] += 1
+
+        async def wind_down():
+            await send_cancel(job_id)
+            try:
+                response = await call
+                result = response.json() if response.status_code == 200 else {}
+            except (httpx.HTTPError, ValueError):
+                result = {}
+            total = result.get("steps_total", requested_steps)
+            completed = result.get("steps_completed", total)
+            if result.get("cancelled"):
+                self.counters["aborted_on_gpu"] += 1
+            else:
+                # Finished (or failed) before the flag was seen
+                self.counters["finished_unwanted"] += 1
+            self.counters["wasted_steps"] += completed
+            self.counters["saved_steps"] += max(0, total - completed)
+
+        return asyncio.ensure_future(wind_down())
+
+    def stats(self) -> Dict[str, Any]:
+        counters = dict(self.counters)
+        counters["waiting_sessions"] = len(self._sessions)
+        return counters
@@ -0,0 +1,453 @@
+"""
+Resumable catalog pipeline
+Walks a directory (or a manifest listing image paths) of product photos
+and runs each through background removal, square crop and enhance, then
+colour variants and lifestyle mockups. Local edits run in a process pool
+on every core; GPU-bound stages go through the gateway (so they share its
+scheduler, single-flight and circuit breaker) several at a time.
+
+Every finished output is checkpointed to pipeline-manifest.jsonl in the
+output directory, keyed by the content hash of its input and its stage
+parameters, so an interrupted or repeated run only redoes work whose
+input or settings changed.
+
+Usage:
+    python catalog_pipeline.py photos/ --out catalog/ \\
+        [--edits remove-background,crop,enhance] [--colors "#c0392b,#2c3e50"] \\
+        [--color-mode fast|flux] [--lifestyle living-room:modern,kitchen:rustic] \\
+        [--gateway http://localhost:8000] [--workers 0] [--gpu-concurrency 4] [--force]
+"""
+
+import argparse
+import asyncio
+import base64
+import functools
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import httpx
+from PIL import Image
+
+import bulk_edit
+import recolor
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".tif", ".tiff", ".bmp")
+
+MANIFEST_NAME = "pipeline-manifest.jsonl"
+
+# GPU calls through the gateway wait in its queue behind interactive edits
+GATEWAY_TIMEOUT = 600.0
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def unit_key(input_hash: str, unit: str, params: Any) -> str:
+    """Identity of one output: what it was made from and how"""
+    return hashlib.sha256(json.dumps([input_hash, unit, params], sort_keys=True).encode()).hexdigest()
+
+
+def find_sources(source: str) -> List[Dict[str, str]]:
+    """
+    Products to process, as {"sku", "path"}
+
+    A directory is walked recursively and each image's SKU is its path
+    relative to the directory without extension. Any other file is read as
+    a manifest: one image path per line (relative to the manifest), or JSON
+    lines with "path" and optionally "sku"; blank lines and # comments are
+    skipped.
+    """
+    products = []
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(root, name)
+                    sku = os.path.splitext(os.path.relpath(path, source))[0]
+                    products.append({"sku": sku.replace(os.sep, "/"), "path": path})
+        return products
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line) if line.startswith("{") else {"path": line}
+            path = os.path.join(base, entry["path"])
+            products.append({"sku": entry.get("sku") or os.path.splitext(os.path.basename(path))[0], "path": path})
+    return products
+
+
+def recolor_file(path: str, colors: List[str]) -> List[bytes]:
+    """Pool task: PNG of the image at `path` in each colour, segmenting it once"""
+    with Image.open(path) as img:
+        img.load()
+        variants = recolor.recolor_variants(img, colors)
+    encoded = []
+    for variant in variants:
+        buffer = io.BytesIO()
+        variant.save(buffer, format="PNG", compress_level=1)
+        encoded.append(buffer.getvalue())
+    return encoded
+
+
+class Manifest:
+    """
+    Append-only checkpoint of finished outputs
+
+    Each line records one unit of one product (its key, output file and
+    output hash). Lines are flushed as they are written, so a killed run
+    loses at most the unit in progress; a torn last line is ignored.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.records[f"{record['sku']}|{record['unit']}"] = record
+        self._file = open(path, "a")
+
+    def done(self, sku: str, unit: str, key: str, out_dir: str) -> Optional[Dict[str, Any]]:
+        """The unit's record if it finished with this key and its output still exists"""
+        record = self.records.get(f"{sku}|{unit}")
+        if record is None or record.get("status") != "done" or record.get("key") != key:
+            return None
+        if not os.path.exists(os.path.join(out_dir, record["output"])):
+            return None
+        return record
+
+    def write(self, record: Dict[str, Any]) -> None:
+        self.records[f"{record['sku']}|{record['unit']}"] = record
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class Progress:
+    """Units done, skipped and failed, with throughput and ETA"""
+
+    def __init__(self, products: int, units_per_product: int):
+        self.products = products
+        self.total = products * units_per_product
+        self.products_done = 0
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.started = time.monotonic()
+
+    def report(self, sku: str) -> None:
+        self.products_done += 1
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = self.total - self.done - self.skipped - self.failed
+        eta = f"{int(remaining / rate) // 60}m{int(remaining / rate) % 60:02d}s" if rate > 0 else "--"
+        width = len(str(self.products))
+        print(
+            f"[{self.products_done:>{width}}/{self.products}] {sku}: "
+            f"{self.done} done, {self.skipped} up to date, {self.failed} failed | "
+            f"{rate:.2f} outputs/s, ETA {eta}",
+            flush=True
+        )
+
+
+class Pipeline:
+    def __init__(self, args: argparse.Namespace):
+        self.out_dir = args.out
+        self.operations = bulk_edit.validate([{"op": op} for op in args.edits]) if args.edits else []
+        self.colors = args.colors
+        self.color_mode = args.color_mode
+        self.lifestyle = args.lifestyle
+        self.force = args.force
+        self.workers = args.workers or (os.cpu_count() or 1)
+        self.gateway = args.gateway.rstrip("/")
+        self.gpu = asyncio.Semaphore(args.gpu_concurrency)
+        self.manifest = Manifest(os.path.join(self.out_dir, MANIFEST_NAME))
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=bulk_edit.init_process
+        )
+        self.client = httpx.AsyncClient(
+            timeout=GATEWAY_TIMEOUT,
+            headers={"X-Priority": "bulk", "X-Client-Id": "catalog-pipeline"}
+        )
+        self.progress: Optional[Progress] = None
+
+    def units_per_product(self) -> int:
+        return bool(self.operations) + len(self.colors) + len(self.lifestyle)
+
+    def _write_atomic(self, relative: str, data: bytes) -> str:
+        path = os.path.join(self.out_dir, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return hashlib.sha256(data).hexdigest()
+
+    def _up_to_date(self, sku: str, unit: str, key: str) -> Optional[Dict[str, Any]]:
+        if self.force:
+            return None
+        record = self.manifest.done(sku, unit, key, self.out_dir)
+        if record is not None:
+            self.progress.skipped += 1
+        return record
+
+    def _finish(self, sku: str, unit: str, key: str, output: str, data: bytes, started: float) -> Dict[str, Any]:
+        record = {
+            "sku": sku,
+            "unit": unit,
+            "key": key,
+            "status": "done",
+            "output": output,
+            "sha256": self._write_atomic(output, data),
+            "seconds": round(time.monotonic() - started, 3),
+            "finished_at": time.time()
+        }
+        self.manifest.write(record)
+        self.progress.done += 1
+        return record
+
+    def _fail(self, sku: str, unit: str, key: str, error: Exception) -> None:
+        print(f"{sku} {unit} failed: {str(error)}", file=sys.stderr)
+        self.manifest.write({"sku": sku, "unit": unit, "key": key, "status": "failed", "error": str(error), "finished_at": time.time()})
+        self.progress.failed += 1
+
+    async def _gateway(self, path: str, payload: Dict[str, Any], pick) -> bytes:
+        """PNG bytes from a gateway endpoint; `pick` selects the image from its response"""
+        async with self.gpu:
+            response = await self.client.post(f"{self.gateway}{path}", params={"inline": "true"}, json=payload)
+        response.raise_for_status()
+        result = response.json()
+        if not result.get("success"):
+            raise RuntimeError(result.get("error") or result.get("message") or "Gateway request failed")
+        image = pick(result)
+        return base64.b64decode(image.split(",", 1)[1] if image.startswith("data:") else image)
+
+    async def prepare(self, product: Dict[str, str]) -> Optional[Dict[str, str]]:
+        """The edited product image as {"path", "sha256"}, or the source if no edits are set"""
+        sku = product["sku"]
+        source_hash = await asyncio.to_thread(sha256_file, product["path"])
+        if not self.operations:
+            return {"path": product["path"], "sha256": source_hash}
+
+        key = unit_key(source_hash, "prepare", self.operations)
+        record = self._up_to_date(sku, "prepare", key)
+        if record is None:
+            started = time.monotonic()
+            try:
+                loop = asyncio.get_running_loop()
+                png = await loop.run_in_executor(self.pool, functools.partial(
+                    bulk_edit.process, self.operations, path=product["path"]
+                ))
+                record = self._finish(sku, "prepare", key, f"{sku}/prepared.png", png, started)
+            except Exception as e:
+                self._fail(sku, "prepare", key, e)
+                return None
+        return {"path": os.path.join(self.out_dir, record["output"]), "sha256": record["sha256"]}
+
+    async def color_variants(self, sku: str, prepared: Dict[str, str]) -> None:
+        todo = []
+        for color in self.colors:
+            unit = f"color:{color}"
+            key = unit_key(prepared["sha256"], unit, self.color_mode)
+            if self._up_to_date(sku, unit, key) is None:
+                todo.append((color, unit, key))
+        if not todo:
+            return
+
+        name = lambda color: f"{sku}/color-{color.lstrip('#').lower()}.png"
+        if self.color_mode == "fast":
+            # One pool task segments the product once for all its colours
+            started = time.monotonic()
+            loop = asyncio.get_running_loop()
+            try:
+                variants = await loop.run_in_executor(
+                    self.pool, recolor_file, prepared["path"], [color for color, _, _ in todo]
+                )
+            except Exception as e:
+                for color, unit, key in todo:
+                    self._fail(sku, unit, key, e)
+                return
+            for (color, unit, key), png in zip(todo, variants):
+                try:
+                    self._finish(sku, unit, key, name(color), png, started)
+                except Exception as e:
+                    self._fail(sku, unit, key, e)
+            return
+
+        image_base64 = base64.b64encode(await asyncio.to_thread(_read, prepared["path"])).decode()
+
+        async def flux_variant(color: str, unit: str, key: str):
+            started = time.monotonic()
+            try:
+                png = await self._gateway(
+                    "/api/color-variations",
+                    {"image_base64": image_base64, "colors": [color], "num_variations": 1, "mode": "flux"},
+                    lambda result: result["variants"][0]["image"]
+                )
+                self._finish(sku, unit, key, name(color), png, started)
+            except Exception as e:
+                self._fail(sku, unit, key, e)
+
+        await asyncio.gather(*(flux_variant(*entry) for entry in todo))
+
+    async def lifestyle_mockups(self, sku: str, prepared: Dict[str, str]) -> None:
+        todo = []
+        for scene, style in self.lifestyle:
+            unit = f"lifestyle:{scene}:{style}"
+            key = unit_key(prepared["sha256"], unit, "composite")
+            if self._up_to_date(sku, unit, key) is None:
+                todo.append((scene, style, unit, key))
+        if not todo:
+            return
+
+        image_base64 = base64.b64encode(await asyncio.to_thread(_read, prepared["path"])).decode()
+
+        async def mockup(scene: str, style: str, unit: str, key: str):
+            started = time.monotonic()
+            try:
+                png = await self._gateway(
+                    "/api/lifestyle-mockup",
+                    {"image_base64": image_base64, "scene": scene, "style": style, "mode": "composite"},
+                    lambda result: result["image"]
+                )
+                self._finish(sku, unit, key, f"{sku}/lifestyle-{scene}-{style}.png", png, started)
+            except Exception as e:
+                self._fail(sku, unit, key, e)
+
+        await asyncio.gather(*(mockup(*entry) for entry in todo))
+
+    async def run_product(self, product: Dict[str, str]) -> None:
+        sku = product["sku"]
+        try:
+            prepared = await self.prepare(product)
+        except OSError as e:
+            print(f"{sku}: cannot read {product['path']}: {str(e)}", file=sys.stderr)
+            prepared = None
+        if prepared is None:
+            # Nothing downstream can run without the edited image
+            self.progress.failed += len(self.colors) + len(self.lifestyle)
+        else:
+            await asyncio.gather(self.color_variants(sku, prepared), self.lifestyle_mockups(sku, prepared))
+        self.progress.report(sku)
+
+    async def run(self, products: List[Dict[str, str]]) -> int:
+        """Process every product, a bounded number at a time; returns the failure count"""
+        self.progress = Progress(len(products), self.units_per_product())
+        window = 2 * self.workers
+        pending = set()
+        skus = {}
+
+        def collect(done) -> None:
+            # Units fail inside run_product; anything escaping it is a bug,
+            # counted so that the run doesn't exit 0
+            for task in done:
+                sku = skus.pop(task)
+                if task.exception() is not None:
+                    print(f"{sku} failed: {task.exception()!r}", file=sys.stderr)
+                    self.progress.failed += 1
+                    self.progress.report(sku)
+
+        try:
+            for product in products:
+                task = asyncio.ensure_future(self.run_product(product))
+                skus[task] = product["sku"]
+                pending.add(task)
+                if len(pending) >= window:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    collect(done)
+            if pending:
+                done, pending = await asyncio.wait(pending)
+                collect(done)
+        finally:
+            for task in pending:
+                task.cancel()
+            await self.client.aclose()
+            self.pool.shutdown(cancel_futures=True)
+            self.manifest.close()
+
+        elapsed = time.monotonic() - self.progress.started
+        print(
+            f"Finished {self.progress.products} products in {elapsed:.1f}s: "
+            f"{self.progress.done} outputs made, {self.progress.skipped} up to date, "
+            f"{self.progress.failed} failed"
+        )
+        return self.progress.failed
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _split(value: str) -> List[str]:
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("source", help="Directory of product images, or a manifest of image paths")
+    parser.add_argument("--out", required=True, help="Output directory (also holds the checkpoint manifest)")
+    parser.add_argument("--edits", type=_split, default=["remove-background", "crop", "enhance"],
+                        help=f"Comma-separated local edits, in order, from: {', '.join(bulk_edit.OPERATIONS)}; empty for none")
+    parser.add_argument("--colors", type=_split, default=[], help="Comma-separated hex colours for colour variants")
+    parser.add_argument("--color-mode", choices=("fast", "flux"), default="fast",
+                        help="fast: local CPU recolor; flux: FLUX.1-Kontext through the gateway")
+    parser.add_argument("--lifestyle", type=_split, default=[],
+                        help="Comma-separated scene:style mockups, e.g. living-room:modern")
+    parser.add_argument("--gateway", default=os.getenv("CATALOG_GATEWAY_URL", "http://localhost:8000"),
+                        help="Gateway for GPU-bound stages")
+    parser.add_argument("--workers", type=int, default=0, help="Local processes; 0 = one per core")
+    parser.add_argument("--gpu-concurrency", type=int, default=4, help="Gateway requests in flight at once")
+    parser.add_argument("--force", action="store_true", help="Redo every output, ignoring the checkpoint")
+    args = parser.parse_args()
+
+    try:
+        args.lifestyle = [tuple(entry.split(":", 1)) for entry in args.lifestyle]
+        if any(len(entry) != 2 for entry in args.lifestyle):
+            raise ValueError("Lifestyle mockups are given as scene:style")
+        for color in args.colors:
+            recolor.parse_hex(color)
+        products = find_sources(args.source)
+        os.makedirs(args.out, exist_ok=True)
+        pipeline = Pipeline(args)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+    if not pipeline.units_per_product():
+        parser.error("Nothing to do: no edits, colors or lifestyle mockups requested")
+    print(f"{len(products)} products, {pipeline.units_per_product()} outputs each, {pipeline.workers} local processes")
+    failed = asyncio.run(pipeline.run(products))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,651 @@
+"""
+Webhook-driven FAL queue jobs for Kling video generation
+Jobs are submitted to queue.fal.run with a signed webhook URL and recorded
+on disk, so no gateway coroutine waits on them; whichever worker receives
+the webhook downloads the video into the VideoStore. Status polling with
+backoff is only a fallback for jobs whose webhook is overdue. Source
+images are uploaded to FAL storage once and referenced by URL.
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+
+FAL_QUEUE_URL = os.getenv("FAL_QUEUE_URL", "https://queue.fal.run")
+FAL_STORAGE_URL = os.getenv("FAL_STORAGE_URL", "https://rest.alpha.fal.ai")
+KLING_MODEL = "fal-ai/kling-video/v2.5-turbo/pro/image-to-video"
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+# Seconds between saves of a batch record by the worker running it; a
+# batch not saved for BATCH_STALE_AFTER seconds has lost its worker
+BATCH_HEARTBEAT_INTERVAL = 10.0
+BATCH_STALE_AFTER = 6 * BATCH_HEARTBEAT_INTERVAL
+
+
+class FalQueueClient:
+    """Minimal client for the FAL queue REST API"""
+
+    def __init__(self, api_key: str = None, base_url: str = None, timeout: float = 60.0):
+        self.api_key = api_key or os.getenv("FAL_KEY")
+        self.base_url = (base_url or FAL_QUEUE_URL).rstrip("/")
+        self.timeout = timeout
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Key {self.api_key}"}
+
+    async def submit(self, model: str, arguments: Dict[str, Any], webhook_url: str = None) -> Dict[str, Any]:
+        """
+        Enqueue a request
+
+        Returns:
+            FAL's submission: request_id, status_url and response_url
+        """
+        params = {"fal_webhook": webhook_url} if webhook_url else None
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.post(
+                f"{self.base_url}/{model}", params=params, headers=self.headers, json=arguments
+            )
+        response.raise_for_status()
+        return response.json()
+
+    async def status(self, status_url: str) -> str:
+        """IN_QUEUE, IN_PROGRESS or COMPLETED"""
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.get(status_url, headers=self.headers)
+        response.raise_for_status()
+        return response.json().get("status", "IN_QUEUE")
+
+    async def result(self, response_url: str) -> Dict[str, Any]:
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.get(response_url, headers=self.headers)
+        response.raise_for_status()
+        return response.json()
+
+    async def wait(self, submission: Dict[str, Any], timeout: float = 600.0) -> Dict[str, Any]:
+        """Poll a submission with backoff until it completes, for callers that must block"""
+        deadline = time.monotonic() + timeout
+        interval = 2.0
+        while await self.status(submission["status_url"]) != "COMPLETED":
+            if time.monotonic() + interval > deadline:
+                raise TimeoutError(f"FAL request {submission['request_id']} did not complete in {timeout:.0f}s")
+            await asyncio.sleep(interval)
+            interval = min(interval * 1.5, 15.0)
+        return await self.result(submission["response_url"])
+
+
+def _decode_image(image: str):
+    """(bytes, content type) of a data URI or bare base64 image"""
+    content_type = None
+    if image.startswith("data:"):
+        header, _, image = image.partition(",")
+        content_type = header[5:].split(";")[0] or None
+    data = base64.b64decode(image)
+    if content_type is None:
+        if data.startswith(b"\xff\xd8"):
+            content_type = "image/jpeg"
+        elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            content_type = "image/webp"
+        else:
+            content_type = "image/png"
+    return data, content_type
+
+
+class FalStorage:
+    """
+    Uploads source images to FAL storage once per content hash
+
+    The returned URLs are recorded on disk with their expiry, so every
+    worker reuses them and Kling payloads carry a URL instead of the
+    whole image. A URL is only reused while it has at least
+    `min_remaining` seconds left, enough for a job to wait in the queue.
+    """
+
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = None,
+        root: str = None,
+        ttl: float = None,
+        min_remaining: float = 3600.0,
+        timeout: float = 60.0
+    ):
+        """
+        Args:
+            api_key: FAL key; defaults to FAL_KEY
+            base_url: FAL REST API; defaults to FAL_STORAGE_URL
+            root: Directory for the hash -> URL records; defaults to
+                FAL_UPLOAD_CACHE or .cache/fal_uploads
+            ttl: Requested lifetime of uploaded files in seconds; defaults
+                to FAL_UPLOAD_TTL or one day
+            min_remaining: Seconds a URL must still be valid to be reused
+            timeout: HTTP timeout for the upload
+        """
+        self.api_key = api_key or os.getenv("FAL_KEY")
+        self.base_url = (base_url or FAL_STORAGE_URL).rstrip("/")
+        self.root = root or os.getenv("FAL_UPLOAD_CACHE", os.path.join(".cache", "fal_uploads"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("FAL_UPLOAD_TTL", "86400"))
+        self.min_remaining = min_remaining
+        self.timeout = timeout
+        os.makedirs(self.root, exist_ok=True)
+        self._uploading: Dict[str, asyncio.Future] = {}
+        self.counters = Counter()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, f"{digest}.json")
+
+    def _cached(self, digest: str) -> Optional[str]:
+        try:
+            with open(self._path(digest)) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if entry["expires_at"] - time.time() < self.min_remaining:
+            return None
+        return entry["url"]
+
+    def _remember(self, digest: str, url: str, expires_at: float) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"url": url, "expires_at": expires_at}, f)
+            os.replace(tmp_path, self._path(digest))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    async def _upload(self, digest: str, data: bytes, content_type: str) -> str:
+        expires_at = time.time() + self.ttl
+        extension = content_type.split("/")[-1]
+        async with httpx.AsyncClient(timeout=self.timeout) as client:
+            response = await client.post(
+                f"{self.base_url}/storage/upload/initiate",
+                params={"storage_type": "fal-cdn-v3"},
+                headers={
+                    "Authorization": f"Key {self.api_key}",
+                    "X-Fal-Object-Lifecycle-Preference": json.dumps({"expiration_duration_seconds": int(self.ttl)}),
+                },
+                json={"content_type": content_type, "file_name": f"{digest[:16]}.{extension}"}
+            )
+            response.raise_for_status()
+            upload = response.json()
+            response = await client.put(upload["upload_url"], content=data, headers={"Content-Type": content_type})
+            response.raise_for_status()
+
+        self.counters["uploads"] += 1
+        self.counters["bytes_uploaded"] += len(data)
+        self._remember(digest, upload["file_url"], expires_at)
+        return upload["file_url"]
+
+    async def url_for(self, image: str) -> str:
+        """
+        FAL-hosted URL for a base64 image (bare or data URI)
+
+        Falls back to the data URI if the image cannot be uploaded, so a
+        storage outage costs bandwidth rather than the request.
+        """
+        try:
+            data, content_type = _decode_image(image)
+        except (binascii.Error, ValueError):
+            return image
+        data_uri = image if image.startswith("data:") else f"data:{content_type};base64,{image}"
+        digest = hashlib.sha256(data).hexdigest()
+
+        url = self._cached(digest)
+        if url is not None:
+            self.counters["hits"] += 1
+            return url
+
+        # Concurrent requests for the same image share one upload
+        future = self._uploading.get(digest)
+        if future is None:
+            future = asyncio.ensure_future(self._upload(digest, data, content_type))
+            self._uploading[digest] = future
+            future.add_done_callback(lambda done: self._uploading.pop(digest, None))
+        else:
+            self.counters["hits"] += 1
+        try:
+            return await asyncio.shield(future)
+        except Exception as e:
+            self.counters["failures"] += 1
+            print(f"FAL storage upload failed, sending the image inline: {str(e)}")
+            return data_uri
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counters)
+
+
+class VideoJobs:
+    """
+    Durable record of outstanding Kling jobs, shared by all gateway workers
+
+    A job moves queued -> processing -> completed/failed. It completes when
+    FAL calls the webhook. If PUBLIC_BASE_URL is unset, or the webhook is
+    late, it completes on the first status read after the job is overdue.
+    Those fallback status checks back off from 5 s to 60 s. A job left in
+    "processing" for longer than `processing_timeout` (its worker died
+    mid-download) is picked up again by the next status read. A job whose
+    status or result cannot be fetched `max_poll_errors` times in a row
+    is marked failed.
+    """
+
+    def __init__(
+        self,
+        fal: FalQueueClient,
+        video_store,
+        root: str = None,
+        public_base_url: str = None,
+        secret: str = None,
+        webhook_path: str = "/api/fal-webhook",
+        webhook_grace: float = 180.0,
+        poll_grace: float = 20.0,
+        batch_poll_interval: float = 2.0,
+        processing_timeout: float = 300.0,
+        max_poll_errors: int = 5,
+        batch_job_timeout: float = 900.0
+    ):
+        """
+        Args:
+            fal: Queue API client
+            video_store: VideoStore finished videos are registered in
+            root: Directory for job records, shared by all workers
+            public_base_url: Externally reachable gateway URL FAL can call
+                back; without it jobs are completed by polling
+            secret: Key for webhook URL signatures; defaults to
+                FAL_WEBHOOK_SECRET, else derived from FAL_KEY so that every
+                worker agrees on it
+            webhook_path: Route of the webhook receiver
+            webhook_grace: Seconds to wait for a webhook before polling
+            poll_grace: Seconds before the first poll when there is no webhook
+            batch_poll_interval: Seconds between batch progress checks
+                (local record reads; FAL is only polled for overdue jobs)
+            processing_timeout: Seconds after which a job still being
+                downloaded is assumed abandoned and downloaded again
+            max_poll_errors: Consecutive failed FAL status or result
+                fetches after which a job is marked failed
+            batch_job_timeout: Seconds a batch job may run before it is
+                marked failed and its slot given to the next variant
+        """
+        self.fal = fal
+        self.video_store = video_store
+        self.root = root or os.getenv("VIDEO_JOB_DIR", os.path.join(".cache", "video_jobs"))
+        os.makedirs(self.root, exist_ok=True)
+        base_url = public_base_url if public_base_url is not None else os.getenv("PUBLIC_BASE_URL", "")
+        self.public_base_url = base_url.rstrip("/")
+        secret = secret or os.getenv("FAL_WEBHOOK_SECRET") or f"fal-webhook:{fal.api_key or ''}"
+        self._key = hashlib.sha256(secret.encode()).digest()
+        self.webhook_path = webhook_path
+        self.webhook_grace = webhook_grace
+        self.poll_grace = poll_grace
+        self.batch_poll_interval = batch_poll_interval
+        self.processing_timeout = processing_timeout
+        self.max_poll_errors = max_poll_errors
+        self.batch_job_timeout = batch_job_timeout
+        self.counters = Counter()
+        self._batch_tasks = set()
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.root, f"{job_id}.json")
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not _JOB_ID.match(job_id):
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save(self, record: Dict[str, Any]) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(record, f)
+            os.replace(tmp_path, self._path(record["job_id"]))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _update(self, job_id: str, **fields) -> Dict[str, Any]:
+        record = self.get(job_id)
+        record.update(fields)
+        self._save(record)
+        return record
+
+    def signature(self, job_id: str) -> str:
+        return hmac.new(self._key, job_id.encode(), hashlib.sha256).hexdigest()
+
+    def verify(self, job_id: str, signature: str) -> bool:
+        return bool(_JOB_ID.match(job_id)) and hmac.compare_digest(self.signature(job_id), signature or "")
+
+    def webhook_url(self, job_id: str) -> Optional[str]:
+        if not self.public_base_url:
+            return None
+        return f"{self.public_base_url}{self.webhook_path}/{job_id}?sig={quote(self.signature(job_id))}"
+
+    async def submit(
+        self,
+        arguments: Dict[str, Any],
+        metadata: Dict[str, Any] = None,
+        model: str = KLING_MODEL,
+        transcode: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Enqueue a job and return its record immediately
+
+        `transcode` also renders the web rendition once the video arrives.
+
+        Raises:
+            httpx.HTTPError: FAL rejected or did not accept the submission
+        """
+        job_id = uuid.uuid4().hex
+        webhook_url = self.webhook_url(job_id)
+        now = time.time()
+        record = {
+            "job_id": job_id,
+            "status": "queued",
+            "created_at": now,
+            "webhook": webhook_url is not None,
+            "next_poll_at": now + (self.webhook_grace if webhook_url else self.poll_grace),
+            "poll_interval": 5.0,
+            "transcode": transcode,
+            "metadata": metadata or {},
+        }
+        # Written before submitting: the webhook can arrive before submit() returns
+        self._save(record)
+
+        try:
+            submission = await self.fal.submit(model, arguments, webhook_url)
+        except Exception as e:
+            self._update(job_id, status="failed", error=f"Submission failed: {str(e)}")
+            raise
+
+        self.counters["submitted"] += 1
+        return self._update(
+            job_id,
+            fal_request_id=submission.get("request_id"),
+            status_url=submission.get("status_url"),
+            response_url=submission.get("response_url"),
+        )
+
+    def _processing_is_fresh(self, record: Dict[str, Any]) -> bool:
+        """Whether another call is still downloading this job's video"""
+        return (
+            record["status"] == "processing"
+            and time.time() - record.get("processing_started_at", 0) < self.processing_timeout
+        )
+
+    async def complete(self, job_id: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Download the finished video, register it and mark the job completed
+
+        A job already being downloaded (webhook and poll racing) is left to
+        that call, unless its download has been going for longer than
+        processing_timeout.
+        """
+        record = self.get(job_id)
+        if record is None or record["status"] in ("completed", "failed") or self._processing_is_fresh(record):
+            return record
+        if record["status"] == "processing":
+            self.counters["redriven"] += 1
+        self._update(job_id, status="processing", processing_started_at=time.time())
+
+        try:
+            video_url = result["video"]["url"]
+            async with httpx.AsyncClient(timeout=120.0) as client:
+                response = await client.get(video_url)
+            response.raise_for_status()
+            reference = await asyncio.to_thread(
+                self.video_store.register, response.content, record.get("transcode", False)
+            )
+        except Exception as e:
+            self.counters["failed"] += 1
+            return self._update(job_id, status="failed", error=f"Failed to fetch video: {str(e)}")
+
+        self.counters["completed"] += 1
+        return self._update(
+            job_id,
+            status="completed",
+            completed_at=time.time(),
+            video_id=reference["id"],
+            media=reference,
+        )
+
+    async def handle_webhook(self, job_id: str, body: Dict[str, Any]) -> None:
+        """Process a verified webhook delivery (run after acknowledging it)"""
+        self.counters["webhooks"] += 1
+        record = self.get(job_id)
+        if record is None or record["status"] in ("completed", "failed"):
+            return
+
+        if body.get("status") != "OK":
+            self.counters["failed"] += 1
+            self._update(job_id, status="failed", error=str(body.get("error") or body.get("payload") or "FAL job failed"))
+            return
+
+        result = body.get("payload")
+        if not result and record.get("response_url"):
+            # Large payloads are left out of the webhook and must be fetched
+            result = await self.fal.result(record["response_url"])
+        await self.complete(job_id, result or {})
+
+    def _poll_failed(self, job_id: str, action: str, error: Exception) -> Optional[Dict[str, Any]]:
+        """Count a failed FAL fetch, failing the job once max_poll_errors is reached"""
+        print(f"{action} FAL job {job_id} failed: {str(error)}")
+        record = self.get(job_id)
+        if record is None or record["status"] in ("completed", "failed"):
+            return record
+        errors = record.get("poll_errors", 0) + 1
+        if errors >= self.max_poll_errors:
+            self.counters["failed"] += 1
+            return self._update(job_id, status="failed", poll_errors=errors, error=f"{action} FAL job failed: {str(error)}")
+        return self._update(job_id, poll_errors=errors)
+
+    async def refresh(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Current record, polling FAL once if the job is overdue
+
+        This is the only place jobs are polled, so waiting jobs cost
+        nothing until someone asks about one.
+        """
+        record = self.get(job_id)
+        if record is None or not record.get("status_url"):
+            return record
+        if record["status"] == "processing" and not self._processing_is_fresh(record):
+            # The worker downloading it died or restarted, and the webhook
+            # was already acknowledged: fetch the result again
+            try:
+                return await self.complete(job_id, await self.fal.result(record["response_url"]))
+            except httpx.HTTPError as e:
+                return self._poll_failed(job_id, "Re-fetching", e)
+        if record["status"] != "queued" or time.time() < record["next_poll_at"]:
+            return record
+
+        self.counters["polls"] += 1
+        interval = record["poll_interval"]
+        self._update(job_id, next_poll_at=time.time() + interval, poll_interval=min(interval * 2, 60.0))
+        try:
+            if await self.fal.status(record["status_url"]) != "COMPLETED":
+                return self._update(job_id, poll_errors=0) if record.get("poll_errors") else self.get(job_id)
+            return await self.complete(job_id, await self.fal.result(record["response_url"]))
+        except httpx.HTTPError as e:
+            return self._poll_failed(job_id, "Polling", e)
+
+    async def wait(self, job_id: str, timeout: float = None) -> Optional[Dict[str, Any]]:
+        """
+        Record of a job once it has completed or failed, checked every
+        batch_poll_interval seconds without blocking the event loop
+
+        Raises:
+            TimeoutError: Still running after `timeout` seconds
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        record = self.get(job_id)
+        while record is not None and record["status"] not in ("completed", "failed"):
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Video job {job_id} did not finish in {timeout:.0f}s")
+            await asyncio.sleep(self.batch_poll_interval)
+            record = await self.refresh(job_id)
+        return record
+
+    def _batch_path(self, batch_id: str) -> str:
+        return os.path.join(self.root, f"batch-{batch_id}.json")
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        if not _JOB_ID.match(batch_id):
+            return None
+        try:
+            with open(self._batch_path(batch_id)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save_batch(self, batch: Dict[str, Any]) -> None:
+        batch["updated_at"] = time.time()
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(batch, f)
+            os.replace(tmp_path, self._batch_path(batch["batch_id"]))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def start_batch(self, requests: List[Tuple[Dict[str, Any], Dict[str, Any]]], concurrency: int) -> Dict[str, Any]:
+        """
+        Record a batch of (arguments, metadata) jobs and start submitting them
+
+        At most `concurrency` jobs of the batch are outstanding at FAL at a
+        time. Submission runs in a task of this worker, independent of the
+        request that started it, so a client that disconnects can pick
+        the batch up again by id. The task saves the batch record every
+        BATCH_HEARTBEAT_INTERVAL seconds while it runs.
+        """
+        batch = {
+            "batch_id": uuid.uuid4().hex,
+            "created_at": time.time(),
+            "variants": [{"metadata": metadata, "job_id": None, "error": None} for _, metadata in requests],
+        }
+        self._save_batch(batch)
+        self.counters["batches"] += 1
+
+        task = asyncio.ensure_future(self._run_batch(batch, [arguments for arguments, _ in requests], concurrency))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+        return batch
+
+    async def _run_batch(self, batch: Dict[str, Any], arguments: List[Dict[str, Any]], concurrency: int) -> None:
+        slots = asyncio.Semaphore(concurrency)
+
+        async def run_variant(index: int) -> None:
+            variant = batch["variants"][index]
+            async with slots:
+                try:
+                    record = await self.submit(arguments[index], variant["metadata"])
+                except Exception as e:
+                    variant["error"] = f"Submission failed: {str(e)}"
+                    self._save_batch(batch)
+                    return
+                variant["job_id"] = record["job_id"]
+                self._save_batch(batch)
+
+                # Hold the slot until the job finishes; refresh only reads
+                # the record until the job is overdue. A lost webhook must
+                # not hold it for good
+                try:
+                    await asyncio.wait_for(self.wait(record["job_id"]), self.batch_job_timeout)
+                except asyncio.TimeoutError:
+                    self._time_out(record["job_id"])
+
+        async def heartbeat() -> None:
+            while True:
+                await asyncio.sleep(BATCH_HEARTBEAT_INTERVAL)
+                self._save_batch(batch)
+
+        beat = asyncio.ensure_future(heartbeat())
+        try:
+            await asyncio.gather(*(run_variant(index) for index in range(len(arguments))))
+        finally:
+            beat.cancel()
+            batch["finished_at"] = time.time()
+            self._save_batch(batch)
+
+    def _time_out(self, job_id: str) -> None:
+        record = self.get(job_id)
+        if record is not None and record["status"] not in ("completed", "failed"):
+            self.counters["timed_out"] += 1
+            self.counters["failed"] += 1
+            self._update(job_id, status="failed", error=f"No result from FAL in {self.batch_job_timeout:.0f}s")
+
+    def _batch_stopped(self, batch: Dict[str, Any]) -> bool:
+        """Whether no worker is running the batch any more (finished, or its worker died)"""
+        if batch.get("finished_at"):
+            return True
+        return time.time() - batch.get("updated_at", batch["created_at"]) > BATCH_STALE_AFTER
+
+    def batch_status(self, batch: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Current state of each variant: pending until submitted, then its
+        job's status; variants never submitted by a stopped batch are failed
+        """
+        stopped = self._batch_stopped(batch)
+        variants = []
+        for index, variant in enumerate(batch["variants"]):
+            entry = {"index": index, "job_id": variant["job_id"], **variant["metadata"]}
+            record = self.get(variant["job_id"]) if variant["job_id"] else None
+            if variant["error"]:
+                entry.update(status="failed", message=variant["error"])
+            elif record is None and stopped:
+                entry.update(status="failed", message="The batch stopped before this variant was submitted")
+            elif record is None:
+                entry["status"] = "pending"
+            else:
+                entry["status"] = record["status"]
+                if record["status"] == "completed":
+                    entry["media"] = record["media"]
+                elif record["status"] == "failed":
+                    entry["message"] = record.get("error", "Animation generation failed")
+            variants.append(entry)
+        return variants
+
+    async def follow_batch(self, batch_id: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Yield each variant whenever its status changes, until all have finished
+
+        Once no worker runs the batch any more, its outstanding jobs are
+        refreshed here instead, and failed after batch_job_timeout.
+        """
+        reported = {}
+        while True:
+            batch = self.get_batch(batch_id)
+            if self._batch_stopped(batch):
+                for variant in batch["variants"]:
+                    if variant["job_id"]:
+                        record = await self.refresh(variant["job_id"])
+                        if record is not None and time.time() - record["created_at"] > self.batch_job_timeout:
+                            self._time_out(variant["job_id"])
+            variants = self.batch_status(batch)
+            for variant in variants:
+                if reported.get(variant["index"]) != variant["status"]:
+                    reported[variant["index"]] = variant["status"]
+                    yield variant
+            if all(variant["status"] in ("completed", "failed") for variant in variants):
+                return
+            await asyncio.sleep(self.batch_poll_interval)
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counters)
@@ -1,9 +1,11 @@
 """
 FAL API Kling 2.5 Video Animation Service
-Replaces Modal Labs WAN for faster video generation
+Replaces Modal Labs WAN for faster video generation. Jobs are completed by
+FAL calling back /fal-webhook on this service at KLING_PUBLIC_BASE_URL;
+without it, or if the webhook is late, they are polled.
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
 from pydantic import BaseModel
 import base64
 import io
@@ -13,6 +15,9 @@ import httpx
 from PIL import Image
 import json
 
+from fal_jobs import FalQueueClient, FalStorage, VideoJobs, KLING_MODEL
+from video_processing import VideoStore
+
 app = FastAPI(title="FAL Kling 2.5 Animation Service")
 
 class AnimationRequest(BaseModel):
@@ -40,8 +45,17 @@ class FALKlingService:
         if not self.api_key:
             raise ValueError("FAL_KEY environment variable not set")
         
-        self.base_url = "https://queue.fal.run"
-        self.model_endpoint = "fal-ai/kling-video/v2.5-turbo/pro/image-to-video"
+        self.model_endpoint = KLING_MODEL
+        self.queue = FalQueueClient(self.api_key)
+        self.storage = FalStorage(self.api_key)
+        self.jobs = VideoJobs(
+            self.queue,
+            VideoStore(),
+            public_base_url=os.getenv("KLING_PUBLIC_BASE_URL", ""),
+            webhook_path="/fal-webhook"
+        )
+        # Seconds to wait for a job before giving up on it
+        self.timeout = 600.0
         
     async def generate_video(
         self,
@@ -57,12 +71,8 @@ class FALKlingService:
         Generate video using FAL Kling 2.5 API
         """
         try:
-            # Convert base64 image to data URI format expected by FAL
-            if not image_base64.startswith("data:"):
-                # Assume it's a base64 string, convert to data URI
-                image_url = f"data:image/png;base64,{image_base64}"
-            else:
-                image_url = image_base64
+            # Uploaded to FAL storage once; later styles reuse the URL
+            image_url = await self.storage.url_for(image_base64)
                 
             # Create enhanced prompt
             enhanced_prompt = self._create_enhanced_prompt(prompt, category, animation_style)
@@ -85,57 +95,33 @@ class FALKlingService:
             print(f"Duration: {duration}s")
             print(f"CFG Scale: {cfg_scale}")
             
-            # Make request to FAL API using their subscription interface
-            async with httpx.AsyncClient(timeout=300.0) as client:
-                # Submit request to FAL queue
-                response = await client.post(
-                    f"{self.base_url}/fal-ai/kling-video/v2.5-turbo/pro/image-to-video",
-                    headers={
-                        "Authorization": f"Key {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json=payload
-                )
-                
-                if response.status_code != 200:
-                    error_msg = f"FAL API error: {response.status_code} - {response.text}"
-                    print(error_msg)
-                    return {"success": False, "message": error_msg}
-                
-                result = response.json()
-                
-                # FAL returns the result directly for this endpoint
-                if "video" in result and "url" in result["video"]:
-                    video_url = result["video"]["url"]
-                    
-                    # Download the video and convert to base64
-                    video_response = await client.get(video_url)
-                    if video_response.status_code == 200:
-                        video_base64 = base64.b64encode(video_response.content).decode()
-                        
-                        return {
-                            "success": True,
-                            "video": video_base64,
-                            "message": "Video generated successfully with FAL Kling 2.5",
-                            "prompt_used": enhanced_prompt,
-                            "settings": {
-                                "resolution": f"{1280}x{720}",  # FAL Kling default
-                                "duration": f"{duration}s",
-                                "fps": 16,  # FAL Kling default
-                                "cfg_scale": cfg_scale,
-                                "model": "Kling 2.5 Turbo Pro"
-                            }
-                        }
-                    else:
-                        return {
-                            "success": False,
-                            "message": f"Failed to download generated video: {video_response.status_code}"
-                        }
-                else:
-                    return {
-                        "success": False,
-                        "message": f"Unexpected FAL API response format: {result}"
-                    }
+            # The queue endpoint only accepts the request; the webhook (or
+            # a poll once it is overdue) downloads the video into the store
+            record = await self.jobs.submit(payload, model=self.model_endpoint)
+            record = await self.jobs.wait(record["job_id"], timeout=self.timeout)
+            
+            if record is None or record["status"] != "completed":
+                error = record.get("error") if record else None
+                return {
+                    "success": False,
+                    "message": f"Error generating video with FAL Kling: {error or 'job lost'}"
+                }
+            
+            with open(self.jobs.video_store.rendition(record["video_id"], "original"), "rb") as f:
+                video_base64 = base64.b64encode(f.read()).decode()
+            return {
+                "success": True,
+                "video": video_base64,
+                "message": "Video generated successfully with FAL Kling 2.5",
+                "prompt_used": enhanced_prompt,
+                "settings": {
+                    "resolution": f"{1280}x{720}",  # FAL Kling default
+                    "duration": f"{duration}s",
+                    "fps": 16,  # FAL Kling default
+                    "cfg_scale": cfg_scale,
+                    "model": "Kling 2.5 Turbo Pro"
+                }
+            }
                     
         except Exception as e:
             error_msg = f"Error generating video with FAL Kling: {str(e)}"
@@ -207,6 +193,23 @@ async def generate_animation(request: AnimationRequest):
         print(f"Error in generate endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/fal-webhook/{job_id}")
+async def fal_webhook(job_id: str, request: Request, background_tasks: BackgroundTasks, sig: str = ""):
+    """Completion callback from the FAL queue; the URL carries an HMAC of the job id"""
+    if not fal_service.jobs.verify(job_id, sig):
+        raise HTTPException(status_code=403, detail="Invalid signature")
+    
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Webhook body is not JSON")
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=400, detail="Webhook body is not a JSON object")
+    
+    # Acknowledge at once; downloading the video happens after the response
+    background_tasks.add_task(fal_service.jobs.handle_webhook, job_id, body)
+    return {"received": True}
+
 @app.get("/health")
 def health_check():
     """Health check endpoint"""
@@ -0,0 +1,114 @@
+"""
+Local stand-in for the FAL queue API, for developing webhook-driven video jobs
+Accepts queue submissions, "renders" a short test clip after a delay and
+calls the submission's webhook, like queue.fal.run does, and accepts
+storage uploads
+
+Usage:
+    uvicorn fal_standin:app --port 8100
+    FAL_QUEUE_URL=http://127.0.0.1:8100 FAL_STORAGE_URL=http://127.0.0.1:8100 \
+        PUBLIC_BASE_URL=http://127.0.0.1:8000 uvicorn app:app
+"""
+
+import asyncio
+import os
+import tempfile
+import uuid
+from typing import Dict
+
+import cv2
+import httpx
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse
+
+app = FastAPI(title="FAL queue stand-in")
+
+DELAY = float(os.getenv("FAL_STANDIN_DELAY", "5"))
+FILES_DIR = tempfile.mkdtemp(prefix="fal_standin_")
+
+requests: Dict[str, Dict] = {}
+
+
+def render_clip(path: str, seconds: float = 2.0, fps: int = 16) -> None:
+    """Write a small moving-gradient MP4"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (320, 180))
+    ramp = np.linspace(0, 255, 320, dtype=np.uint8)
+    for index in range(int(seconds * fps)):
+        frame = np.zeros((180, 320, 3), dtype=np.uint8)
+        frame[:, :, 0] = np.roll(ramp, index * 8)
+        frame[:, :, 2] = 255 - frame[:, :, 0]
+        writer.write(frame)
+    writer.release()
+
+
+async def run_request(request_id: str, base_url: str, webhook_url: str) -> None:
+    requests[request_id]["status"] = "IN_PROGRESS"
+    await asyncio.sleep(DELAY)
+    await asyncio.to_thread(render_clip, os.path.join(FILES_DIR, f"{request_id}.mp4"))
+    result = {"video": {"url": f"{base_url}/files/{request_id}.mp4"}}
+    requests[request_id].update(status="COMPLETED", result=result)
+
+    if webhook_url:
+        try:
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                await client.post(webhook_url, json={
+                    "request_id": request_id,
+                    "gateway_request_id": request_id,
+                    "status": "OK",
+                    "payload": result
+                })
+        except httpx.HTTPError as e:
+            print(f"Webhook delivery for {request_id} failed: {str(e)}")
+
+
+@app.get("/files/{name}")
+async def files(name: str):
+    path = os.path.join(FILES_DIR, os.path.basename(name))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Not found")
+    return FileResponse(path)
+
+
+@app.post("/storage/upload/initiate")
+async def initiate_upload(request: Request):
+    body = await request.json()
+    name = f"{uuid.uuid4().hex}_{os.path.basename(body['file_name'])}"
+    base_url = str(request.base_url).rstrip("/")
+    return {"upload_url": f"{base_url}/files/{name}", "file_url": f"{base_url}/files/{name}"}
+
+
+@app.put("/files/{name}")
+async def upload(name: str, request: Request):
+    with open(os.path.join(FILES_DIR, os.path.basename(name)), "wb") as f:
+        f.write(await request.body())
+    return {}
+
+
+@app.get("/{model:path}/requests/{request_id}/status")
+async def status(model: str, request_id: str):
+    if request_id not in requests:
+        raise HTTPException(status_code=404, detail="Unknown request")
+    return {"status": requests[request_id]["status"], "request_id": request_id}
+
+
+@app.get("/{model:path}/requests/{request_id}")
+async def result(model: str, request_id: str):
+    entry = requests.get(request_id)
+    if entry is None or entry["status"] != "COMPLETED":
+        raise HTTPException(status_code=400, detail="Request is still in progress")
+    return entry["result"]
+
+
+@app.post("/{model:path}")
+async def submit(model: str, request: Request, fal_webhook: str = None):
+    await request.json()
+    request_id = uuid.uuid4().hex
+    base_url = str(request.base_url).rstrip("/")
+    requests[request_id] = {"status": "IN_QUEUE"}
+    asyncio.get_running_loop().create_task(run_request(request_id, base_url, fal_webhook))
+    return {
+        "request_id": request_id,
+        "status_url": f"{base_url}/{model}/requests/{request_id}/status",
+        "response_url": f"{base_url}/{model}/requests/{request_id}",
+    }
@@ -0,0 +1,290 @@
+"""
+Fan-out batch editing over FluxKontext containers
+Maps many (image, prompt) jobs over FluxKontext.generate_item so that
+Modal autoscales up to a chosen number of GPU containers, writing each
+result as it arrives. A failing item (bad input, container crash,
+timeout) is recorded and the rest of the batch carries on.
+
+The orchestration takes any object with Modal's `.map` interface, so it
+runs locally against StubFluxKontext without Modal or a GPU.
+
+Usage:
+    modal run modal_flux_kontext.py::batch --manifest jobs.jsonl [--max-containers 10] [--ordered]
+    python flux_batch.py jobs.jsonl [--out flux_batch_out] [--max-containers 10] [--ordered] [--stub]
+
+jobs.jsonl holds one job per line: {"image": "shoe.png", "prompt": "...",
+"output": "shoe_red.png", "guidance_scale": 3.5, "num_inference_steps": 28};
+image paths are relative to the manifest, output and the settings optional.
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterable, Iterator, List
+
+RESULTS_NAME = "results.jsonl"
+
+
+def load_jobs(manifest: str) -> List[Dict[str, Any]]:
+    """
+    Jobs from a JSON-lines manifest, with image paths resolved and output
+    names filled in
+
+    Raises:
+        ValueError: A line is not a job object with "image" and "prompt"
+    """
+    base = os.path.dirname(os.path.abspath(manifest))
+    jobs = []
+    with open(manifest) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            job = json.loads(line)
+            if not isinstance(job, dict) or not job.get("image") or not job.get("prompt"):
+                raise ValueError(f"{manifest}:{number}: a job needs an image and a prompt")
+            stem = os.path.splitext(os.path.basename(job["image"]))[0]
+            jobs.append({
+                **job,
+                "image": os.path.join(base, job["image"]),
+                "output": job.get("output") or f"{len(jobs):05d}_{stem}.png"
+            })
+    return jobs
+
+
+def iter_items(jobs: List[Dict[str, Any]], sent: List[int], on_error) -> Iterator[Dict[str, Any]]:
+    """
+    generate_item inputs, read lazily so that only the images Modal is
+    about to send are held in memory
+
+    Indices are appended to `sent` as items are handed to map; an image
+    that can't be read is reported through `on_error(index, message)`
+    rather than sent.
+    """
+    for index, job in enumerate(jobs):
+        try:
+            with open(job["image"], "rb") as f:
+                image_base64 = base64.b64encode(f.read()).decode()
+        except OSError as e:
+            on_error(index, f"Cannot read image: {str(e)}")
+            continue
+        sent.append(index)
+        yield {
+            "index": index,
+            "image_base64": image_base64,
+            "prompt": job["prompt"],
+            "guidance_scale": job.get("guidance_scale", 3.5),
+            "num_inference_steps": job.get("num_inference_steps", 28)
+        }
+
+
+def run_batch(method, jobs: List[Dict[str, Any]], output_dir: str, ordered: bool = False) -> Dict[str, Any]:
+    """
+    Run every job through `method.map` and write results as they arrive
+
+    Each finished item is written to `output_dir` (image) and appended to
+    results.jsonl there (index, output, success, message, seconds since
+    the batch started). Items that never returned a result of their own
+    (a crash while collecting unordered) are listed under "missing" and
+    not counted as failed, so every job is counted exactly once.
+
+    Args:
+        method: FluxKontext().generate_item, or a stub with the same `.map`
+        jobs: From load_jobs
+        output_dir: Where images and results.jsonl are written
+        ordered: Collect results in job order; otherwise in completion
+            order, so one slow item doesn't hold back writing the others
+
+    Returns:
+        Summary with counts and wall time
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    started = time.monotonic()
+    pending = set(range(len(jobs)))
+    sent: List[int] = []
+    counts = {"succeeded": 0, "failed": 0}
+    logged = 0
+
+    with open(os.path.join(output_dir, RESULTS_NAME), "a") as log:
+        def record(index, success: bool, message: str):
+            nonlocal logged
+            entry = {
+                "index": index,
+                "image": jobs[index]["image"] if index is not None else None,
+                "output": jobs[index]["output"] if index is not None and success else None,
+                "success": success,
+                "message": message,
+                "seconds": round(time.monotonic() - started, 3)
+            }
+            if index is not None:
+                # A crash of an unknown item stays pending and is counted
+                # under "missing" instead
+                pending.discard(index)
+                counts["succeeded" if success else "failed"] += 1
+            log.write(json.dumps(entry) + "\n")
+            log.flush()
+            logged += 1
+            label = jobs[index]["output"] if index is not None else "unknown item"
+            print(f"[{logged}/{len(jobs)}] {'ok' if success else 'FAILED'} {label}: {message}", flush=True)
+
+        items = iter_items(jobs, sent, lambda index, message: record(index, False, message))
+        results = method.map(items, order_outputs=ordered, return_exceptions=True)
+        for position, result in enumerate(results):
+            if isinstance(result, BaseException):
+                # The item never returned (container crash, timeout). Its
+                # position identifies it only when results are ordered;
+                # otherwise it is reported under "missing" at the end
+                record(sent[position] if ordered else None, False, f"{type(result).__name__}: {str(result)}")
+                continue
+
+            index = result["index"]
+            if not result.get("success"):
+                record(index, False, result.get("message", "Unknown error"))
+                continue
+            path = os.path.join(output_dir, jobs[index]["output"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(base64.b64decode(result["image"]))
+            record(index, True, result.get("message", ""))
+
+    elapsed = time.monotonic() - started
+    summary = {
+        "total": len(jobs),
+        **counts,
+        "missing": sorted(pending),
+        "seconds": round(elapsed, 3),
+        "items_per_second": round(len(jobs) / elapsed, 3) if elapsed > 0 else None
+    }
+    print(
+        f"{counts['succeeded']}/{len(jobs)} succeeded, {counts['failed']} failed, "
+        f"{len(summary['missing'])} missing in {elapsed:.1f}s ({summary['items_per_second']} items/s)"
+    )
+    return summary
+
+
+class _StubMethod:
+    """Stand-in for a Modal method handle: `.remote` and Modal-style `.map` on local threads"""
+
+    def __init__(self, fn, max_containers: int):
+        self.fn = fn
+        self.max_containers = max_containers
+
+    def remote(self, *args, **kwargs):
+        return self.fn(*args, **kwargs)
+
+    def map(self, inputs: Iterable, order_outputs: bool = True, return_exceptions: bool = False) -> Iterator:
+        def call(item):
+            try:
+                return self.fn(item)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return e
+
+        # Like Modal, inputs are pulled only as containers free up
+        inputs = iter(inputs)
+        with ThreadPoolExecutor(max_workers=self.max_containers) as pool:
+            window = []
+            for item in inputs:
+                window.append(pool.submit(call, item))
+                if len(window) < self.max_containers:
+                    continue
+                if order_outputs:
+                    yield window.pop(0).result()
+                else:
+                    done, _ = wait(window, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        window.remove(future)
+                        yield future.result()
+            if order_outputs:
+                for future in window:
+                    yield future.result()
+            else:
+                while window:
+                    done, _ = wait(window, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        window.remove(future)
+                        yield future.result()
+
+
+class StubFluxKontext:
+    """
+    FluxKontext stand-in for exercising batches locally
+
+    "Edits" an image by tinting it with a colour derived from the prompt
+    after `delay` seconds. Prompts containing "[crash]" raise instead of
+    returning, as a lost container would; "[error]" returns a failed result
+    as the model code does.
+    """
+
+    def __init__(self, max_containers: int = 10, delay: float = 0.5):
+        self.delay = delay
+        self.active = 0
+        self.peak_active = 0
+        self._lock = threading.Lock()
+        self.generate_item = _StubMethod(self._generate_item, max_containers)
+
+    def _generate_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        from PIL import Image
+
+        with self._lock:
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if "[crash]" in item["prompt"]:
+                raise RuntimeError("Container exited unexpectedly")
+            if "[error]" in item["prompt"]:
+                return {"index": item["index"], "success": False, "message": "Error: stub error", "image": None}
+            img = Image.open(io.BytesIO(base64.b64decode(item["image_base64"]))).convert("RGB")
+            tint = Image.new("RGB", img.size, tuple(hashlib.sha256(item["prompt"].encode()).digest()[:3]))
+            buffer = io.BytesIO()
+            Image.blend(img, tint, 0.3).save(buffer, format="PNG")
+            return {
+                "index": item["index"],
+                "success": True,
+                "image": base64.b64encode(buffer.getvalue()).decode(),
+                "message": "Image generated successfully"
+            }
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("manifest", help="JSON-lines file of {image, prompt} jobs")
+    parser.add_argument("--out", default="flux_batch_out", help="Output directory")
+    parser.add_argument("--max-containers", type=int, default=10, help="Most GPU containers to scale to")
+    parser.add_argument("--ordered", action="store_true", help="Collect results in job order")
+    parser.add_argument("--stub", action="store_true", help="Run against StubFluxKontext instead of the deployed app")
+    parser.add_argument("--stub-delay", type=float, default=0.5, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    try:
+        jobs = load_jobs(args.manifest)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+    if args.stub:
+        flux = StubFluxKontext(max_containers=args.max_containers, delay=args.stub_delay)
+    else:
+        import modal
+        flux_cls = modal.Cls.from_name("flux-kontext", "FluxKontext")
+        flux = flux_cls.with_options(max_containers=args.max_containers)()
+
+    summary = run_batch(flux.generate_item, jobs, args.out, ordered=args.ordered)
+    if args.stub:
+        print(f"Peak concurrent stub containers: {flux.peak_active}")
+    sys.exit(1 if summary["failed"] or summary["missing"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -61,6 +61,8 @@ const MainContent = React.memo(({
 
     const handleFileUpload = (file) => {
         if (file && file.type.startsWith('image/')) {
+            // Start the GPU container while the user picks an edit
+            navigator.sendBeacon('/api/prewarm');
             const reader = new FileReader();
             reader.onload = (e) => {
                 setUploadedImage(e.target.result);
@@ -99,7 +101,7 @@ const MainContent = React.memo(({
 
         if (activeToolId === 'animation') {
             // Video generation endpoint for animation section
-            endpoint = '/api/generate-video';
+            endpoint = '/api/video-jobs';
             setProcessingText('AI is creating your animation...');
             requestData = {
                 image_base64: imageBase64,
@@ -114,7 +116,7 @@ const MainContent = React.memo(({
             };
         } else {
             // Image edit endpoint for color variations and lifestyle mockup sections
-            endpoint = '/api/generate';
+            endpoint = '/api/generate?inline=true';
             if (activeToolId === 'shots') {
                 setProcessingText('AI is generating color variation...');
             } else if (activeToolId === 'lifestyle') {
@@ -147,7 +149,16 @@ const MainContent = React.memo(({
                 body: JSON.stringify(requestData)
             });
 
-            const result = await response.json();
+            let result = await response.json();
+
+            // Animations are queued at FAL; poll the job until the video is ready
+            if (result.success && result.status_url) {
+                const statusUrl = `${result.status_url}?inline=true`;
+                while (result.status === 'queued' || result.status === 'processing') {
+                    await new Promise(resolve => setTimeout(resolve, 3000));
+                    result = await (await fetch(statusUrl)).json();
+                }
+            }
 
             if (result.success) {
                 setProgress(100);
@@ -207,7 +218,7 @@ const MainContent = React.memo(({
         }, 500);
 
         try {
-            const response = await fetch('/api/generate', {
+            const response = await fetch('/api/generate?inline=true', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
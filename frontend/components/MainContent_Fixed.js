@@ -1,3 +1,7 @@
+// URL of a stored result's derivative (128, 512 or 1024 px WebP from
+// /api/assets), falling back to the inline image when it wasn't stored
+const assetUrl = (asset, size, fallback) => (asset && asset.derivatives && asset.derivatives[size]) || fallback;
+
 // Main Content Component - ProductGenius Style (Exact Match)
 const MainContent = ({ 
     uploadedImage, 
@@ -55,6 +59,8 @@ const MainContent = ({
                     const variantImage = {
                         id: timestamp,
                         src: variant.image,
+                        thumbnail: assetUrl(variant.asset, 128, variant.image),
+                        preview: assetUrl(variant.asset, 1024, variant.image),
                         name: `${variant.name} Variant`,
                         timestamp,
                         isVariant: true,
@@ -71,11 +77,13 @@ const MainContent = ({
     }, [colorVariants]);
     
     // Global function to add generated images to slideshow
-    window.addToSlideshow = React.useCallback((imageData, name, type = 'generated') => {
+    window.addToSlideshow = React.useCallback((imageData, name, type = 'generated', asset = null) => {
         const timestamp = Date.now();
         const newImage = {
             id: timestamp,
             src: imageData,
+            thumbnail: assetUrl(asset, 128, imageData),
+            preview: assetUrl(asset, 1024, imageData),
             name: name || `${type} Image`,
             timestamp,
             type,
@@ -133,6 +141,8 @@ const MainContent = ({
 
     const handleFileUpload = (file) => {
         if (file && file.type.startsWith('image/')) {
+            // Start the GPU container while the user picks an edit
+            navigator.sendBeacon('/api/prewarm');
             const reader = new FileReader();
             reader.onload = (e) => {
                 setUploadedImage(e.target.result);
@@ -154,7 +164,7 @@ const MainContent = ({
         setProgress(10);
 
         try {
-            const response = await fetch('/api/generate', {
+            const response = await fetch('/api/generate?inline=true', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
@@ -210,7 +220,7 @@ const MainContent = ({
             const imageBase64 = uploadedImage.split(',')[1] || uploadedImage;
             
             // Determine which endpoint to call based on active tool
-            let endpoint = '/api/generate'; // Default for image editing
+            let endpoint = '/api/generate?inline=true'; // Default for image editing
             let requestData = {
                 image_base64: imageBase64,
                 prompt: promptText.trim(),
@@ -220,7 +230,7 @@ const MainContent = ({
             
             if (activeToolId === 'animation') {
                 // Call video generation endpoint for animation section
-                endpoint = '/api/generate-video';
+                endpoint = '/api/video-jobs';
                 setProcessingText('AI is creating your animation...');
                 requestData = {
                     image_base64: imageBase64,
@@ -254,7 +264,16 @@ const MainContent = ({
             });
 
             setProgress(50);
-            const result = await response.json();
+            let result = await response.json();
+
+            // Animations are queued at FAL; poll the job until the video is ready
+            if (result.success && result.status_url) {
+                const statusUrl = `${result.status_url}?inline=true`;
+                while (result.status === 'queued' || result.status === 'processing') {
+                    await new Promise(resolve => setTimeout(resolve, 3000));
+                    result = await (await fetch(statusUrl)).json();
+                }
+            }
 
             if (result.success) {
                 setProgress(100);
@@ -269,7 +288,7 @@ const MainContent = ({
                         setUploadedImage(imageData);
                         // Add to slideshow as image
                         if (window.addToSlideshow) {
-                            window.addToSlideshow(imageData, 'AI Edit', 'edit');
+                            window.addToSlideshow(imageData, 'AI Edit', 'edit', result.asset);
                         }
                     }
                     setIsProcessing(false);
@@ -343,7 +362,7 @@ const MainContent = ({
                                 <img 
                                     alt={currentImage.name || "Product image"} 
                                     className={`w-full h-auto ${activeToolId ? 'max-h-[60vh]' : 'max-h-[70vh]'} rounded-lg object-contain mx-auto`} 
-                                    src={currentImage.src}
+                                    src={currentImage.preview || currentImage.src}
                                 />
                             )}
                         </div>
@@ -391,7 +410,7 @@ const MainContent = ({
                                             </div>
                                         ) : (
                                             <img 
-                                                src={image.src} 
+                                                src={image.thumbnail || image.src} 
                                                 alt={image.name}
                                                 className="w-16 h-16 object-cover rounded-lg"
                                             />
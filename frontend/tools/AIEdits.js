@@ -81,9 +81,11 @@ const AIEditsPanel = React.memo(({ uploadedImage, setUploadedImage, setIsProcess
                 finalPrompt = presetPrompts[selectedPreset] || prompt;
             }
             
-            const response = await fetch('/api/generate', {
+            // One id per tab: a newer edit from this tab cancels the older one on the GPU
+            window.editSessionId = window.editSessionId || Math.random().toString(36).slice(2);
+            const response = await fetch('/api/generate?inline=true', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'X-Session-Id': window.editSessionId },
                 body: JSON.stringify({
                     image_base64: imageBase64,
                     prompt: finalPrompt,
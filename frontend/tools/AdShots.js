@@ -138,7 +138,7 @@ const AdShotsPanel = React.memo(({ uploadedImage, setUploadedImage, setIsProcess
 
                 const fullPrompt = `${basePrompt}, professional advertising photography, ultra-high quality, 8K resolution, cinematic lighting, award-winning commercial photography, hyperrealistic details, perfect product integration`;
 
-                const response = await fetch('/api/generate', {
+                const response = await fetch('/api/generate?inline=true', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({
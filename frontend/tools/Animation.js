@@ -220,7 +220,9 @@ const AnimationPanel = React.memo(({ uploadedImage, setUploadedImage, setIsProce
                 ? customPrompt.trim()  // Use user's custom prompt directly
                 : createAdQualityPrompt(selectedCategory, selectedStyle); // Generate enhanced prompt
             
-            const response = await fetch('/api/generate-video', {
+            // Queue the job, then poll its status; the gateway holds no
+            // connection open while Kling renders
+            const submitResponse = await fetch('/api/video-jobs', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({
@@ -240,10 +242,20 @@ const AnimationPanel = React.memo(({ uploadedImage, setUploadedImage, setIsProce
                 })
             });
 
+            const job = await submitResponse.json();
+            if (!job.success) {
+                throw new Error(job.message || 'Animation submission failed');
+            }
+
+            let result = job;
+            while (result.status === 'queued' || result.status === 'processing') {
+                await new Promise(resolve => setTimeout(resolve, 3000));
+                const statusResponse = await fetch(`${job.status_url}?inline=true`);
+                result = await statusResponse.json();
+            }
+
             clearInterval(progressInterval);
             updateProgress(90);
-
-            const result = await response.json();
             updateProgress(100);
 
             if (result.success) {
@@ -251,6 +263,7 @@ const AnimationPanel = React.memo(({ uploadedImage, setUploadedImage, setIsProce
                 const animationInfo = {
                     id: Date.now(),
                     video: videoData,
+                    media: result.media && result.media.renditions,
                     name: `${selectedStyle.replace('_', ' ')} Animation`,
                     category: selectedCategory,
                     style: selectedStyle,
@@ -646,7 +659,9 @@ const AnimationPanel = React.memo(({ uploadedImage, setUploadedImage, setIsProce
                         {generatedVideos.map((animation) => (
                             <div key={animation.id} className="bg-gray-50 dark:bg-gray-800/50 rounded-lg p-3">
                                 <video 
-                                    src={animation.video} 
+                                    src={animation.media ? animation.media.original : animation.video} 
+                                    poster={animation.media ? animation.media.poster : undefined}
+                                    preload={animation.media ? 'none' : 'auto'}
                                     controls 
                                     loop 
                                     muted
@@ -101,7 +101,7 @@ const ColorVariationsPanel = ({
                 
                 const fullPrompt = `${colorPrompt}. Professional product photography, clean white background, studio lighting, high-quality commercial shot, maintain original shape and details${preserveDetails ? ', preserve textures and shadows intact' : ''}`;
                 
-                const response = await fetch('/api/generate', {
+                const response = await fetch('/api/generate?inline=true', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({
@@ -32,6 +32,7 @@ const ColorVariationsPanel = React.memo(({
     const [selectedColors, setSelectedColors] = React.useState(() => getRandomColors(4));
     const [customColor, setCustomColor] = React.useState('#ff0000');
     const [preserveDetails, setPreserveDetails] = React.useState(true);
+    const [highFidelity, setHighFidelity] = React.useState(false); // FLUX per color instead of instant CPU recolor
     const [numRandomColors, setNumRandomColors] = React.useState(4);
     const [colorMode, setColorMode] = React.useState('random'); // 'random' or 'custom'
 
@@ -95,8 +96,34 @@ const ColorVariationsPanel = React.memo(({
 
             updateProgress(20); // Processing started
 
+            if (!highFidelity) {
+                // Instant recolor on the server CPU, all colors in one request
+                const response = await fetch('/api/color-variations?inline=true', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({
+                        image_base64: imageBase64,
+                        colors: selectedColors.map(c => c.hex),
+                        num_variations: selectedColors.length,
+                        mode: 'fast'
+                    })
+                });
+                const result = await response.json();
+                if (result.success) {
+                    result.variants.forEach((variant, i) => {
+                        variants.push({
+                            id: `color-${i}-${Date.now()}`,
+                            name: selectedColors[i].name,
+                            color: variant.color,
+                            image: variant.image,
+                            asset: variant.asset
+                        });
+                    });
+                }
+            }
+
             // Process colors in batches to reduce re-renders
-            for (let i = 0; i < selectedColors.length; i++) {
+            for (let i = 0; highFidelity && i < selectedColors.length; i++) {
                 const color = selectedColors[i];
                 
                 // Update processing text for current color (minimal state updates)
@@ -107,7 +134,7 @@ const ColorVariationsPanel = React.memo(({
                 
                 const fullPrompt = `${colorPrompt}. Professional product photography, clean white background, studio lighting, high-quality commercial shot, maintain original shape and details${preserveDetails ? ', preserve textures and shadows intact' : ''}`;
                 
-                const response = await fetch('/api/generate', {
+                const response = await fetch('/api/generate?inline=true', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({
@@ -125,7 +152,8 @@ const ColorVariationsPanel = React.memo(({
                             id: `color-${i}-${Date.now()}`,
                             name: color.name,
                             color: color.hex,
-                            image: `data:image/png;base64,${result.image}`
+                            image: `data:image/png;base64,${result.image}`,
+                            asset: result.asset
                         });
                     }
                 }
@@ -345,6 +373,18 @@ const ColorVariationsPanel = React.memo(({
                         <div className="text-xs text-dark-text-secondary">Keep textures and shadows intact</div>
                     </div>
                 </label>
+                <label className="flex items-center space-x-3 cursor-pointer mt-3">
+                    <input 
+                        type="checkbox" 
+                        checked={highFidelity}
+                        onChange={(e) => setHighFidelity(e.target.checked)}
+                        className="text-teal-500 focus:ring-teal-500"
+                    />
+                    <div>
+                        <div className="text-sm font-medium">High Fidelity (FLUX)</div>
+                        <div className="text-xs text-dark-text-secondary">AI re-render per color; slower, for complex products</div>
+                    </div>
+                </label>
             </div>
 
             {/* Generate Button */}
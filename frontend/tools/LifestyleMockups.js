@@ -282,7 +282,7 @@ const LifestyleMockupsPanel = React.memo(({ uploadedImage, setUploadedImage, set
                     const stylePrompt = styleOptions[selectedStyle]?.prompt || styleOptions.photorealistic.prompt;
                     const lifestylePrompt = `${basePrompt}, ${stylePrompt}, photorealistic, high quality professional photography, realistic human proportions, no cartoonish elements, no floating objects, natural lighting, authentic scene, shot with professional camera, proper product integration, realistic scale`;
 
-                    const response = await fetch('/api/generate', {
+                    const response = await fetch('/api/generate?inline=true', {
                         method: 'POST',
                         headers: { 'Content-Type': 'application/json' },
                         body: JSON.stringify({
@@ -305,6 +305,7 @@ const LifestyleMockupsPanel = React.memo(({ uploadedImage, setUploadedImage, set
                             variantImage: variant.image,
                             scenarioName: scenario.name,
                             image: lifestyleImage,
+                            asset: result.asset,
                             prompt: scenario.prompt
                         };
                         
@@ -316,7 +317,8 @@ const LifestyleMockupsPanel = React.memo(({ uploadedImage, setUploadedImage, set
                             window.addToSlideshow(
                                 lifestyleImage, 
                                 `${scenario.name} - ${variant.name}`, 
-                                'lifestyle'
+                                'lifestyle',
+                                result.asset
                             );
                         }
                     }
@@ -350,7 +352,8 @@ const LifestyleMockupsPanel = React.memo(({ uploadedImage, setUploadedImage, set
             window.addToSlideshow(
                 scenario.image, 
                 `${scenario.scenarioName} - ${scenario.variantName}`, 
-                'lifestyle-selected'
+                'lifestyle-selected',
+                scenario.asset
             );
         }
     };
@@ -432,7 +435,7 @@ const LifestyleMockupsPanel = React.memo(({ uploadedImage, setUploadedImage, set
                                     }`}
                             >
                                 <img
-                                    src={variant.image}
+                                    src={assetUrl(variant.asset, 128, variant.image)}
                                     alt={variant.name}
                                     className="w-full h-12 object-cover"
                                 />
@@ -545,7 +548,7 @@ const LifestyleMockupsPanel = React.memo(({ uploadedImage, setUploadedImage, set
                                 }}
                             >
                                 <img
-                                    src={scenario.image}
+                                    src={assetUrl(scenario.asset, 512, scenario.image)}
                                     alt={`${scenario.variantName} - ${scenario.scenarioName}`}
                                     style={{
                                         width: '100%',
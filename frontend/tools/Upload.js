@@ -5,6 +5,8 @@ const UploadPanel = ({ setUploadedImage }) => {
 
     const handleFileUpload = (file) => {
         if (file && file.type.startsWith('image/')) {
+            // Start the GPU container while the user picks an edit
+            navigator.sendBeacon('/api/prewarm');
             const reader = new FileReader();
             reader.onload = (e) => {
                 setUploadedImage(e.target.result);
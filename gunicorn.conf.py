@@ -0,0 +1,25 @@
+"""
+Gunicorn settings for production
+    gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app once in the master and fork workers from it (PRELOAD_APP=0
+# to import per worker, e.g. to compare with benchmarks/bench_startup.py)
+preload_app = os.getenv("PRELOAD_APP", "1") != "0"
+
+
+def when_ready(server):
+    if preload_app:
+        import preload
+        preload.warm_master()
+
+
+def post_fork(server, worker):
+    import preload
+    preload.init_worker()
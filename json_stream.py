@@ -0,0 +1,112 @@
+"""
+Streamed JSON responses for large base64 payloads
+The envelope is serialized once (orjson when available) with placeholders
+for the base64 fields, which are then encoded chunk by chunk straight from
+the image buffer, so a response never holds more than the encoded image
+plus one chunk in memory
+"""
+
+import base64
+import io
+import json
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+
+from starlette.responses import StreamingResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Raw bytes per chunk; a multiple of 3 so that chunks concatenate into
+# valid base64 without padding in between (64 KiB encoded)
+CHUNK_SIZE = 3 * 16384
+
+
+def _dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":")).encode()
+
+
+class Base64Field:
+    """
+    A JSON string value written as `prefix` + base64 of `data`
+
+    `data` is any bytes-like object and is not copied. Already-encoded text
+    (e.g. an upstream result) can be passed as `encoded` instead; it is
+    then only prefixed, without concatenating.
+    """
+
+    def __init__(self, data=None, prefix: str = "", encoded: Optional[str] = None):
+        self.data = memoryview(data) if data is not None else None
+        self.prefix = prefix.encode()
+        self.encoded = encoded
+
+    def __len__(self) -> int:
+        """Length of the JSON string including its quotes"""
+        if self.encoded is not None:
+            body = len(self.encoded)
+        else:
+            body = (self.data.nbytes + 2) // 3 * 4
+        return len(self.prefix) + body + 2
+
+    def chunks(self) -> Iterator[bytes]:
+        yield b'"' + self.prefix
+        if self.encoded is not None:
+            for start in range(0, len(self.encoded), CHUNK_SIZE):
+                yield self.encoded[start:start + CHUNK_SIZE].encode("ascii")
+        else:
+            data = self.data.cast("B")
+            for start in range(0, data.nbytes, CHUNK_SIZE):
+                yield base64.b64encode(data[start:start + CHUNK_SIZE])
+        yield b'"'
+
+
+def encode_image(img, format: str = "PNG", prefix: str = "", **save_args) -> Base64Field:
+    """Save a PIL image into a buffer and wrap it for streaming, without copying the buffer"""
+    buffer = io.BytesIO()
+    img.save(buffer, format=format, **save_args)
+    return Base64Field(buffer.getbuffer(), prefix=prefix)
+
+
+class StreamedJSONResponse(StreamingResponse):
+    """
+    JSON response whose Base64Field values are streamed rather than built
+
+    Base64Field may appear anywhere in `content` (nested dicts and lists
+    included). The body length is known up front, so the response carries
+    a Content-Length rather than being chunked.
+    """
+
+    def __init__(self, content: Dict[str, Any], status_code: int = 200, headers: Dict[str, str] = None):
+        fields: List[Base64Field] = []
+        marker = uuid.uuid4().hex
+
+        def substitute(value):
+            if isinstance(value, Base64Field):
+                fields.append(value)
+                return marker
+            if isinstance(value, dict):
+                return {key: substitute(item) for key, item in value.items()}
+            if isinstance(value, (list, tuple)):
+                return [substitute(item) for item in value]
+            return value
+
+        # Fields are collected in document order, which is also the order
+        # their markers appear in the serialized envelope
+        parts = _dumps(substitute(content)).split(f'"{marker}"'.encode())
+        self.fields = fields
+        self.parts = parts
+
+        length = sum(len(part) for part in parts) + sum(len(field) for field in fields)
+        headers = dict(headers or {})
+        headers["content-length"] = str(length)
+        super().__init__(self._body(), status_code=status_code, headers=headers, media_type="application/json")
+
+    def _body(self) -> Iterator[bytes]:
+        for part, field in zip(self.parts, self.fields):
+            yield part
+            yield from field.chunks()
+        yield self.parts[-1]
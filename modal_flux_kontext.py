@@ -29,6 +29,17 @@ image = (
 # Persistent volume for model caching
 volume = modal.Volume.from_name("flux-kontext-cache", create_if_missing=True)
 
+# Job ids the gateway has given up on (client gone, request superseded);
+# running jobs poll it and stop at the next denoising step
+cancel_flags = modal.Dict.from_name("flux-kontext-cancel", create_if_missing=True)
+
+# Seconds between checks of a running job's cancel flag
+CANCEL_POLL_INTERVAL = 0.25
+
+
+class GenerationCancelled(Exception):
+    """Raised from the step callback to abandon a cancelled job"""
+
 @app.cls(
     image=image,
     gpu="A100-40GB",
@@ -65,8 +76,20 @@ class FluxKontext:
         # Move the entire pipeline to the GPU
         self.pipe.to("cuda")
         
+        import time
+        self.loaded_at = time.time()
         print("Model loaded successfully!")
     
+    @modal.method()
+    def warmup(self) -> Dict[str, Any]:
+        """
+        No-op call used by the gateway's pre-warmer
+        
+        Calling it starts a container and loads the model if none is running,
+        and resets the idle timer of the one that is.
+        """
+        return {"success": True, "loaded_at": self.loaded_at}
+    
     @modal.method()
     def generate(
         self, 
@@ -75,7 +98,8 @@ class FluxKontext:
         guidance_scale: float = 3.5,
         num_inference_steps: int = 28,
         width: int = 1024,
-        height: int = 1024
+        height: int = 1024,
+        job_id: str = None
     ) -> Dict[str, Any]:
         """
         Generate or edit image with FLUX.1-Kontext
@@ -87,18 +111,92 @@ class FluxKontext:
             num_inference_steps: Number of denoising steps
             width: Width for text-to-image generation
             height: Height for text-to-image generation
+            job_id: Id under which the caller may cancel the job (see /cancel)
             
         Returns:
-            Dictionary with success status and output image (base64)
+            Dictionary with success status and output image (base64), or
+            cancelled=True if the job was cancelled, with the number of
+            denoising steps run and requested in either case
+        """
+        return self._generate(prompt, image_base64, guidance_scale, num_inference_steps, width, height, job_id)
+    
+    @modal.method()
+    def generate_item(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        One job of a fan-out batch (see flux_batch.py)
+        
+        Takes a single dict so that batches can be mapped over it, and
+        echoes its "index" so results collected out of order can be matched
+        to their jobs.
         """
+        if not item.get("image_base64"):
+            # Never fall through to text-to-image for a batch edit
+            return {"index": item.get("index"), "success": False, "message": "Error: no image", "image": None}
+        result = self._generate(
+            prompt=item["prompt"],
+            image_base64=item["image_base64"],
+            guidance_scale=item.get("guidance_scale", 3.5),
+            num_inference_steps=item.get("num_inference_steps", 28),
+            job_id=item.get("job_id")
+        )
+        return {"index": item.get("index"), **result}
+    
+    def _generate(
+        self,
+        prompt: str,
+        image_base64: str = None,
+        guidance_scale: float = 3.5,
+        num_inference_steps: int = 28,
+        width: int = 1024,
+        height: int = 1024,
+        job_id: str = None
+    ) -> Dict[str, Any]:
+        """Model call shared by generate and generate_item"""
+        import threading
+        import time
+        
+        # Stage timings in seconds, returned with every result for tracing
+        started = time.perf_counter()
+        timings = {}
+        
+        def with_timings(result: Dict[str, Any]) -> Dict[str, Any]:
+            timings["total"] = time.perf_counter() - started
+            return {**result, "timings": timings}
+        
+        steps = {"completed": 0, "total": num_inference_steps}
+        cancelled = threading.Event()
+        finished = threading.Event()
+        
+        def watch_cancel_flag():
+            # Polled off the denoising loop so that steps never wait on the Dict
+            while not finished.wait(CANCEL_POLL_INTERVAL):
+                try:
+                    if cancel_flags.contains(job_id):
+                        cancelled.set()
+                        return
+                except Exception as e:
+                    print(f"Cancel flag check failed: {str(e)}")
+        
+        def on_step_end(pipe, step, timestep, callback_kwargs):
+            steps["completed"] = step + 1
+            if cancelled.is_set():
+                raise GenerationCancelled()
+            return callback_kwargs
+        
+        if job_id:
+            threading.Thread(target=watch_cancel_flag, daemon=True).start()
+        
         try:
             if image_base64:
                 # Image-to-image editing mode
+                stage = time.perf_counter()
                 image_data = base64.b64decode(image_base64)
                 input_image = Image.open(io.BytesIO(image_data)).convert('RGB')
+                timings["decode"] = time.perf_counter() - stage
                 
                 # Use the same approach as the working rugRemover
                 import torch
+                stage = time.perf_counter()
                 result = self.pipe(
                     image=input_image,
                     prompt=prompt,
@@ -106,38 +204,67 @@ class FluxKontext:
                     num_inference_steps=num_inference_steps,
                     width=input_image.width,
                     height=input_image.height,
-                    generator=torch.Generator().manual_seed(42)
+                    generator=torch.Generator().manual_seed(42),
+                    callback_on_step_end=on_step_end
                 )
             else:
                 # Text-to-image generation mode
                 # Text-to-image generation mode
                 import torch
+                stage = time.perf_counter()
                 result = self.pipe(
                     prompt=prompt,
                     guidance_scale=guidance_scale,
                     num_inference_steps=num_inference_steps,
                     width=width,
                     height=height,
-                    generator=torch.Generator().manual_seed(42)
+                    generator=torch.Generator().manual_seed(42),
+                    callback_on_step_end=on_step_end
                 )
             
+            timings["denoise"] = time.perf_counter() - stage
+            
             # Convert output to base64
+            stage = time.perf_counter()
             buffer = io.BytesIO()
             result.images[0].save(buffer, format='PNG')
             output_base64 = base64.b64encode(buffer.getvalue()).decode()
+            timings["encode"] = time.perf_counter() - stage
             
-            return {
+            return with_timings({
                 "success": True,
                 "image": output_base64,
-                "message": "Image generated successfully"
-            }
+                "message": "Image generated successfully",
+                "steps_completed": steps["completed"],
+                "steps_total": steps["total"]
+            })
+        
+        except GenerationCancelled:
+            print(f"Job {job_id} cancelled after {steps['completed']}/{steps['total']} steps")
+            timings["denoise"] = time.perf_counter() - stage
+            return with_timings({
+                "success": False,
+                "cancelled": True,
+                "message": "Cancelled",
+                "image": None,
+                "steps_completed": steps["completed"],
+                "steps_total": steps["total"]
+            })
             
         except Exception as e:
-            return {
+            return with_timings({
                 "success": False,
                 "message": f"Error: {str(e)}",
                 "image": None
-            }
+            })
+        
+        finally:
+            finished.set()
+            if cancelled.is_set():
+                try:
+                    cancel_flags.pop(job_id)
+                except Exception:
+                    pass
 
 
 @app.function(
@@ -147,7 +274,7 @@ class FluxKontext:
 @modal.asgi_app()
 def web_app():
     """FastAPI web interface"""
-    from fastapi import FastAPI, HTTPException, File, UploadFile, Form
+    from fastapi import FastAPI, HTTPException, File, UploadFile, Form, Response
     from fastapi.responses import HTMLResponse
     from pydantic import BaseModel
     import base64
@@ -161,6 +288,10 @@ def web_app():
         num_inference_steps: int = 28
         width: int = 1024
         height: int = 1024
+        job_id: str = None  # Lets the caller cancel the job via /cancel
+    
+    class CancelRequest(BaseModel):
+        job_id: str
     
     @app_instance.get("/", response_class=HTMLResponse)
     def home():
@@ -543,22 +674,68 @@ def web_app():
         """
     
     @app_instance.post("/generate")
-    async def generate(request: GenerateRequest):
-        """Generate image with FLUX.1-Kontext"""
+    async def generate(request: GenerateRequest, response: Response):
+        """
+        Generate image with FLUX.1-Kontext
+        
+        Stage timings are returned in a Server-Timing header: this handler
+        (webapp), the hop to the GPU container including Modal queueing
+        and cold starts (modal), and the container's decode, denoise and
+        encode stages.
+        """
+        import time
+        
         try:
+            started = time.perf_counter()
             flux = FluxKontext()
-            result = flux.generate.remote(
+            remote_started = time.perf_counter()
+            # Awaited, not blocking: /cancel for this job is served by the
+            # same event loop while the generation runs
+            result = await flux.generate.remote.aio(
                 prompt=request.prompt,
                 image_base64=request.image_base64,
                 guidance_scale=request.guidance_scale,
                 num_inference_steps=request.num_inference_steps,
                 width=request.width,
-                height=request.height
+                height=request.height,
+                job_id=request.job_id
+            )
+            remote = time.perf_counter() - remote_started
+            
+            timings = result.pop("timings", None) or {}
+            stages = {
+                "modal": remote - timings.get("total", 0.0),
+                "gpu-decode": timings.get("decode"),
+                "denoise": timings.get("denoise"),
+                "gpu-encode": timings.get("encode"),
+                "webapp": time.perf_counter() - started,
+            }
+            response.headers["Server-Timing"] = ", ".join(
+                f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items() if seconds is not None
             )
             return result
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
     
+    @app_instance.post("/cancel")
+    async def cancel(request: CancelRequest):
+        """Stop a running generation at its next denoising step"""
+        import time
+        
+        # Flags for jobs that already finished are never read; Modal expires
+        # idle Dict entries
+        await cancel_flags.put.aio(request.job_id, time.time())
+        return {"success": True, "job_id": request.job_id}
+    
+    @app_instance.post("/warmup")
+    async def warmup():
+        """Start (or keep alive) a FluxKontext container with the model loaded"""
+        try:
+            flux = FluxKontext()
+            return await flux.warmup.remote.aio()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+    
     return app_instance
 
 
@@ -598,4 +775,23 @@ def main():
             f.write(base64.b64decode(result["image"]))
         print(f"✅ Image saved to: {output_path}")
     else:
-        print(f"❌ {result['message']}")
\ No newline at end of file
+        print(f"❌ {result['message']}")
+
+
+@app.local_entrypoint()
+def batch(manifest: str, output_dir: str = "flux_batch_out", max_containers: int = 10, ordered: bool = False):
+    """
+    Edit many images at once across up to `max_containers` GPU containers
+    
+    modal run modal_flux_kontext.py::batch --manifest jobs.jsonl
+    (see flux_batch.py for the manifest format)
+    """
+    import flux_batch
+    
+    jobs = flux_batch.load_jobs(manifest)
+    flux = FluxKontext.with_options(max_containers=max_containers)()
+    summary = flux_batch.run_batch(flux.generate_item, jobs, output_dir, ordered=ordered)
+    if summary["failed"] or summary["missing"]:
+        print(f"❌ {summary['failed']} failed, see {output_dir}/{flux_batch.RESULTS_NAME}")
+    else:
+        print(f"✅ {summary['succeeded']} images saved to: {output_dir}")
@@ -0,0 +1,243 @@
+"""
+Background plate library and CPU compositing for lifestyle mockups
+Each scene/style background is generated (or imported) once and stored
+with its placement area and lighting direction; mockups then cut out the
+product and composite it onto the plate with contact and cast shadows and
+a light colour match, instead of running FLUX per product
+"""
+
+import io
+import json
+import os
+import re
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import background_removal
+
+# Default product area as fractions of the plate: centred on a surface in
+# the lower half, bottom edge at `bottom`
+DEFAULT_PLACEMENT = {"x": 0.5, "bottom": 0.86, "max_width": 0.5, "max_height": 0.5}
+
+# Share of the plate's ambient lightness and tint applied to the product
+COLOR_MATCH = 0.25
+
+CONTACT_SHADOW_OPACITY = 0.55
+CAST_SHADOW_OPACITY = 0.3
+
+_NAME = re.compile(r"^[a-z0-9-]+$")
+
+
+def estimate_light_direction(plate: np.ndarray) -> List[float]:
+    """
+    Unit vector (x right, y down) from the plate centre towards its
+    brightest region, taken as the main light
+    """
+    small = cv2.resize(cv2.cvtColor(plate, cv2.COLOR_RGB2GRAY), (64, 64), interpolation=cv2.INTER_AREA)
+    small = cv2.GaussianBlur(small.astype(np.float32), (0, 0), 4)
+    threshold = np.percentile(small, 90)
+    ys, xs = np.nonzero(small >= threshold)
+    vector = np.array([xs.mean() - 31.5, ys.mean() - 31.5])
+    norm = np.linalg.norm(vector)
+    if norm < 2.0:
+        # Evenly lit: treat as overhead light, shadows fall straight down
+        return [0.0, -1.0]
+    return [float(v) for v in vector / norm]
+
+
+class PlateLibrary:
+    """
+    Scene/style background plates on disk, shared by all gateway workers
+
+    A plate is `<scene>__<style>.png` plus a JSON record of its placement
+    area, light direction and origin.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = root or os.getenv("PLATE_DIR", os.path.join(".cache", "plates"))
+        os.makedirs(self.root, exist_ok=True)
+        self._cache: Dict[str, Tuple[float, Image.Image]] = {}
+
+    def _base(self, scene: str, style: str) -> str:
+        if not (_NAME.match(scene) and _NAME.match(style)):
+            raise ValueError(f"Invalid plate name: {scene}/{style}")
+        return os.path.join(self.root, f"{scene}__{style}")
+
+    def _write_atomic(self, path: str, data: bytes) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, scene: str, style: str) -> Optional[Tuple[Image.Image, Dict[str, Any]]]:
+        """(plate image, metadata), or None if the plate has not been made yet"""
+        base = self._base(scene, style)
+        try:
+            with open(f"{base}.json") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # Decoded plates are kept per process; the record's timestamp
+        # tells when an import replaced one
+        cached = self._cache.get(base)
+        if cached is None or cached[0] != meta["created_at"]:
+            plate = Image.open(f"{base}.png").convert("RGB")
+            plate.load()
+            cached = (meta["created_at"], plate)
+            self._cache[base] = cached
+        return cached[1], meta
+
+    def put(
+        self,
+        scene: str,
+        style: str,
+        image_bytes: bytes,
+        source: str,
+        placement: Dict[str, float] = None,
+        light_direction: List[float] = None
+    ) -> Dict[str, Any]:
+        """
+        Store a plate, estimating the light direction if not given
+
+        The image is written before its record, so a reader never sees a
+        record without its plate.
+        """
+        base = self._base(scene, style)
+        plate = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        meta = {
+            "scene": scene,
+            "style": style,
+            "width": plate.width,
+            "height": plate.height,
+            "placement": {**DEFAULT_PLACEMENT, **(placement or {})},
+            "light_direction": light_direction or estimate_light_direction(np.asarray(plate)),
+            "source": source,
+            "created_at": time.time(),
+        }
+        buffer = io.BytesIO()
+        plate.save(buffer, format="PNG")
+        self._write_atomic(f"{base}.png", buffer.getvalue())
+        self._write_atomic(f"{base}.json", json.dumps(meta).encode())
+        return meta
+
+    def index(self) -> List[Dict[str, Any]]:
+        """Metadata of every stored plate"""
+        plates = []
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.root, name)) as f:
+                        plates.append(json.load(f))
+                except (FileNotFoundError, ValueError):
+                    continue
+        return plates
+
+
+def _cutout(product: Image.Image) -> np.ndarray:
+    """RGBA array of the product cropped to its silhouette"""
+    if product.mode == "RGBA" and product.getextrema()[3][0] < 255:
+        rgba = np.asarray(product)
+    else:
+        rgb = np.asarray(product.convert("RGB"))
+        mask = background_removal.fast_mask(rgb).astype(np.float32)
+        # The feather is centred on the product edge, so its outer half is
+        # studio backdrop; choke it inwards so the product doesn't get a
+        # light halo on the plate
+        mask = np.clip((mask - 127.5) * 2.0, 0, 255).astype(np.uint8)
+        rgba = np.dstack((rgb, mask))
+    ys, xs = np.nonzero(rgba[:, :, 3] > 8)
+    if len(xs) == 0:
+        return rgba
+    return rgba[ys.min():ys.max() + 1, xs.min():xs.max() + 1]
+
+
+def _color_match(rgb: np.ndarray, alpha: np.ndarray, ambient: np.ndarray) -> np.ndarray:
+    """Pull the product's lightness and tint part of the way to the plate's ambient Lab"""
+    lab = cv2.cvtColor(rgb.astype(np.float32) * (1.0 / 255.0), cv2.COLOR_RGB2LAB)
+    weights = alpha.astype(np.float32) / 255.0
+    product_l = float((lab[:, :, 0] * weights).sum() / max(weights.sum(), 1e-3))
+    lab[:, :, 0] += COLOR_MATCH * (ambient[0] - product_l)
+    lab[:, :, 1:] += COLOR_MATCH * ambient[1:]
+    rgb = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+    return np.clip(rgb * 255.0 + 0.5, 0, 255).astype(np.uint8)
+
+
+def composite(product: Image.Image, plate: Image.Image, meta: Dict[str, Any]) -> Image.Image:
+    """
+    Place the product on the plate
+
+    The product is cut out, scaled into the plate's placement area with its
+    base on the surface, colour-matched to the surrounding plate, and
+    grounded with a soft contact shadow and a cast shadow falling away
+    from the plate's light.
+    """
+    plate_rgb = np.asarray(plate, dtype=np.float32)
+    plate_h, plate_w = plate_rgb.shape[:2]
+    placement = meta["placement"]
+
+    cutout = _cutout(product)
+    scale = min(
+        placement["max_width"] * plate_w / cutout.shape[1],
+        placement["max_height"] * plate_h / cutout.shape[0]
+    )
+    size = (max(1, int(cutout.shape[1] * scale)), max(1, int(cutout.shape[0] * scale)))
+    interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LANCZOS4
+    cutout = cv2.resize(cutout, size, interpolation=interpolation)
+    width, height = size
+
+    left = int(placement["x"] * plate_w - width / 2)
+    bottom = int(placement["bottom"] * plate_h)
+    top = bottom - height
+
+    # Ambient colour of the plate around the product area
+    region = plate_rgb[max(0, top - height // 2):min(plate_h, bottom + height // 4),
+                       max(0, left - width // 2):min(plate_w, left + width + width // 2)]
+    ambient = cv2.cvtColor(region.reshape(1, -1, 3) * (1.0 / 255.0), cv2.COLOR_RGB2LAB).reshape(-1, 3).mean(axis=0)
+    rgb = _color_match(cutout[:, :, :3], cutout[:, :, 3], ambient)
+
+    # Shadows are painted on a darkening map the size of the plate
+    shadow = np.zeros((plate_h, plate_w), dtype=np.float32)
+    contact = np.zeros_like(shadow)
+    cv2.ellipse(
+        contact, (left + width // 2, bottom), (max(1, int(width * 0.45)), max(1, int(width * 0.05))),
+        0, 0, 360, 1.0, -1
+    )
+    contact = cv2.GaussianBlur(contact, (0, 0), max(1.0, width * 0.03))
+    shadow = np.maximum(shadow, contact * CONTACT_SHADOW_OPACITY)
+
+    # Cast shadow: the silhouette flattened onto the surface and sheared
+    # away from the light
+    light_x, light_y = meta["light_direction"]
+    squash = 0.3
+    silhouette = cutout[:, :, 3].astype(np.float32) / 255.0
+    shear = -light_x * 1.2
+    transform = np.float32([
+        [1, -shear * squash, left + shear * height * squash],
+        [0, squash, bottom - height * squash],
+    ])
+    cast = cv2.warpAffine(silhouette, transform, (plate_w, plate_h))
+    cast = cv2.GaussianBlur(cast, (0, 0), max(1.0, height * 0.02))
+    # Light from behind throws a longer, fainter shadow towards the viewer
+    shadow = np.maximum(shadow, cast * CAST_SHADOW_OPACITY * (1.0 - 0.3 * max(0.0, -light_y)))
+
+    out = plate_rgb * (1.0 - shadow[:, :, None])
+
+    # Paste the product, clipped to the plate
+    x0, y0 = max(0, left), max(0, top)
+    x1, y1 = min(plate_w, left + width), min(plate_h, bottom)
+    if x1 > x0 and y1 > y0:
+        piece = rgb[y0 - top:y1 - top, x0 - left:x1 - left].astype(np.float32)
+        alpha = cutout[y0 - top:y1 - top, x0 - left:x1 - left, 3:].astype(np.float32) / 255.0
+        out[y0:y1, x0:x1] = out[y0:y1, x0:x1] * (1.0 - alpha) + piece * alpha
+
+    return Image.fromarray(np.clip(out + 0.5, 0, 255).astype(np.uint8), "RGB")
@@ -0,0 +1,47 @@
+"""
+Startup hooks for the preload-and-fork worker model (see gunicorn.conf.py)
+With preload_app the master imports app.py once, so the interpreter, the
+heavy libraries, the prompt tables and the precompressed frontend are shared
+copy-on-write by every forked worker instead of being rebuilt per worker
+"""
+
+import gc
+import importlib
+import os
+
+# Imported lazily by app.py, but worth sharing when a master is available
+COLD_PATH_MODULES = ("rembg", "onnxruntime")
+
+
+def warm_master() -> None:
+    """Run in the gunicorn master after the app is loaded, before any fork"""
+    for name in COLD_PATH_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+    # Move everything allocated so far out of the collector's reach, so
+    # garbage collection in the workers does not write to (and so copy)
+    # the shared pages
+    gc.collect()
+    gc.freeze()
+
+
+def init_worker() -> None:
+    """
+    Run in each worker right after the fork
+
+    ONNX Runtime sessions are not fork-safe (their thread pools do not
+    survive the fork), so the rembg session is created here, once per
+    worker and before the first request, rather than in the master.
+    """
+    if os.getenv("REMBG_PRELOAD", "1") == "0":
+        return
+
+    import background_removal
+    try:
+        background_removal.get_rembg_session()
+    except ImportError:
+        # rembg is optional; the fast mode does not need a session
+        pass
@@ -0,0 +1,275 @@
+"""
+On-demand sampling profiler for a running gateway worker
+Samples every thread's Python stack from a background thread for a fixed
+window (or for one request) and writes the samples as collapsed stacks,
+ready for flamegraph.pl or speedscope, together with the top functions by
+self and total time and how busy the event loop thread was. Optionally
+diffs tracemalloc snapshots taken at the start and end of the window.
+
+Nothing is sampled unless a profile is running, so it is safe to leave
+enabled in production; only one profile runs per worker at a time.
+"""
+
+import asyncio
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+# Where profiles are written, as <id>.folded (collapsed stacks) and <id>.json (summary)
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(".cache", "profiles"))
+
+# Milliseconds between stack samples
+INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+
+# Longest window an admin may request
+MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+
+# Frames tracemalloc keeps per allocation in memory profiles
+MEMORY_FRAMES = 1
+
+# Leaf frames of threads that are waiting rather than working: selector
+# polls, lock and queue waits, and an idle uvloop (running in C)
+IDLE_FRAMES = {
+    ("selectors.py", "select"), ("selectors.py", "poll"), ("selectors.py", "control"),
+    ("threading.py", "wait"), ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"), ("thread.py", "_worker"), ("process.py", "_wait_for_updates"),
+    ("connection.py", "wait"), ("base_events.py", "run_forever"),
+    ("base_events.py", "run_until_complete"), ("runners.py", "run"),
+}
+
+PROFILE_ID = re.compile(r"^[0-9a-f]{12}\.(folded|json)$")
+
+
+class ProfilerBusy(Exception):
+    """Another profile is already running in this worker"""
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_label(name: str) -> str:
+    # Group pool threads, e.g. ThreadPoolExecutor-0_3 -> ThreadPoolExecutor
+    return re.sub(r"[-_]\d+(_\d+)?$", "", name) or "thread"
+
+
+class Profile:
+    """
+    One sampling window
+
+    Call from the event loop thread, which is then reported separately as
+    "event-loop". stop() ends sampling and writes the output files.
+    """
+
+    def __init__(self, memory: bool = False, top: int = 25, include_idle: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.memory = memory
+        self.top = top
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.loop_samples = 0
+        self.loop_busy = 0
+        self.idle_samples = 0
+        self._loop_thread = threading.get_ident()
+        self._labels: Dict[Any, str] = {}
+        self._stopped = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+        self._started_tracemalloc = False
+        self._memory_start = None
+        self.started = time.time()
+
+    def start(self) -> None:
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(MEMORY_FRAMES)
+                self._started_tracemalloc = True
+            self._memory_start = tracemalloc.take_snapshot()
+        self._sampler.start()
+
+    def _sample_loop(self) -> None:
+        me = threading.get_ident()
+        interval = INTERVAL_MS / 1000
+        while not self._stopped.wait(interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                code = frame.f_code
+                idle = (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+                if ident == self._loop_thread:
+                    self.loop_samples += 1
+                    self.loop_busy += not idle
+                if idle:
+                    self.idle_samples += 1
+                    if not self.include_idle:
+                        continue
+                stack = []
+                while frame is not None:
+                    label = self._labels.get(frame.f_code)
+                    if label is None:
+                        label = self._labels[frame.f_code] = _frame_label(frame.f_code)
+                    stack.append(label)
+                    frame = frame.f_back
+                thread = "event-loop" if ident == self._loop_thread else _thread_label(names.get(ident, ""))
+                stack.append(thread)
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def _memory_diff(self) -> Optional[Dict[str, Any]]:
+        if self._memory_start is None:
+            return None
+        current, peak = tracemalloc.get_traced_memory()
+        ignore = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        )
+        end = tracemalloc.take_snapshot().filter_traces(ignore)
+        diff = end.compare_to(self._memory_start.filter_traces(ignore), "lineno")
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        return {
+            "traced_kb": round(current / 1024, 1),
+            "peak_kb": round(peak / 1024, 1),
+            "top": [
+                {
+                    "where": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size_diff_kb": round(stat.size_diff / 1024, 1),
+                    "count_diff": stat.count_diff,
+                    "size_kb": round(stat.size / 1024, 1)
+                }
+                for stat in diff[:self.top]
+            ]
+        }
+
+    def stop(self) -> Dict[str, Any]:
+        """End sampling, write <id>.folded and <id>.json and return the summary"""
+        self._stopped.set()
+        self._sampler.join()
+        seconds = time.time() - self.started
+
+        samples = sum(self.stacks.values())
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+
+        def ranked(counter: Counter):
+            return [
+                {"function": frame, "samples": count, "percent": round(100 * count / samples, 1)}
+                for frame, count in counter.most_common(self.top)
+            ]
+
+        summary = {
+            "id": self.id,
+            "pid": os.getpid(),
+            "started_at": self.started,
+            "seconds": round(seconds, 3),
+            "interval_ms": INTERVAL_MS,
+            "samples": samples,
+            "idle_samples": self.idle_samples,
+            "event_loop_busy_percent": round(100 * self.loop_busy / self.loop_samples, 1) if self.loop_samples else None,
+            "top_self": ranked(own),
+            "top_total": ranked(total),
+            "memory": self._memory_diff(),
+            "files": {"collapsed": f"{self.id}.folded", "summary": f"{self.id}.json"}
+        }
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f"{self.id}.folded"), "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(os.path.join(PROFILE_DIR, f"{self.id}.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+
+_lock = threading.Lock()
+_active: Optional[Profile] = None
+
+
+def start(memory: bool = False, top: int = 25, include_idle: bool = False) -> Profile:
+    """
+    Start a profile in this worker; call from the event loop thread
+
+    Raises:
+        ProfilerBusy: One is already running
+    """
+    global _active
+    with _lock:
+        if _active is not None:
+            raise ProfilerBusy(f"Profile {_active.id} is already running in this worker")
+        _active = Profile(memory=memory, top=top, include_idle=include_idle)
+    _active.start()
+    return _active
+
+
+def finish(profile: Profile) -> Dict[str, Any]:
+    """Stop a profile from start() and free the slot for the next one"""
+    global _active
+    try:
+        return profile.stop()
+    finally:
+        with _lock:
+            _active = None
+
+
+def path(name: str) -> Optional[str]:
+    """Path of a written profile file by name, or None if there is no such file"""
+    if not PROFILE_ID.match(name):
+        return None
+    full = os.path.join(PROFILE_DIR, name)
+    return full if os.path.exists(full) else None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling single requests
+
+    A request with an "X-Profile" header ("1", or "memory" to add a
+    tracemalloc diff) that `authorize(headers)` accepts is profiled from
+    arrival until its body is sent; the response carries X-Profile-Id.
+    Samples cover the whole worker, so concurrent requests show up too.
+    """
+
+    def __init__(self, app, authorize: Callable[[Headers], bool]):
+        self.app = app
+        self.authorize = authorize
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        mode = headers.get("x-profile")
+        if not mode or not self.authorize(headers):
+            await self.app(scope, receive, send)
+            return
+        try:
+            profile = start(memory=mode == "memory")
+        except ProfilerBusy:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_profiled(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("X-Profile-Id", profile.id)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_profiled)
+        finally:
+            await asyncio.to_thread(finish, profile)
@@ -0,0 +1,67 @@
+"""
+Prompt tables for the FLUX.1-Kontext and Kling requests
+Module-level so they are built once, and shared copy-on-write by forked
+gunicorn workers in preload mode
+"""
+
+# Color name to prompt mapping
+COLOR_PROMPTS = {
+    "#dc2626": "Transform the product to elegant red color scheme, vibrant red finish, professional red coating",
+    "#2563eb": "Transform the product to deep blue color scheme, rich navy blue finish, vibrant blue coating", 
+    "#16a34a": "Transform the product to forest green color scheme, natural green finish, deep emerald green coating",
+    "#ea580c": "Transform the product to bright orange color scheme, vibrant orange finish, energetic orange coating",
+    "#9333ea": "Transform the product to elegant purple color scheme, rich purple finish, luxurious purple coating",
+    "#f59e0b": "Transform the product to golden yellow color scheme, warm gold finish, premium golden coating",
+    "#1f2937": "Transform the product to elegant matte black color scheme, sophisticated dark finish, premium black coating",
+    "#f9fafb": "Transform the product to clean pure white color scheme, pristine white finish, minimalist white coating",
+    "#f472b6": "Transform the product to soft pink color scheme, elegant pink finish, stylish rose coating",
+    "#10b981": "Transform the product to mint green color scheme, fresh mint finish, modern teal coating",
+    "#0ea5e9": "Transform the product to sky blue color scheme, bright cyan finish, modern blue coating",
+    "#a855f7": "Transform the product to lavender purple color scheme, soft purple finish, elegant violet coating"
+}
+
+# Lifestyle mockup scenes and the style applied on top
+SCENE_PROMPTS = {
+    'living-room': 'Product placed in a modern living room setting, cozy atmosphere, natural lighting, home lifestyle',
+    'kitchen': 'Product in a modern kitchen environment, bright lighting, culinary lifestyle, home cooking scene',
+    'office': 'Product in a professional office workspace, clean desk setup, business environment, productivity lifestyle',
+    'bedroom': 'Product in a comfortable bedroom setting, soft lighting, relaxing atmosphere, personal space',
+    'outdoor': 'Product in a natural outdoor setting, fresh air environment, outdoor lifestyle, nature scene',
+    'cafe': 'Product in a trendy café atmosphere, coffee shop environment, social lifestyle, urban setting'
+}
+
+STYLE_MODIFIERS = {
+    'modern': 'clean, minimalist aesthetic, contemporary design',
+    'rustic': 'warm, natural materials, cozy atmosphere',
+    'industrial': 'urban, edgy vibe, modern industrial design',
+    'scandinavian': 'light, airy Nordic style, minimalist approach',
+    'bohemian': 'eclectic, artistic feel, creative atmosphere'
+}
+
+# Category-specific prompt enhancements optimized for Kling 2.5
+CATEGORY_PROMPTS = {
+    "product": "premium commercial product showcase, studio lighting, clean background",
+    "electronics": "sleek modern electronics, premium materials, high-tech aesthetic",
+    "fashion": "stylish fashion photography, elegant presentation, premium quality",
+    "jewelry": "luxury jewelry showcase, sparkling details, premium lighting",
+    "cosmetics": "beauty product photography, elegant presentation, soft lighting",
+    "furniture": "modern furniture showcase, interior design aesthetic, premium materials",
+    "automotive": "automotive product showcase, sleek design, professional presentation",
+    "food": "appetizing food presentation, fresh ingredients, culinary artistry",
+    "sports": "dynamic sports equipment, athletic performance, energetic presentation",
+    "lifestyle": "lifestyle product integration, modern living, aspirational presentation"
+}
+
+# Animation style descriptions optimized for Kling 2.5
+ANIMATION_STYLES = {
+    "smooth_rotation": "smooth 360-degree rotation, fluid camera movement, cinematic",
+    "gentle_float": "gentle floating motion, ethereal movement, soft transitions",
+    "dynamic_showcase": "dynamic product showcase, multiple angles, professional presentation",
+    "lifestyle_scene": "lifestyle integration, environmental context, natural movement",
+    "premium_reveal": "premium product reveal, dramatic lighting, luxury presentation",
+    "tech_demo": "technology demonstration, interactive elements, modern aesthetic",
+    "organic_flow": "organic flowing movement, natural transitions, smooth animation",
+    "dramatic_lighting": "dramatic lighting changes, cinematic atmosphere, mood enhancement",
+    "close_up_details": "detailed close-up shots, texture focus, premium quality reveal",
+    "environmental_context": "environmental integration, contextual placement, story-driven"
+}
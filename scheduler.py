@@ -0,0 +1,431 @@
+"""
+Gateway-side scheduler for GPU-bound requests
+Caps outstanding upstream generations across all gateway workers and hands
+free slots out by priority class, round-robin between clients within a
+class
+"""
+
+import asyncio
+import json
+import math
+import os
+import socket
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional, Tuple
+
+# Highest priority first
+PRIORITIES = ("interactive", "preview", "bulk")
+
+# Seconds between attempts to claim a slot freed by another worker
+SLOT_POLL_INTERVAL = 0.2
+
+# A worker's waiting marker older than this is ignored (the worker died
+# or stopped waiting without cleaning up)
+MARKER_TTL = 10 * SLOT_POLL_INTERVAL
+
+
+class SharedSlots:
+    """
+    Upstream slots shared by all gateway workers through lease files
+
+    Slot n is held by whoever created slot-n.lease, so the capacity holds
+    host-wide (or across hosts on a shared volume) however many workers
+    gunicorn runs. Each worker with queued requests also keeps a marker
+    with the class of the request it would serve next and how long it has
+    gone without a slot, and a worker only claims a slot when no other
+    worker outranks it: higher class first, then longest without a slot,
+    so workers take turns much like clients do within one.
+
+    Each lease carries an owner token, so a holder whose lease was broken
+    never releases the slot its successor claimed. Holders refresh their
+    leases (refresh()) so that long generations don't look abandoned.
+    """
+
+    def __init__(self, root: str, capacity: int, lease_ttl: float):
+        self.root = root
+        self.capacity = capacity
+        self.lease_ttl = lease_ttl
+        os.makedirs(self.root, exist_ok=True)
+        self._host = socket.gethostname()
+        # Owner token of each slot this worker holds
+        self._held: Dict[int, str] = {}
+
+    def _slot_path(self, slot: int) -> str:
+        return os.path.join(self.root, f"slot-{slot}.lease")
+
+    def _marker_path(self, pid: int) -> str:
+        return os.path.join(self.root, f"waiting-{self._host}-{pid}.json")
+
+    def _read_lease(self, path: str) -> Optional[Dict[str, Any]]:
+        """The lease at path, or None if there is none or it is being written"""
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _lease_is_stale(self, lease: Dict[str, Any]) -> bool:
+        if time.time() > lease.get("expires", 0):
+            return True
+        if lease.get("host") == self._host:
+            try:
+                os.kill(lease["pid"], 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+        return False
+
+    def _lease(self, token: str) -> Dict[str, Any]:
+        return {"host": self._host, "pid": os.getpid(), "token": token, "expires": time.time() + self.lease_ttl}
+
+    def _remove_lease(self, slot: int, token: str) -> bool:
+        """
+        Delete slot's lease if it is still the one with this token
+
+        The lease is renamed first, so that only one of several racing
+        workers gets it, then checked; a newer lease taken by mistake is
+        linked back, which fails rather than replacing one created since.
+        """
+        path = self._slot_path(slot)
+        lease = self._read_lease(path)
+        if lease is None or lease.get("token") != token:
+            return False
+        taken = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+        try:
+            os.replace(path, taken)
+        except FileNotFoundError:
+            return False
+        try:
+            if (self._read_lease(taken) or {}).get("token") == token:
+                return True
+            try:
+                os.link(taken, path)
+            except FileExistsError:
+                pass
+            return False
+        finally:
+            os.unlink(taken)
+
+    def try_claim(self) -> Optional[int]:
+        """Claim a free slot, breaking leases of dead holders; None if all are held"""
+        token = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        for slot in range(self.capacity):
+            for _ in range(2):
+                try:
+                    fd = os.open(self._slot_path(slot), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+                except FileExistsError:
+                    lease = self._read_lease(self._slot_path(slot))
+                    if lease is not None and self._lease_is_stale(lease):
+                        self._remove_lease(slot, lease.get("token"))
+                        continue
+                    break
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self._lease(token), f)
+                self._held[slot] = token
+                return slot
+        return None
+
+    def release(self, slot: int) -> None:
+        """Give the slot back, unless its lease was broken and claimed by another worker"""
+        token = self._held.pop(slot, None)
+        if token is not None:
+            self._remove_lease(slot, token)
+
+    def holding(self) -> bool:
+        return bool(self._held)
+
+    def refresh(self) -> None:
+        """Push back the expiry of every slot this worker still holds"""
+        for slot, token in list(self._held.items()):
+            try:
+                # Checked and rewritten through one descriptor, so a lease
+                # that replaced ours in the meantime is never overwritten
+                with open(self._slot_path(slot), "r+") as f:
+                    lease = json.load(f)
+                    if lease.get("token") != token:
+                        raise FileNotFoundError
+                    f.seek(0)
+                    f.truncate()
+                    json.dump(self._lease(token), f)
+            except FileNotFoundError:
+                print(f"GPU slot {slot} lease was broken while held")
+                del self._held[slot]
+            except (OSError, ValueError) as e:
+                print(f"Failed to refresh GPU slot {slot} lease: {str(e)}")
+
+    def held(self) -> int:
+        """Slots currently held by any worker"""
+        return sum(os.path.exists(self._slot_path(slot)) for slot in range(self.capacity))
+
+    def set_waiting(self, head: Optional[Tuple[int, float]]) -> None:
+        """Publish this worker's next request as (priority index, waiting since), or None"""
+        path = self._marker_path(os.getpid())
+        if head is None:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            return
+        temp = f"{path}.tmp"
+        with open(temp, "w") as f:
+            json.dump({"priority": head[0], "since": head[1]}, f)
+        os.replace(temp, path)
+
+    def _others_waiting(self):
+        own = os.path.basename(self._marker_path(os.getpid()))
+        now = time.time()
+        for name in os.listdir(self.root):
+            if not name.startswith("waiting-") or not name.endswith(".json") or name == own:
+                continue
+            path = os.path.join(self.root, name)
+            try:
+                if now - os.path.getmtime(path) > MARKER_TTL:
+                    continue
+                with open(path) as f:
+                    marker = json.load(f)
+            except (OSError, ValueError):
+                continue
+            yield marker["priority"], marker["since"]
+
+    def outranked(self, head: Tuple[int, float]) -> bool:
+        """Whether another worker's next request should get the next free slot first"""
+        return any(other < head for other in self._others_waiting())
+
+    def waiting_workers(self) -> int:
+        return sum(1 for _ in self._others_waiting())
+
+
+class HeldSlot:
+    """An acquired scheduler slot, yielded by GpuScheduler.slot"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Future] = None
+
+    def hand_over(self, task: asyncio.Future) -> None:
+        """Keep the slot after the block exits, until `task` is done"""
+        self.task = task
+
+
+class GpuScheduler:
+    """
+    Fair-queueing admission control in front of the Modal upstream
+
+    Each priority class keeps one FIFO per client; clients within a class
+    are served round-robin, so one client's 12-colour batch cannot starve
+    another's single edit, and a waiting higher class is always served
+    before a lower one.
+
+    The capacity is shared by all gunicorn workers through SharedSlots.
+    Fair queueing happens within each worker; between workers, the freed
+    slot goes to the worker whose next request is of the highest class,
+    then to the one that has gone longest without a slot.
+    """
+
+    def __init__(self, capacity: int = None, slot_dir: str = None, lease_ttl: float = None):
+        """
+        Args:
+            capacity: Maximum concurrent upstream generations across all
+                workers; defaults to GPU_MAX_CONCURRENCY
+            slot_dir: Directory shared by all workers; defaults to
+                GPU_SLOT_DIR or .cache/gpu-slots. An empty GPU_SLOT_DIR
+                makes the capacity per process instead.
+            lease_ttl: Seconds after which a slot is considered abandoned
+                even if its holder looks alive
+        """
+        self.capacity = capacity or int(os.getenv("GPU_MAX_CONCURRENCY", "2"))
+        self.in_flight = 0
+        self._queues: Dict[str, "OrderedDict[str, Deque[Tuple[asyncio.Future, float]]]"] = {
+            priority: OrderedDict() for priority in PRIORITIES
+        }
+        self._service_time: Optional[float] = None
+        self.completed = {priority: 0 for priority in PRIORITIES}
+
+        if slot_dir is None:
+            slot_dir = os.getenv("GPU_SLOT_DIR", os.path.join(".cache", "gpu-slots"))
+        if lease_ttl is None:
+            lease_ttl = float(os.getenv("GPU_SLOT_LEASE_TTL", "900"))
+        self.shared = SharedSlots(slot_dir, self.capacity, lease_ttl) if slot_dir else None
+        self._poller: Optional[asyncio.Task] = None
+        self._refresher: Optional[asyncio.Task] = None
+        self._last_grant = 0.0
+
+    def _depth(self, priority: str) -> int:
+        return sum(len(waiters) for waiters in self._queues[priority].values())
+
+    def _head(self) -> Optional[Tuple[int, float]]:
+        """
+        (priority index, waiting since) of the request _next_waiter would
+        return, where it waits since it was queued or this worker last got
+        a slot, whichever is later
+        """
+        for index, priority in enumerate(PRIORITIES):
+            queue = self._queues[priority]
+            while queue:
+                client_id, waiters = next(iter(queue.items()))
+                while waiters and waiters[0][0].done():
+                    waiters.popleft()
+                if waiters:
+                    return index, max(waiters[0][1], self._last_grant)
+                del queue[client_id]
+        return None
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue:
+                client_id, waiters = queue.popitem(last=False)
+                waiter, _ = waiters.popleft()
+                if waiters:
+                    # Back of the line for this client's next request
+                    queue[client_id] = waiters
+                if not waiter.done():
+                    return waiter
+        return None
+
+    def _claim(self, head: Tuple[int, float]) -> Tuple[bool, Optional[int]]:
+        """(claimed, shared slot number) for the request at `head`"""
+        if self.shared is None:
+            return True, None
+        if self.shared.outranked(head):
+            return False, None
+        slot = self.shared.try_claim()
+        if slot is not None:
+            self._last_grant = time.time()
+            if self._refresher is None or self._refresher.done():
+                self._refresher = asyncio.ensure_future(self._refresh())
+        return slot is not None, slot
+
+    def _dispatch(self) -> None:
+        while self.in_flight < self.capacity:
+            head = self._head()
+            if head is None:
+                break
+            claimed, slot = self._claim(head)
+            if not claimed:
+                break
+            self.in_flight += 1
+            self._next_waiter().set_result(slot)
+
+        if self.shared is not None:
+            head = self._head()
+            self.shared.set_waiting(head)
+            if head is not None and (self._poller is None or self._poller.done()):
+                # Slots freed by other workers are not signalled, so poll
+                self._poller = asyncio.ensure_future(self._poll())
+
+    async def _poll(self) -> None:
+        while self._head() is not None:
+            await asyncio.sleep(SLOT_POLL_INTERVAL)
+            self._dispatch()
+
+    async def _refresh(self) -> None:
+        # Keeps held leases from expiring during long generations
+        while self.shared.holding():
+            await asyncio.sleep(self.shared.lease_ttl / 3)
+            self.shared.refresh()
+
+    def _remove(self, priority: str, client_id: str, waiter: asyncio.Future) -> None:
+        waiters = self._queues[priority].get(client_id)
+        if waiters is None:
+            return
+        for entry in waiters:
+            if entry[0] is waiter:
+                waiters.remove(entry)
+                break
+        if not waiters:
+            del self._queues[priority][client_id]
+
+    async def acquire(self, client_id: str, priority: str = "interactive") -> Optional[int]:
+        """Wait for an upstream slot; pass the result to release() when done"""
+        if priority not in self._queues:
+            priority = "interactive"
+
+        queued_at = time.time()
+        if self.in_flight < self.capacity and self._head() is None:
+            claimed, slot = self._claim((PRIORITIES.index(priority), max(queued_at, self._last_grant)))
+            if claimed:
+                self.in_flight += 1
+                return slot
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(client_id, deque()).append((waiter, queued_at))
+        self._dispatch()
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted a slot just as we were cancelled: give it back
+                self.release(waiter.result())
+            else:
+                self._remove(priority, client_id, waiter)
+                if self.shared is not None:
+                    self.shared.set_waiting(self._head())
+            raise
+
+    def release(self, slot: Optional[int] = None) -> None:
+        if slot is not None:
+            self.shared.release(slot)
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _finish(self, priority: str, slot: Optional[int], started: float) -> None:
+        elapsed = time.monotonic() - started
+        # Exponentially weighted service time for wait estimates
+        if self._service_time is None:
+            self._service_time = elapsed
+        else:
+            self._service_time = 0.8 * self._service_time + 0.2 * elapsed
+        self.completed[priority if priority in self.completed else "interactive"] += 1
+        self.release(slot)
+
+    @asynccontextmanager
+    async def slot(self, client_id: str, priority: str = "interactive"):
+        """
+        Hold an upstream slot for the duration of the block
+
+        The block may hand the slot over to a task that outlives it with
+        `held.hand_over(task)`, e.g. an abandoned call still winding down
+        on the GPU; the slot is then released when that task finishes.
+        """
+        slot = await self.acquire(client_id, priority)
+        held = HeldSlot()
+        started = time.monotonic()
+        try:
+            yield held
+        finally:
+            if held.task is None:
+                self._finish(priority, slot, started)
+            else:
+                held.task.add_done_callback(lambda task: self._finish(priority, slot, started))
+
+    def estimated_wait(self, priority: str) -> float:
+        """Seconds a new request of this class would wait for a slot"""
+        if self._service_time is None:
+            return 0.0
+        ahead = sum(self._depth(p) for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        if self.in_flight < self.capacity and ahead == 0:
+            return 0.0
+        return math.ceil((ahead + 1) / self.capacity) * self._service_time
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and estimated wait per priority class"""
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "in_flight_all_workers": self.shared.held() if self.shared is not None else self.in_flight,
+            "other_workers_waiting": self.shared.waiting_workers() if self.shared is not None else 0,
+            "service_time": self._service_time,
+            "classes": {
+                priority: {
+                    "queued": self._depth(priority),
+                    "clients": len(self._queues[priority]),
+                    "estimated_wait": round(self.estimated_wait(priority), 1),
+                    "completed": self.completed[priority],
+                }
+                for priority in PRIORITIES
+            },
+        }
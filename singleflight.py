@@ -0,0 +1,264 @@
+"""
+Single-flight coalescing for identical in-flight generation requests
+Concurrent callers with the same request key share one upstream call, within
+a worker through a shared future and across gunicorn workers through a
+lease file and a short-lived result file in a shared directory
+"""
+
+import asyncio
+import glob
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import time
+import uuid
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def request_key(payload: Dict[str, Any]) -> str:
+    """
+    Hash of a normalized generation request
+
+    Prompts are whitespace-collapsed and numbers compared as floats, so
+    "a  red mug" with guidance 7 matches "a red mug" with guidance 7.0.
+    """
+    normalized = {}
+    for name, value in payload.items():
+        if value is None:
+            continue
+        if isinstance(value, str) and name == "prompt":
+            value = " ".join(value.split())
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = float(value)
+        normalized[name] = value
+    encoded = json.dumps(normalized, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()[:32]
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time across all gateway workers
+
+    Within a process, followers await the leader's future. A worker that
+    finds another worker's lease polls for the result of that lease's call.
+    If the lease disappears without a result, because the leader failed or
+    its process died, the worker takes over and makes the call itself.
+    Only successful results are shared across processes, and only with
+    workers that saw the call's lease while it ran: a request arriving
+    after a call finished makes a new one. Results are deleted after
+    `result_ttl` seconds.
+
+    A call outlives any one caller going away and is cancelled only once
+    every caller in this worker has been cancelled, since nobody is left
+    to see its result.
+    """
+
+    def __init__(self, root: str = None, lease_ttl: float = None, result_ttl: float = 0.5):
+        """
+        Args:
+            root: Directory shared by all workers; defaults to
+                SINGLEFLIGHT_DIR or .cache/inflight
+            lease_ttl: Seconds after which a lease is considered abandoned
+                even if its owner looks alive
+            result_ttl: Seconds a finished result stays available to
+                the workers that were waiting on it
+        """
+        self.root = root or os.getenv("SINGLEFLIGHT_DIR", os.path.join(".cache", "inflight"))
+        self.lease_ttl = lease_ttl if lease_ttl is not None else float(os.getenv("SINGLEFLIGHT_LEASE_TTL", "900"))
+        self.result_ttl = result_ttl
+        # Waiting workers poll at least this often, so they see a result
+        # before it is deleted
+        self.poll_interval = min(0.25, result_ttl / 2)
+        os.makedirs(self.root, exist_ok=True)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self._host = socket.gethostname()
+        self.counters = Counter()
+
+    def _lease_path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.lease")
+
+    def _result_path(self, key: str, token: str) -> str:
+        return os.path.join(self.root, f"{key}.{token}.json")
+
+    def _try_lease(self, key: str, token: str) -> bool:
+        """Atomically create the lease file; False if another worker holds it"""
+        try:
+            fd = os.open(self._lease_path(key), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            json.dump({
+                "host": self._host,
+                "pid": os.getpid(),
+                "token": token,
+                "expires": time.time() + self.lease_ttl
+            }, f)
+        return True
+
+    def _read_lease(self, path: str) -> Optional[Dict[str, Any]]:
+        """The lease at path, or None if there is none or it is being written"""
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _lease_is_stale(self, lease: Dict[str, Any]) -> bool:
+        if time.time() > lease.get("expires", 0):
+            return True
+        if lease.get("host") == self._host:
+            try:
+                os.kill(lease["pid"], 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+        return False
+
+    def _remove_lease(self, key: str, token: str) -> bool:
+        """
+        Delete the lease if it is still the one with this token
+
+        The lease is renamed first, so that only one of several racing
+        workers gets it, then checked; a newer lease taken by mistake is
+        linked back, which fails rather than replacing one created since.
+        """
+        path = self._lease_path(key)
+        lease = self._read_lease(path)
+        if lease is None or lease.get("token") != token:
+            return False
+        taken = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+        try:
+            os.replace(path, taken)
+        except FileNotFoundError:
+            return False
+        try:
+            if (self._read_lease(taken) or {}).get("token") == token:
+                return True
+            try:
+                os.link(taken, path)
+            except FileExistsError:
+                pass
+            return False
+        finally:
+            os.unlink(taken)
+
+    def _read_result(self, key: str, token: str) -> Optional[Any]:
+        try:
+            with open(self._result_path(key, token)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_result(self, key: str, token: str, result: Any) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(result, f)
+            os.replace(tmp_path, self._result_path(key, token))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _discard_result(self, key: str, token: str) -> None:
+        try:
+            os.unlink(self._result_path(key, token))
+        except FileNotFoundError:
+            pass
+
+    def _sweep_results(self, key: str) -> None:
+        # Results left behind by leaders that died before deleting them
+        for path in glob.glob(os.path.join(self.root, f"{key}.*.json")):
+            try:
+                if time.time() - os.path.getmtime(path) > self.result_ttl:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _forget(self, key: str, future: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if not future.cancelled():
+            # Mark the exception retrieved even if every caller went away
+            future.exception()
+
+    async def _lead(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Make the call once this worker holds the lease, sharing the result if it succeeds"""
+        token = f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        # Token of the other worker's call this one is waiting on
+        waiting_on = None
+        delay = 0.05
+        while not self._try_lease(key, token):
+            lease = self._read_lease(self._lease_path(key))
+            if lease is not None:
+                waiting_on = lease.get("token")
+                result = self._read_result(key, waiting_on)
+                if result is not None:
+                    self.counters["coalesced_remote"] += 1
+                    return result
+                if self._lease_is_stale(lease):
+                    if self._remove_lease(key, waiting_on):
+                        self.counters["stale_leases"] += 1
+                    continue
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, self.poll_interval)
+
+        try:
+            # The call waited on may have finished between the last poll
+            # and taking the lease
+            result = self._read_result(key, waiting_on) if waiting_on else None
+            if result is not None:
+                self.counters["coalesced_remote"] += 1
+                return result
+
+            self.counters["leaders"] += 1
+            self._sweep_results(key)
+            result = await call()
+            try:
+                self._write_result(key, token, result)
+                asyncio.get_running_loop().call_later(self.result_ttl, self._discard_result, key, token)
+            except OSError as e:
+                print(f"Failed to share single-flight result: {str(e)}")
+            return result
+        finally:
+            self._remove_lease(key, token)
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Return call()'s result, running it only if no identical call is in flight
+
+        `call` must return a JSON-serializable value. Exceptions it raises
+        reach every caller in this worker. Callers in other workers retry.
+        """
+        self.counters["requests"] += 1
+        future = self._inflight.get(key)
+        if future is not None:
+            self.counters["coalesced_local"] += 1
+        else:
+            # The upstream call runs as its own task so that one caller
+            # disconnecting does not cancel it for the others
+            future = asyncio.ensure_future(self._lead(key, call))
+            self._inflight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+
+        self._waiters[future] = self._waiters.get(future, 0) + 1
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if self._waiters[future] == 1 and not future.done():
+                # The last caller is gone
+                self.counters["abandoned"] += 1
+                future.cancel()
+            raise
+        finally:
+            self._waiters[future] -= 1
+            if not self._waiters[future]:
+                del self._waiters[future]
+
+    def stats(self) -> Dict[str, Any]:
+        counters = dict(self.counters)
+        counters["in_flight"] = len(self._inflight)
+        return counters
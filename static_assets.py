@@ -0,0 +1,149 @@
+"""
+In-memory static asset layer for the studio frontend
+Fingerprints files by content hash, precompresses them once at startup
+(brotli when available, gzip always) and answers with immutable caching,
+ETags and 304s
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Dict, Optional
+
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smaller files gain little from compression and cost a header either way
+MIN_COMPRESS_SIZE = 512
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+# name.<12 hex>.ext
+_FINGERPRINTED = re.compile(r"^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})(?P<ext>\.[A-Za-z0-9]+)$")
+
+
+class Asset:
+    """One file (or rendered page) with its precompressed variants"""
+
+    def __init__(self, body: bytes, content_type: str):
+        self.body = body
+        self.content_type = content_type
+        self.hash = hashlib.sha256(body).hexdigest()[:12]
+        self.variants: Dict[str, bytes] = {}
+        if len(body) >= MIN_COMPRESS_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+            if brotli is not None:
+                self.variants["br"] = brotli.compress(body, quality=11)
+            self.variants["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+
+    def etag(self, encoding: Optional[str]) -> str:
+        return f'"{self.hash}-{encoding}"' if encoding else f'"{self.hash}"'
+
+
+def _accepted_encoding(accept_encoding: str, asset: Asset) -> Optional[str]:
+    """Best precompressed variant the client accepts"""
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in asset.variants and (encoding in accepted or "*" in accepted):
+            return encoding
+    return None
+
+
+class StaticAssets:
+    """
+    Serves a directory from memory
+
+    Every file is reachable under its plain path, which must be
+    revalidated, and under a fingerprinted name (app.<hash>.js) that is
+    cached for a year. HTML entry points are rendered once with their
+    asset references rewritten to the fingerprinted names.
+    """
+
+    def __init__(self, directory: str, url_prefix: str = "/frontend"):
+        self.directory = directory
+        self.url_prefix = url_prefix.rstrip("/")
+        self.files: Dict[str, Asset] = {}
+        self.pages: Dict[str, Asset] = {}
+        self.load()
+
+    def load(self) -> None:
+        """(Re)read and compress every file under the directory"""
+        files = {}
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                full_path = os.path.join(dirpath, filename)
+                rel_path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+                content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                if content_type.startswith("text/") or content_type == "application/javascript":
+                    content_type += "; charset=utf-8"
+                with open(full_path, "rb") as f:
+                    files[rel_path] = Asset(f.read(), content_type)
+        self.files = files
+
+    def url(self, rel_path: str) -> str:
+        """Fingerprinted URL for a file, or its plain URL if it is unknown"""
+        asset = self.files.get(rel_path)
+        if asset is None:
+            return f"{self.url_prefix}/{rel_path}"
+        stem, ext = os.path.splitext(rel_path)
+        return f"{self.url_prefix}/{stem}.{asset.hash}{ext}"
+
+    def fingerprint_html(self, html: str) -> str:
+        """Rewrite src/href references to this directory to fingerprinted URLs"""
+        prefix = re.escape(self.url_prefix)
+        pattern = re.compile(rf'(src|href)="{prefix}/([^"?#]+)(?:\?[^"#]*)?"')
+        return pattern.sub(lambda m: f'{m.group(1)}="{self.url(m.group(2))}"', html)
+
+    def add_page(self, name: str, html: str) -> None:
+        """Register a rendered HTML page, served by page_response(name)"""
+        self.pages[name] = Asset(self.fingerprint_html(html).encode(), "text/html; charset=utf-8")
+
+    def _respond(self, asset: Asset, headers, cache_control: str) -> Response:
+        encoding = _accepted_encoding(headers.get("accept-encoding", ""), asset)
+        response_headers = {
+            "Cache-Control": cache_control,
+            "ETag": asset.etag(encoding),
+            "Vary": "Accept-Encoding",
+        }
+
+        # Any representation of the same content is still current
+        if_none_match = headers.get("if-none-match", "")
+        if if_none_match == "*" or asset.hash in if_none_match:
+            return Response(status_code=304, headers=response_headers)
+
+        body = asset.body
+        if encoding:
+            body = asset.variants[encoding]
+            response_headers["Content-Encoding"] = encoding
+        return Response(body, media_type=asset.content_type, headers=response_headers)
+
+    def response(self, path: str, headers) -> Optional[Response]:
+        """Response for a request under url_prefix, or None for unknown files"""
+        asset = self.files.get(path)
+        if asset is not None:
+            return self._respond(asset, headers, REVALIDATE)
+
+        match = _FINGERPRINTED.match(path)
+        if match is None:
+            return None
+        asset = self.files.get(match["stem"] + match["ext"])
+        if asset is None:
+            return None
+        # An outdated fingerprint still gets the current file, just not cached for good
+        cache_control = IMMUTABLE if match["hash"] == asset.hash else REVALIDATE
+        return self._respond(asset, headers, cache_control)
+
+    def page_response(self, name: str, headers) -> Response:
+        return self._respond(self.pages[name], headers, REVALIDATE)
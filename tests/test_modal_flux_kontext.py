@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("modal")
+httpx = pytest.importorskip("httpx")
+
+import modal_flux_kontext
+
+
+class FakeRemote:
+    """generate.remote stand-in that holds the generation until released"""
+
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    def __call__(self, **kwargs):
+        raise AssertionError("generate.remote blocks the web app's event loop")
+
+    async def aio(self, **kwargs):
+        self.started.set()
+        await self.release.wait()
+        return {"success": True, "image": "", "timings": {"total": 0.0}}
+
+
+class FakeFlux:
+    remote = None
+
+    def __init__(self):
+        self.generate = type("Method", (), {"remote": FakeFlux.remote})()
+
+
+class FakeFlags:
+    def __init__(self):
+        self.put = type("Put", (), {"aio": self._put})()
+        self.flags = {}
+
+    async def _put(self, key, value):
+        self.flags[key] = value
+
+
+def test_cancel_is_served_while_a_generate_is_in_flight(monkeypatch):
+    FakeFlux.remote = FakeRemote()
+    flags = FakeFlags()
+    monkeypatch.setattr(modal_flux_kontext, "FluxKontext", FakeFlux)
+    monkeypatch.setattr(modal_flux_kontext, "cancel_flags", flags)
+    web_app = modal_flux_kontext.web_app.local()
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=web_app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://flux") as client:
+            generate = asyncio.create_task(
+                client.post("/generate", json={"prompt": "a chair", "job_id": "job-1"})
+            )
+            await asyncio.wait_for(FakeFlux.remote.started.wait(), 5)
+
+            cancel = await asyncio.wait_for(client.post("/cancel", json={"job_id": "job-1"}), 5)
+            assert cancel.json() == {"success": True, "job_id": "job-1"}
+            assert "job-1" in flags.flags
+            assert not generate.done()
+
+            FakeFlux.remote.release.set()
+            response = await asyncio.wait_for(generate, 5)
+            assert response.status_code == 200
+
+    asyncio.run(scenario())
@@ -0,0 +1,64 @@
+import asyncio
+
+import httpx
+import pytest
+
+from upstream import CircuitBreaker, CircuitOpenError, ModalUpstream
+
+
+def open_upstream():
+    upstream = ModalUpstream("http://modal", max_retries=0, failure_threshold=1, reset_timeout=0.05)
+    upstream.breaker.record_failure()
+    assert upstream.breaker.state == CircuitBreaker.OPEN
+    return upstream
+
+
+def test_cancelled_half_open_probe_lets_the_next_call_probe():
+    upstream = open_upstream()
+    sent = asyncio.Event()
+
+    async def hang(path, payload):
+        sent.set()
+        await asyncio.sleep(60)
+
+    async def respond(path, payload):
+        return httpx.Response(200, json={"success": True})
+
+    async def scenario():
+        await asyncio.sleep(0.1)
+        upstream._send = hang
+        probe = asyncio.ensure_future(upstream.post("/generate", {}))
+        await sent.wait()
+        assert upstream.breaker.state == CircuitBreaker.HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            await upstream.post("/generate", {})
+
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        upstream._send = respond
+        response = await upstream.post("/generate", {})
+        assert response.status_code == 200
+        assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_half_open_probe_raising_reopens_the_circuit():
+    upstream = open_upstream()
+
+    async def broken(path, payload):
+        raise ValueError("not JSON")
+
+    async def scenario():
+        await asyncio.sleep(0.1)
+        upstream._send = broken
+        with pytest.raises(ValueError):
+            await upstream.post("/generate", {})
+        assert upstream.breaker.state == CircuitBreaker.OPEN
+
+        await asyncio.sleep(0.1)
+        assert upstream.breaker.allow()
+
+    asyncio.run(scenario())
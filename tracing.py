@@ -0,0 +1,218 @@
+"""
+Per-request stage tracing
+Records named spans (parse, decode, queue, upstream, upscale...) for each
+gateway request, returns them in a Server-Timing header together with the
+stages FluxKontext reports back in its own Server-Timing header, and
+appends sampled traces to a JSON-lines log, so a slow /api/generate can be
+attributed to a hop.
+
+Usage:
+    python tracing.py [.cache/traces.jsonl] [--route /api/generate]
+"""
+
+import argparse
+import contextlib
+import contextvars
+import json
+import os
+import random
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+
+from starlette.datastructures import MutableHeaders
+
+# Where sampled traces are appended
+TRACE_LOG = os.getenv("TRACE_LOG", os.path.join(".cache", "traces.jsonl"))
+
+# Fraction of requests written to the trace log; requests with an X-Trace
+# header are always written. Every response gets Server-Timing either way.
+SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """Spans of one request, as (name, start offset, duration) in seconds"""
+
+    def __init__(self, method: str, path: str, sampled: bool):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.sampled = sampled
+        self.started = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, name: str, seconds: float, start: Optional[float] = None) -> None:
+        offset = (start if start is not None else time.perf_counter() - seconds) - self.started
+        self.spans.append({"name": name, "start": round(offset, 6), "seconds": round(seconds, 6)})
+
+    def server_timing(self) -> str:
+        """Server-Timing value with the durations of repeated spans summed"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span["name"]] = totals.get(span["name"], 0.0) + span["seconds"]
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the enclosed block as a span of the current request, if any"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - start, start)
+
+
+def add(name: str, seconds: float) -> None:
+    """Record a span measured elsewhere (e.g. by the upstream), ending now"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+def since_start(name: str) -> None:
+    """Record the time from the request's arrival to now, e.g. body parsing"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, time.perf_counter() - trace.started, trace.started)
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """Durations in seconds from a Server-Timing header (entries without dur are skipped)"""
+    timings = {}
+    for entry in (header or "").split(","):
+        name, *params = [part.strip() for part in entry.split(";")]
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "dur" and name:
+                try:
+                    timings[name] = float(value.strip('"')) / 1000
+                except ValueError:
+                    pass
+    return timings
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that opens a Trace per HTTP request
+
+    Adds Server-Timing (the request's spans plus "total", the time to the
+    response headers) and X-Trace-Id to every response. Sampled traces are
+    logged once the body is sent, with the time taken to transfer it.
+    """
+
+    def __init__(self, app, log_path: str = TRACE_LOG, sample_rate: float = SAMPLE_RATE):
+        self.app = app
+        self.log_path = log_path
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        forced = any(key == b"x-trace" for key, _ in scope["headers"])
+        trace = Trace(scope["method"], scope["path"], forced or random.random() < self.sample_rate)
+        token = _current.set(trace)
+        state = {"status": None, "headers_at": None, "finished_at": None}
+
+        async def send_traced(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["headers_at"] = time.perf_counter()
+                headers = MutableHeaders(scope=message)
+                timing = trace.server_timing()
+                total = f"total;dur={(state['headers_at'] - trace.started) * 1000:.1f}"
+                headers.append("Server-Timing", f"{timing}, {total}" if timing else total)
+                headers.append("X-Trace-Id", trace.id)
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["finished_at"] = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            _current.reset(token)
+            if trace.sampled:
+                self._log(trace, scope, state)
+
+    def _log(self, trace: Trace, scope, state: Dict[str, Any]) -> None:
+        route = scope.get("route")
+        headers_at = state["headers_at"]
+        finished_at = state["finished_at"] or time.perf_counter()
+        record = {
+            "trace_id": trace.id,
+            "at": time.time(),
+            "method": trace.method,
+            "path": trace.path,
+            "route": getattr(route, "path", None),
+            "status": state["status"],
+            "headers_seconds": round(headers_at - trace.started, 6) if headers_at else None,
+            "total_seconds": round(finished_at - trace.started, 6),
+            "transfer_seconds": round(finished_at - headers_at, 6) if headers_at else None,
+            "spans": trace.spans
+        }
+        try:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            # One write per record on an O_APPEND descriptor, so records from
+            # several workers never interleave
+            fd = os.open(self.log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, (json.dumps(record) + "\n").encode())
+            finally:
+                os.close(fd)
+        except OSError as e:
+            print(f"Trace log write failed: {str(e)}")
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("log", nargs="?", default=TRACE_LOG, help="Trace log to summarise")
+    parser.add_argument("--route", help="Only requests to this route, e.g. /api/generate")
+    args = parser.parse_args()
+
+    by_route: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+    with open(args.log) as f:
+        for line in f:
+            record = json.loads(line)
+            route = record.get("route") or record["path"]
+            if args.route and route != args.route:
+                continue
+            stages = by_route[f"{record['method']} {route}"]
+            stages["(total)"].append(record["total_seconds"])
+            if record.get("transfer_seconds") is not None:
+                stages["(transfer)"].append(record["transfer_seconds"])
+            totals: Dict[str, float] = defaultdict(float)
+            for span in record["spans"]:
+                totals[span["name"]] += span["seconds"]
+            for name, seconds in totals.items():
+                stages[name].append(seconds)
+
+    for route, stages in sorted(by_route.items()):
+        print(f"{route}  ({len(stages['(total)'])} requests)")
+        print(f"  {'stage':<16}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+        for name, values in sorted(stages.items(), key=lambda item: -sum(item[1])):
+            print(
+                f"  {name:<16}{len(values):>7}{_percentile(values, 0.5) * 1000:>10.1f}"
+                f"{_percentile(values, 0.95) * 1000:>10.1f}{sum(values) / len(values) * 1000:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
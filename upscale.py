@@ -0,0 +1,98 @@
+"""
+Resolution-decoupled FLUX generation
+FLUX.1-Kontext runs at (at most) its native pixel budget and larger
+deliverables are produced on the CPU: Lanczos resampling followed by an
+unsharp mask scaled to the enlargement, so a 2048 px result costs about the
+same GPU time as a 1024 px one. The *_base64 helpers are process pool tasks.
+"""
+
+import base64
+import io
+import math
+import os
+from typing import Tuple
+
+import cv2
+from PIL import Image
+
+import image_kernels
+import tiling
+
+# Side of the square pixel budget FLUX is run at; larger requests keep
+# their aspect ratio and are upscaled afterwards
+NATIVE_RESOLUTION = int(os.getenv("FLUX_NATIVE_RESOLUTION", "1024"))
+
+# Largest side the CPU stage will produce
+MAX_OUTPUT_SIDE = int(os.getenv("UPSCALE_MAX_SIDE", "8192"))
+
+# Unsharp strength (percent) after upscaling, which softens edges in
+# proportion to the enlargement; 0 disables
+SHARPEN_PERCENT = int(os.getenv("UPSCALE_SHARPEN_PERCENT", "60"))
+
+# FLUX works on 16 px latent patches
+SIZE_MULTIPLE = 16
+
+
+def gpu_size(width: int, height: int, native: int = NATIVE_RESOLUTION) -> Tuple[int, int]:
+    """
+    Size to generate at for a requested size: unchanged if it fits the
+    native pixel budget, otherwise the same aspect ratio scaled down to
+    it, in multiples of 16
+    """
+    if width * height <= native * native:
+        return width, height
+    scale = native / math.sqrt(width * height)
+    return (
+        max(SIZE_MULTIPLE, int(width * scale) // SIZE_MULTIPLE * SIZE_MULTIPLE),
+        max(SIZE_MULTIPLE, int(height * scale) // SIZE_MULTIPLE * SIZE_MULTIPLE)
+    )
+
+
+def clamp_size(width: int, height: int, max_side: int = MAX_OUTPUT_SIDE) -> Tuple[int, int]:
+    """(width, height) scaled down to fit max_side, keeping the aspect ratio"""
+    if max(width, height) <= max_side:
+        return width, height
+    scale = max_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def upscale(img: Image.Image, width: int, height: int) -> Image.Image:
+    """Lanczos-resize to (width, height), then re-sharpen edges softened by the enlargement"""
+    arr = image_kernels.to_array(img)
+    factor = max(width / arr.shape[1], height / arr.shape[0])
+    arr = cv2.resize(arr, (width, height), interpolation=cv2.INTER_LANCZOS4)
+    if factor > 1 and SHARPEN_PERCENT:
+        # Lanczos blur spreads over about half a source pixel
+        radius = 0.5 * factor
+        sharpen = lambda block: image_kernels.unsharp_mask(block, radius, SHARPEN_PERCENT, 2)
+        if tiling.should_tile(arr):
+            arr = tiling.map_tiles(arr, sharpen, math.ceil(3 * radius) + 1)
+        else:
+            arr = sharpen(arr)
+    return image_kernels.from_array(arr)
+
+
+def upscale_base64(image_base64: str, width: int, height: int) -> bytes:
+    """Pool task: PNG of a base64 FLUX result upscaled to (width, height)"""
+    img = Image.open(io.BytesIO(base64.b64decode(image_base64)))
+    buffer = io.BytesIO()
+    upscale(img, width, height).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def source_size(image_base64: str) -> Tuple[int, int]:
+    """Size of a base64 image, read from its header where possible"""
+    # PNG and most JPEG headers sit well within the first 48 KiB
+    try:
+        return Image.open(io.BytesIO(base64.b64decode(image_base64[:65536]))).size
+    except Exception:
+        return Image.open(io.BytesIO(base64.b64decode(image_base64))).size
+
+
+def fit_base64(image_base64: str, native: int = NATIVE_RESOLUTION) -> str:
+    """Pool task: an edit source downscaled to the native pixel budget, as base64 PNG"""
+    img = Image.open(io.BytesIO(base64.b64decode(image_base64)))
+    arr = cv2.resize(image_kernels.to_array(img), gpu_size(img.width, img.height, native), interpolation=cv2.INTER_AREA)
+    buffer = io.BytesIO()
+    image_kernels.from_array(arr).save(buffer, format="PNG", compress_level=1)
+    return base64.b64encode(buffer.getvalue()).decode()
@@ -0,0 +1,379 @@
+"""
+Resilience layer for calls from the gateway to the Modal FLUX.1-Kontext service
+Circuit breaker, bounded retries with jittered backoff, optional hedged
+requests and counters, all behind a single shared HTTP client, plus a
+traffic-driven pre-warmer for the scale-to-zero GPU container
+"""
+
+import asyncio
+import os
+import random
+import time
+from collections import Counter, deque
+from typing import Any, Dict, Optional
+
+import httpx
+
+# Failures that happen before the request reaches the model, so sending it
+# again cannot run the same inference twice
+RETRYABLE_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+RETRYABLE_STATUS = {429, 502, 503}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the upstream while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Classic three-state breaker
+
+    closed: calls pass; consecutive failures are counted
+    open: calls fail fast until reset_timeout has elapsed
+    half_open: a single probe call is let through; its outcome closes or
+        re-opens the circuit
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        """Whether a call may be made now"""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+        return self.state != self.OPEN
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def release_probe(self) -> None:
+        """Let another call probe when this one ended without an outcome, e.g. cancelled"""
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        """Seconds until the breaker will let a probe through"""
+        if self.state != self.OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+
+class ModalUpstream:
+    """Shared, instrumented client for the Modal web_app endpoint"""
+
+    def __init__(
+        self,
+        base_url: str,
+        timeout: float = None,
+        max_retries: int = None,
+        failure_threshold: int = None,
+        reset_timeout: float = None,
+        hedge_percentile: float = None,
+        hedge_min_samples: int = 20
+    ):
+        """
+        Args:
+            base_url: Modal web_app URL
+            timeout: Per-attempt read timeout in seconds
+            max_retries: Extra attempts for retryable failures
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds the circuit stays open before probing
+            hedge_percentile: Send a duplicate request once the first has
+                been outstanding longer than this latency percentile
+                (e.g. 95); 0 disables hedging
+            hedge_min_samples: Successful calls needed before hedging starts
+        """
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout if timeout is not None else float(os.getenv("UPSTREAM_TIMEOUT", "300"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("UPSTREAM_MAX_RETRIES", "2"))
+        self.hedge_percentile = (
+            hedge_percentile if hedge_percentile is not None
+            else float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "0"))
+        )
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = CircuitBreaker(
+            failure_threshold if failure_threshold is not None else int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "5")),
+            reset_timeout if reset_timeout is not None else float(os.getenv("UPSTREAM_RESET_TIMEOUT", "30"))
+        )
+        self.counters = Counter()
+        self.latencies = deque(maxlen=200)
+        self.last_success_at: Optional[float] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # httpx clients are bound to the event loop they were first used on
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(timeout=httpx.Timeout(self.timeout, connect=10.0))
+            self._client_loop = loop
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """Latency of recent successful calls at the given percentile, in seconds"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(10.0, 0.5 * 2 ** attempt))
+
+    async def _send(self, path: str, payload: Dict[str, Any]) -> httpx.Response:
+        return await self._get_client().post(f"{self.base_url}{path}", json=payload)
+
+    async def _send_hedged(self, path: str, payload: Dict[str, Any], hedge: bool = True) -> httpx.Response:
+        """Send once, and race a duplicate if the first is slower than usual"""
+        hedge_after = None
+        if hedge and self.hedge_percentile > 0 and len(self.latencies) >= self.hedge_min_samples:
+            hedge_after = self.latency_percentile(self.hedge_percentile)
+
+        primary = asyncio.ensure_future(self._send(path, payload))
+        if hedge_after is None:
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after)
+        if done:
+            return primary.result()
+
+        self.counters["hedges"] += 1
+        hedge = asyncio.ensure_future(self._send(path, payload))
+        pending = {primary, hedge}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    # Take the first usable answer; if both fail, surface the last one
+                    if task.exception() is None and task.result().status_code < 500:
+                        if task is hedge:
+                            self.counters["hedges_won"] += 1
+                        return task.result()
+                    if not pending:
+                        return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def post(self, path: str, payload: Dict[str, Any], probe: bool = False) -> httpx.Response:
+        """
+        POST to the upstream with circuit breaking, retries and hedging
+
+        Probe calls (warm-ups) are never hedged and are left out of the
+        latency samples, which describe generations.
+
+        Every exit after the breaker let the call through records an
+        outcome, or frees the half-open probe if the call was cancelled.
+
+        Raises:
+            CircuitOpenError: The circuit is open; nothing was sent
+            httpx.HTTPError: The last attempt failed at the transport level
+
+        Returns:
+            The upstream response; non-200 statuses are returned, not raised
+        """
+        self.counters["requests"] += 1
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self.counters["rejected"] += 1
+                raise CircuitOpenError(
+                    f"Modal upstream unavailable, retry in {self.breaker.retry_after():.0f}s"
+                )
+
+            self.counters["attempts"] += 1
+            started = time.monotonic()
+            try:
+                response = await self._send_hedged(path, payload, hedge=not probe)
+            except httpx.HTTPError as e:
+                self.breaker.record_failure()
+                self.counters["timeouts" if isinstance(e, httpx.TimeoutException) else "transport_errors"] += 1
+                if attempt < self.max_retries and isinstance(e, RETRYABLE_EXCEPTIONS):
+                    attempt += 1
+                    self.counters["retries"] += 1
+                    await asyncio.sleep(self._backoff(attempt))
+                    continue
+                raise
+            except asyncio.CancelledError:
+                # The caller went away (client disconnect, lost hedge race)
+                # before there was an outcome
+                self.breaker.release_probe()
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                self.counters["errors"] += 1
+                raise
+
+            if response.status_code >= 500 or response.status_code == 429:
+                self.breaker.record_failure()
+                self.counters["upstream_errors"] += 1
+                if attempt < self.max_retries and response.status_code in RETRYABLE_STATUS:
+                    attempt += 1
+                    self.counters["retries"] += 1
+                    await asyncio.sleep(self._backoff(attempt))
+                    continue
+                return response
+
+            self.breaker.record_success()
+            self.counters["successes"] += 1
+            if not probe:
+                self.latencies.append(time.monotonic() - started)
+            if response.status_code == 200:
+                # Only a 200 proves a FluxKontext container answered
+                self.last_success_at = time.monotonic()
+            return response
+
+    async def cancel(self, job_id: str) -> bool:
+        """
+        Ask FluxKontext to stop a job at its next denoising step
+
+        Best effort and outside the breaker: False if the request failed
+        or the deployed service doesn't support cancellation.
+        """
+        try:
+            response = await self._get_client().post(
+                f"{self.base_url}/cancel", json={"job_id": job_id}, timeout=10.0
+            )
+        except httpx.HTTPError as e:
+            print(f"Cancelling upstream job {job_id} failed: {str(e)}")
+            return False
+        self.counters["cancels_sent"] += 1
+        return response.status_code == 200
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of breaker state, counters and recent latency"""
+        return {
+            "circuit": self.breaker.state,
+            "retry_after": round(self.breaker.retry_after(), 1),
+            "counters": dict(self.counters),
+            "latency_p50": self.latency_percentile(50),
+            "latency_p95": self.latency_percentile(95),
+        }
+
+
+class Prewarmer:
+    """
+    Keeps the Modal FluxKontext container warm while the studio is in use
+
+    The container scales to zero after warm_window seconds without calls.
+    Traffic that predicts a generation soon, such as opening the studio or
+    uploading an image, calls note_activity(). If the upstream has not
+    answered recently enough to still be warm, a background call to the
+    /warmup route starts a container and loads the model, so the user's
+    first edit does not pay the cold start.
+    """
+
+    def __init__(
+        self,
+        upstream: ModalUpstream,
+        warm_window: float = None,
+        cold_start_threshold: float = 20.0
+    ):
+        """
+        Args:
+            upstream: Client the warm-up calls are sent through
+            warm_window: Seconds a container stays up after its last call;
+                defaults to MODAL_WARM_WINDOW and should not exceed the
+                class's scaledown window
+            cold_start_threshold: Warm-up calls slower than this are
+                recorded as cold starts
+        """
+        self.upstream = upstream
+        self.warm_window = warm_window if warm_window is not None else float(os.getenv("MODAL_WARM_WINDOW", "600"))
+        self.cold_start_threshold = cold_start_threshold
+        self.enabled = os.getenv("MODAL_PREWARM", "1") != "0"
+        self.last_activity_at: Optional[float] = None
+        self.last_cold_start: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self.counters = Counter()
+
+    def state(self) -> str:
+        """One of "warm", "warming", "cold" or "unavailable" """
+        if self.upstream.breaker.state == CircuitBreaker.OPEN:
+            return "unavailable"
+        if self._task is not None and not self._task.done():
+            return "warming"
+        last = self.upstream.last_success_at
+        if last is not None and time.monotonic() - last < self.warm_window:
+            return "warm"
+        return "cold"
+
+    def note_activity(self) -> None:
+        """Record user activity and warm the upstream if it may have scaled down"""
+        self.last_activity_at = time.monotonic()
+        if not self.enabled:
+            return
+
+        last = self.upstream.last_success_at
+        # Re-warm a little before the window closes, so that a studio
+        # session in progress does not see the container scale down
+        if last is not None and time.monotonic() - last < self.warm_window * 0.8:
+            return
+        if self._task is not None and not self._task.done():
+            return
+        if self.upstream.breaker.state == CircuitBreaker.OPEN:
+            return
+
+        self.counters["warmups"] += 1
+        self._task = asyncio.get_running_loop().create_task(self._warm())
+
+    async def _warm(self) -> None:
+        started = time.monotonic()
+        try:
+            response = await self.upstream.post("/warmup", {}, probe=True)
+        except Exception as e:
+            self.counters["warmup_failures"] += 1
+            print(f"Modal warm-up failed: {str(e)}")
+            return
+
+        elapsed = time.monotonic() - started
+        if response.status_code != 200:
+            self.counters["warmup_failures"] += 1
+            print(f"Modal warm-up failed: HTTP {response.status_code}")
+        elif elapsed >= self.cold_start_threshold:
+            self.counters["cold_starts"] += 1
+            self.last_cold_start = elapsed
+
+    def stats(self) -> Dict[str, Any]:
+        """Upstream warm/cold state and recent latency, for the readiness endpoint"""
+        now = time.monotonic()
+        last = self.upstream.last_success_at
+        return {
+            "state": self.state(),
+            "last_success_age": round(now - last, 1) if last is not None else None,
+            "last_activity_age": round(now - self.last_activity_at, 1) if self.last_activity_at is not None else None,
+            "last_cold_start": round(self.last_cold_start, 1) if self.last_cold_start is not None else None,
+            "latency_p50": self.upstream.latency_percentile(50),
+            "latency_p95": self.upstream.latency_percentile(95),
+            "circuit": self.upstream.breaker.state,
+            "counters": dict(self.counters),
+        }
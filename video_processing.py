@@ -0,0 +1,172 @@
+"""
+Post-processing for generated videos
+Stores each Kling MP4 once by content hash and derives a poster JPEG, a
+short low-resolution animated WebP preview and an optional smaller WebM
+rendition with OpenCV, in one decode pass, cached next to the source
+"""
+
+import io
+import os
+import re
+from typing import Dict, Optional
+
+import cv2
+from PIL import Image
+
+from asset_store import AssetStore
+
+POSTER_QUALITY = 85
+
+# The preview loops the start of the clip at a low frame rate
+PREVIEW_MAX_SIDE = 320
+PREVIEW_FPS = 8
+PREVIEW_SECONDS = 4.0
+PREVIEW_QUALITY = 60
+
+# VP8 WebM plays in every current browser and is available in the FFmpeg
+# build bundled with opencv-python, unlike H.264
+WEB_MAX_SIDE = 640
+WEB_FOURCC = "VP80"
+
+RENDITIONS = {
+    "original": ("mp4", "video/mp4"),
+    "poster": ("jpg", "image/jpeg"),
+    "preview": ("webp", "image/webp"),
+    "web": ("webm", "video/webm"),
+}
+
+_VIDEO_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _fit(width: int, height: int, max_side: int):
+    scale = min(1.0, max_side / max(width, height))
+    # Even dimensions keep video encoders happy
+    return max(2, int(width * scale) // 2 * 2), max(2, int(height * scale) // 2 * 2)
+
+
+class VideoStore(AssetStore):
+    """Content-addressed video cache with lazily rendered poster/preview/web renditions"""
+
+    def __init__(self, root: str = None, url_prefix: str = "/api/videos"):
+        # Videos are referenced by job records for good, so never evicted
+        super().__init__(
+            root or os.getenv("VIDEO_CACHE_DIR", os.path.join(".cache", "videos")),
+            url_prefix,
+            max_bytes=0
+        )
+
+    def _path(self, video_id: str, name: str) -> str:
+        ext = RENDITIONS[name][0]
+        if name == "original":
+            return os.path.join(self.root, video_id[:2], f"{video_id}.{ext}")
+        return os.path.join(self.root, video_id[:2], f"{video_id}_{name}.{ext}")
+
+    def urls(self, video_id: str, include_web: bool = False) -> Dict[str, str]:
+        names = [name for name in RENDITIONS if include_web or name != "web"]
+        return {name: f"{self.url_prefix}/{video_id}/{name}" for name in names}
+
+    def register(self, video_bytes: bytes, transcode: bool = False) -> Dict[str, object]:
+        """
+        Store a video, render its poster and preview (and web rendition if
+        requested), and return the reference block for its response
+        """
+        video_id = self.put(video_bytes)
+        self.render(video_id, ["poster", "preview"] + (["web"] if transcode else []))
+        return {"id": video_id, "renditions": self.urls(video_id, include_web=transcode)}
+
+    def render(self, video_id: str, names) -> None:
+        """Produce the missing renditions among `names` in a single pass over the frames"""
+        with self._locked(video_id):
+            missing = [name for name in names if not os.path.exists(self._path(video_id, name))]
+            if not missing:
+                return
+
+            capture = cv2.VideoCapture(self._path(video_id, "original"))
+            if not capture.isOpened():
+                raise ValueError(f"Cannot decode video {video_id}")
+            try:
+                self._render_frames(video_id, capture, missing)
+            finally:
+                capture.release()
+
+    def _render_frames(self, video_id: str, capture, missing) -> None:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 24.0
+        width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+        preview_frames = []
+        preview_size = _fit(width, height, PREVIEW_MAX_SIDE)
+        preview_step = max(1.0, fps / PREVIEW_FPS)
+        preview_limit = int(PREVIEW_SECONDS * fps)
+
+        writer = None
+        web_tmp = None
+        if "web" in missing:
+            web_size = _fit(width, height, WEB_MAX_SIDE)
+            web_path = self._path(video_id, "web")
+            # VideoWriter picks the container from the extension, so the
+            # temp file keeps it; renamed into place once complete
+            web_tmp = f"{web_path}.{os.getpid()}.tmp.webm"
+            writer = cv2.VideoWriter(web_tmp, cv2.VideoWriter_fourcc(*WEB_FOURCC), fps, web_size)
+            if not writer.isOpened():
+                print(f"WebM encoder unavailable, skipping web rendition of {video_id}")
+                writer = None
+
+        index = 0
+        next_preview = 0.0
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+
+                if index == 0 and "poster" in missing:
+                    ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, POSTER_QUALITY, cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+                    if ok:
+                        self._write_atomic(self._path(video_id, "poster"), lambda f: f.write(jpeg.tobytes()))
+
+                if "preview" in missing and index < preview_limit and index >= next_preview:
+                    small = cv2.resize(frame, preview_size, interpolation=cv2.INTER_AREA)
+                    preview_frames.append(Image.fromarray(cv2.cvtColor(small, cv2.COLOR_BGR2RGB)))
+                    next_preview += preview_step
+
+                if writer is not None:
+                    writer.write(cv2.resize(frame, web_size, interpolation=cv2.INTER_AREA))
+                elif index >= preview_limit:
+                    # The poster and preview only need the start of the clip
+                    break
+                index += 1
+        finally:
+            if writer is not None:
+                writer.release()
+
+        if writer is not None:
+            if os.path.exists(web_tmp) and os.path.getsize(web_tmp) > 0:
+                os.replace(web_tmp, self._path(video_id, "web"))
+            elif os.path.exists(web_tmp):
+                os.unlink(web_tmp)
+
+        if preview_frames:
+            buffer = io.BytesIO()
+            preview_frames[0].save(
+                buffer, format="WEBP", save_all=True, append_images=preview_frames[1:],
+                duration=int(1000 / PREVIEW_FPS), loop=0, quality=PREVIEW_QUALITY, method=4
+            )
+            self._write_atomic(self._path(video_id, "preview"), lambda f: f.write(buffer.getvalue()))
+
+    def rendition(self, video_id: str, name: str) -> Optional[str]:
+        """
+        Path to a rendition, rendering it on first request
+
+        Returns:
+            File path, or None if the video or rendition is unknown
+        """
+        if not _VIDEO_ID.match(video_id) or name not in RENDITIONS:
+            return None
+        if not os.path.exists(self._path(video_id, "original")):
+            return None
+
+        path = self._path(video_id, name)
+        if not os.path.exists(path):
+            self.render(video_id, [name])
+        return path if os.path.exists(path) else None